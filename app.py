@@ -5,15 +5,28 @@ Wazzup-Podio Integration Webhook Server
 """
 
 import os
+import hmac
 import json
 import logging
+from collections import deque
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, make_response
 from dotenv import load_dotenv
 
 from src.wazzup.webhook_handler import WazzupWebhookHandler
-from src.podio.client import PodioClient
+from src.wazzup.recorder import TrafficRecorder
+from src.podio.router import PodioRouter
+from src.delivery.pipeline import DeliveryPipeline
+from src.delivery.admission import AdmissionController, ACCEPT, SPOOL, REJECT
+from src.delivery.spool import WebhookSpool
+from src.delivery.lanes import LaneScheduler
+from src.storage.message_store import MessageStore
 from src.utils.logger import setup_logger
+from src.utils.profiling import profiler
+from src.utils.tracing import (
+    tracer, correlation_id_from_headers, get_correlation_id,
+    set_correlation_id, reset_correlation_id
+)
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -24,10 +37,38 @@ app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key')
 
 # Настройка логирования
 logger = setup_logger(__name__)
+setup_logger('src')
 
 # Инициализация клиентов
-podio_client = PodioClient()
+podio_router = PodioRouter()
 webhook_handler = WazzupWebhookHandler()
+delivery_pipeline = DeliveryPipeline(podio_router)
+delivery_scheduler = LaneScheduler(delivery_pipeline)
+delivery_pipeline.set_deferred_sink(delivery_scheduler.submit)
+
+# Локальная история сообщений для API чатов (отключается пустым MESSAGE_STORE_DB)
+message_store = MessageStore()
+
+# Запись реального трафика для воспроизведения (включается через TRAFFIC_RECORD_DIR)
+traffic_recorder = TrafficRecorder()
+
+# Контроль допуска и очередь отложенной доставки
+webhook_spool = WebhookSpool()
+spool_all_webhooks = os.getenv('SPOOL_ALL_WEBHOOKS', 'False').lower() == 'true'
+webhook_stream_window = max(1, int(os.getenv('WEBHOOK_STREAM_WINDOW', 64)))
+admission_controller = AdmissionController()
+# Задержка фоновых полос (эхо, статусы) не должна приводить к отказу в приеме
+admission_controller.add_backlog_source(
+    'lanes', lambda: delivery_scheduler.oldest_age(delivery_scheduler.await_lanes)
+)
+# Доставки в работе - события ожидаемых полос (в очереди и доставляемые), а не только потоки запросов
+admission_controller.add_load_source(
+    'lanes', lambda: delivery_scheduler.pending(delivery_scheduler.await_lanes)
+)
+if webhook_spool.enabled:
+    admission_controller.add_backlog_source('spool', webhook_spool.oldest_age)
+    # События, не доставленные из полос до остановки воркера, дожидаются обработчика очереди
+    delivery_scheduler.set_spill(webhook_spool.put_items)
 
 @app.route('/', methods=['GET'])
 def health_check():
@@ -45,9 +86,53 @@ def wazzup_webhook():
     Обработчик вебхуков от Wazzup
     Принимает сообщения и передает их в Podio
     """
+    # Идентификатор корреляции сопровождает события вебхука до Podio
+    correlation_token = set_correlation_id(correlation_id_from_headers(request.headers))
+    try:
+        with tracer.span('webhook.receive', content_length=request.content_length):
+            response = make_response(_receive_wazzup_webhook())
+        response.headers['X-Correlation-ID'] = get_correlation_id()
+        return response
+    finally:
+        reset_correlation_id(correlation_token)
+
+def _receive_wazzup_webhook():
+    """Прием вебхука: контроль допуска и выбор режима обработки"""
+    # Большие пачки разбираются потоком, без загрузки всего тела в память
+    streaming = _is_streaming_request()
+    
+    if traffic_recorder.enabled and not streaming:
+        traffic_recorder.record(
+            request.get_data(),
+            {'X-Wazzup-Signature': request.headers.get('X-Wazzup-Signature', '')}
+        )
+    
+    # Доставка целиком в обработчиках шардов (scripts/shard_worker.py): сервер только принимает вебхуки
+    if spool_all_webhooks:
+        response = _spool_webhook_stream() if streaming else _spool_webhook()
+        if response is not None:
+            return response
+    
+    # Контроль допуска: при перегрузке не берем работу, которую не успеем выполнить
+    admission = admission_controller.decide()
+    if admission['action'] != ACCEPT:
+        return _shed_webhook(admission)
+    
+    profile_token = profiler.start_request('wazzup')
+    try:
+        if streaming:
+            return _process_wazzup_webhook_stream()
+        return _process_wazzup_webhook()
+    finally:
+        profiler.finish_request(profile_token)
+        admission_controller.release(admission['token'])
+
+def _process_wazzup_webhook():
+    """Синхронная обработка вебхука и доставка в Podio"""
     try:
         # Получение данных из запроса
-        data = request.get_json()
+        with profiler.stage('parse'), tracer.span('webhook.parse'):
+            data = request.get_json()
         
         if not data:
             logger.warning("Получен пустой запрос")
@@ -61,26 +146,30 @@ def wazzup_webhook():
             return jsonify({'error': 'Invalid webhook'}), 401
         
         # Обработка вебхука
-        processed_items = webhook_handler.process_webhook(data)
+        with profiler.stage('process_webhook'):
+            processed_items = webhook_handler.process_webhook(data)
+        
+        with profiler.stage('store'):
+            message_store.add_events(processed_items)
         
         if processed_items:
-            results = []
-            for item in processed_items:
-                # Отправка в Podio
-                result = podio_client.create_message_item(item)
-                
-                if result:
-                    logger.info(f"Элемент успешно отправлен в Podio: {result}")
-                    results.append(result)
-                else:
-                    logger.error("Ошибка отправки элемента в Podio")
+            # Отправка в Podio через приоритетные полосы: входящие сообщения ждем,
+            # эхо и статусы доставляются в фоне
+            results, queued, dropped = delivery_scheduler.deliver_batch(processed_items)
             
-            if results:
-                return jsonify({
+            if dropped:
+                # Иначе часть событий была бы потеряна: вебхук повторяется целиком, доставленные сообщения пропускаются как повторы
+                return _delivery_unavailable(dropped)
+            
+            if results or queued:
+                response = {
                     'status': 'success',
                     'message': f'Processed {len(results)} items and sent to Podio',
                     'podio_items': results
-                })
+                }
+                if queued:
+                    response['queued_items_count'] = queued
+                return jsonify(response)
             else:
                 return jsonify({'error': 'Failed to send any items to Podio'}), 500
         else:
@@ -91,6 +180,189 @@ def wazzup_webhook():
         logger.error(f"Ошибка обработки вебхука: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def _is_streaming_request() -> bool:
+    """Потоковый режим для тел больше WEBHOOK_STREAMING_THRESHOLD (и тел без Content-Length)"""
+    threshold = int(os.getenv('WEBHOOK_STREAMING_THRESHOLD', 1024 * 1024))
+    if threshold <= 0:
+        return False
+    return request.content_length is None or request.content_length > threshold
+
+def _buffer_webhook_body():
+    """
+    Буферизация большого тела во временный файл (на диск при большом размере) с проверкой подписи
+    Возвращает файл, открытый на начале, или None при неверной подписи
+    """
+    signature = request.headers.get('X-Wazzup-Signature', '')
+    body = webhook_handler.buffer_body(request.stream, signature)
+    
+    if body is not None and traffic_recorder.enabled:
+        traffic_recorder.record_stream(body, {'X-Wazzup-Signature': signature})
+        body.seek(0)
+    
+    return body
+
+def _spool_buffered_body(body, events_count: int):
+    """Запись проверенного большого тела в спул; None, если спул недоступен или запись не удалась"""
+    headers = {'X-Wazzup-Signature': request.headers.get('X-Wazzup-Signature', '')}
+    if not webhook_spool.enabled or not webhook_spool.put_stream(body, headers, get_correlation_id()):
+        body.seek(0)
+        return None
+    
+    return jsonify({
+        'status': 'accepted',
+        'message': 'Webhook spooled for deferred delivery',
+        'queued_items_count': events_count
+    }), 202
+
+def _process_wazzup_webhook_stream():
+    """
+    Потоковая обработка большого вебхука
+    Тело проверяется целиком до ответа; при настроенном спуле ответ дается после записи в спул,
+    иначе события доставляются по мере разбора
+    """
+    try:
+        with profiler.stage('parse'), tracer.span('webhook.buffer'):
+            body = _buffer_webhook_body()
+        
+        if body is None:
+            logger.error("Ошибка валидации вебхука")
+            return jsonify({'error': 'Invalid webhook'}), 401
+        
+        with body:
+            # Обрезанное или некорректное тело отклоняется до доставки первого события
+            with profiler.stage('parse'), tracer.span('webhook.validate'):
+                events_count = webhook_handler.count_stream_events(body)
+                body.seek(0)
+            
+            if not events_count:
+                logger.warning("Вебхук не содержал обрабатываемых данных")
+                return jsonify({'status': 'ignored', 'message': 'No processable data in webhook'})
+            
+            logger.info(f"Получен большой вебхук от Wazzup, событий: {events_count}")
+            
+            response = _spool_buffered_body(body, events_count)
+            if response is not None:
+                return response
+            
+            queued = 0
+            rejected = []
+            # События в полосах, доставки которых еще ждем: разбор идет со скоростью доставки,
+            # и в памяти не больше WEBHOOK_STREAM_WINDOW событий пачки
+            window = deque()
+            events = message_store.record_stream(webhook_handler.process_webhook_stream(body))
+            while True:
+                with profiler.stage('process_webhook'):
+                    item = next(events, None)
+                if item is None:
+                    break
+                
+                future = delivery_scheduler.submit(item, block=True)
+                if future is None:
+                    # Полосы остановлены (воркер завершается): остаток сохраняется в spill частями
+                    rejected.append(item)
+                    if len(rejected) >= webhook_stream_window:
+                        if not delivery_scheduler.spill_items(rejected):
+                            return _delivery_unavailable(len(rejected))
+                        queued += len(rejected)
+                        rejected = []
+                    continue
+                
+                queued += 1
+                window.append(future)
+                if len(window) >= webhook_stream_window:
+                    window.popleft().result()
+        
+        if rejected:
+            if not delivery_scheduler.spill_items(rejected):
+                return _delivery_unavailable(len(rejected))
+            queued += len(rejected)
+        
+        if not queued:
+            logger.warning("Вебхук не содержал обрабатываемых данных")
+            return jsonify({'status': 'ignored', 'message': 'No processable data in webhook'})
+        
+        # В потоковом режиме результаты не накапливаются, возвращается только счетчик
+        return jsonify({
+            'status': 'success',
+            'message': f'Queued {queued} items for delivery to Podio',
+            'queued_items_count': queued
+        })
+    
+    except ValueError as e:
+        logger.error(f"Некорректное тело большого вебхука: {str(e)}")
+        return jsonify({'error': 'Malformed JSON body'}), 400
+    
+    except Exception as e:
+        logger.error(f"Ошибка потоковой обработки вебхука: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def _delivery_unavailable(dropped: int):
+    """Ответ 503, когда события не удалось ни поставить в полосы, ни сохранить: Wazzup повторит вебхук"""
+    logger.error(f"Вебхук не принят: {dropped} событий не поставлено в полосы доставки")
+    response = jsonify({'error': 'Delivery queue unavailable', 'dropped_items_count': dropped})
+    response.headers['Retry-After'] = str(admission_controller.retry_after)
+    return response, 503
+
+def _shed_webhook(admission):
+    """Быстрый путь при перегрузке: запись в спул или отказ с Retry-After"""
+    reason = admission['reason']
+    
+    if admission['action'] == SPOOL:
+        response = _spool_webhook_stream() if _is_streaming_request() else _spool_webhook()
+        if response is not None:
+            if response[1] == 202:
+                admission_controller.record_shed(SPOOL, reason)
+            return response
+    
+    admission_controller.record_shed(REJECT, reason)
+    response = jsonify({'error': 'Service overloaded', 'reason': reason})
+    response.headers['Retry-After'] = str(admission_controller.retry_after)
+    return response, 503
+
+def _spool_webhook():
+    """Запись вебхука в спул для отложенной доставки; None, если спул недоступен"""
+    if not webhook_spool.enabled:
+        return None
+    
+    # В спул попадают только вебхуки с корректной подписью
+    if not webhook_handler.validate_webhook(request):
+        logger.error("Ошибка валидации вебхука")
+        return jsonify({'error': 'Invalid webhook'}), 401
+    
+    headers = {'X-Wazzup-Signature': request.headers.get('X-Wazzup-Signature', '')}
+    if not webhook_spool.put(request.get_data(), headers, get_correlation_id()):
+        return None
+    
+    return jsonify({
+        'status': 'accepted',
+        'message': 'Webhook spooled for deferred delivery'
+    }), 202
+
+def _spool_webhook_stream():
+    """Запись большого вебхука в спул без загрузки тела в память; None, если спул недоступен"""
+    if not webhook_spool.enabled:
+        return None
+    
+    body = _buffer_webhook_body()
+    if body is None:
+        logger.error("Ошибка валидации вебхука")
+        return jsonify({'error': 'Invalid webhook'}), 401
+    
+    with body:
+        try:
+            events_count = webhook_handler.count_stream_events(body)
+            body.seek(0)
+        except ValueError as e:
+            logger.error(f"Некорректное тело большого вебхука: {str(e)}")
+            return jsonify({'error': 'Malformed JSON body'}), 400
+        
+        response = _spool_buffered_body(body, events_count)
+        if response is None:
+            # Тело уже прочитано из запроса - обработать его напрямую нельзя
+            return jsonify({'error': 'Failed to spool webhook'}), 500
+    
+    return response
+
 @app.route('/webhook/test', methods=['POST'])
 def test_webhook():
     """Тестовый эндпоинт для проверки работы вебхука"""
@@ -113,14 +385,30 @@ def test_webhook():
 def status():
     """Статус интеграции и подключений"""
     try:
-        # Проверка подключения к Podio
-        podio_status = podio_client.check_connection()
+        # Проверка подключения ко всем приложениям Podio
+        podio_apps = podio_router.check_connections()
+        podio_status = all(podio_apps.values())
         
         return jsonify({
             'service': 'Wazzup-Podio Integration',
             'status': 'running',
             'connections': {
-                'podio': 'connected' if podio_status else 'disconnected'
+                'podio': 'connected' if podio_status else 'disconnected',
+                'podio_apps': {
+                    name: 'connected' if connected else 'disconnected'
+                    for name, connected in podio_apps.items()
+                }
+            },
+            'podio_limits': podio_router.get_stats(),
+            'traffic_recorder': traffic_recorder.get_stats(),
+            'delivery': delivery_pipeline.get_stats(),
+            'delivery_lanes': delivery_scheduler.get_stats(),
+            'message_store': message_store.get_stats(),
+            'admission': admission_controller.get_stats(),
+            'spool': {
+                'enabled': webhook_spool.enabled,
+                'depth': webhook_spool.depth(),
+                'oldest_age': round(webhook_spool.oldest_age(), 3)
             },
             'timestamp': datetime.utcnow().isoformat()
         })
@@ -129,6 +417,65 @@ def status():
         logger.error(f"Ошибка проверки статуса: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def _is_admin_request(*extra_tokens: str) -> bool:
+    """Проверка токена администратора (X-Admin-Token) или одного из дополнительных токенов"""
+    provided = request.headers.get('X-Admin-Token', '')
+    tokens = [os.getenv('ADMIN_TOKEN', '')] + [token for token in extra_tokens if token]
+    return any(token and hmac.compare_digest(provided, token) for token in tokens)
+
+@app.route('/chats/<chat_id>/messages', methods=['GET'])
+def chat_messages(chat_id):
+    """
+    История чата из локального хранилища, от новых сообщений к старым
+    Параметры: limit, cursor (next_cursor предыдущей страницы), q - полнотекстовый поиск
+    """
+    if not _is_admin_request(os.getenv('HISTORY_API_TOKEN', '')):
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    if not message_store.enabled:
+        return jsonify({'error': 'Message store is disabled'}), 404
+    
+    try:
+        page = message_store.get_chat_messages(
+            chat_id,
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor'),
+            query=request.args.get('q')
+        )
+        return jsonify({'chat_id': chat_id, **page})
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    except Exception as e:
+        logger.error(f"Ошибка чтения истории чата {chat_id}: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/admin/profiling', methods=['GET', 'POST', 'DELETE'])
+def admin_profiling():
+    """
+    Управление профилированием вебхуков
+    POST {"percent": 10, "duration_seconds": 300} - включить, DELETE - выключить
+    """
+    if not _is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    try:
+        if request.method == 'POST':
+            params = request.get_json(silent=True) or {}
+            profiler.enable(
+                percent=float(params.get('percent', 100)),
+                duration=params.get('duration_seconds')
+            )
+        elif request.method == 'DELETE':
+            profiler.disable()
+        
+        return jsonify(profiler.get_stats())
+    
+    except Exception as e:
+        logger.error(f"Ошибка управления профилированием: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
 @app.errorhandler(404)
 def not_found(error):
     """Обработчик 404 ошибок"""
@@ -0,0 +1,52 @@
+"""
+Конфигурация gunicorn для вебхук-сервера
+Приложение загружается в мастере один раз (preload), воркеры получают его через fork.
+Сокеты и токены Podio, потоки доставки и соединения SQLite создаются в каждом воркере после fork.
+"""
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Нагрузка ограничена ожиданием Podio, поэтому несколько процессов с потоками (gthread)
+# обслуживают больше одновременных вебхуков, чем синхронные воркеры
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+# При threads > 1 gunicorn сам заменяет sync на gthread
+threads = int(os.getenv('GUNICORN_THREADS', 8 if worker_class == 'gthread' else 1))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+def when_ready(server):
+    """Объекты, созданные при загрузке приложения, не попадают в сборку мусора воркеров (меньше копирования страниц)"""
+    if preload_app:
+        gc.freeze()
+
+def post_worker_init(worker):
+    """Получение токенов Podio в фоне, не задерживая готовность воркера"""
+    import threading
+    from app import podio_router
+    
+    if os.getenv('PODIO_WARMUP', 'True').lower() == 'true':
+        threading.Thread(target=podio_router.warm_up, name='podio-warmup', daemon=True).start()
+    worker.log.info(f"Воркер {worker.pid} готов")
+
+def worker_exit(server, worker):
+    """
+    Доставка событий из полос, запись отложенных правок и выпуск буфера переупорядочивания
+    при остановке воркера; недоставленный остаток полос записывается в спул (SPOOL_DIR)
+    """
+    import time
+    from app import delivery_pipeline, delivery_scheduler
+    
+    # Все этапы укладываются в DELIVERY_DRAIN_TIMEOUT (меньше graceful_timeout)
+    deadline = time.monotonic() + delivery_scheduler.drain_timeout
+    delivery_scheduler.drain()
+    # Правки и выпущенные события могут снова попасть в полосы
+    delivery_pipeline.close()
+    spilled = delivery_scheduler.close(max(0.0, deadline - time.monotonic()))
+    worker.log.info(f"Воркер {worker.pid} остановлен, недоставленных событий в полосах: {spilled}")
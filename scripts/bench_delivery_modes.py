@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк режимов доставки на локальной заглушке Podio API
+Сравнивает число запросов к Podio на сообщение и время доставки:
+comment (элемент + комментарий), embedded, embedded с отложенным комментарием
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+
+from podio_standin import PodioStandin, make_handler
+
+MODES = (
+    ('comment', {'PODIO_DELIVERY_MODE': 'comment', 'PODIO_DEFERRED_COMMENT': 'false'}),
+    ('embedded', {'PODIO_DELIVERY_MODE': 'embedded', 'PODIO_DEFERRED_COMMENT': 'false'}),
+    ('embedded+deferred', {'PODIO_DELIVERY_MODE': 'embedded', 'PODIO_DEFERRED_COMMENT': 'true'}),
+)
+
+def make_message(i: int):
+    return {
+        'source': 'wazzup',
+        'event_type': 'message',
+        'message_id': f'bench-{i}',
+        'chat_id': '79290000000',
+        'chat_type': 'whatsapp',
+        'contact_name': 'Клиент',
+        'message_text': 'Здравствуйте! Хочу уточнить детали заказа.',
+        'message_type': 'text',
+        'timestamp': '2024-01-01T12:00:00',
+        'direction': 'inbound'
+    }
+
+def run_mode(env, messages: int, tmp_dir: str):
+    os.environ.update(env)
+    
+    from src.podio.router import PodioRouter
+    from src.delivery.pipeline import DeliveryPipeline
+    from src.delivery.lanes import LaneScheduler
+    from src.storage.item_map import MessageItemMap
+    
+    pipeline = DeliveryPipeline(PodioRouter(), MessageItemMap(os.path.join(tmp_dir, f"{env['PODIO_DELIVERY_MODE']}-{env['PODIO_DEFERRED_COMMENT']}.db")))
+    scheduler = LaneScheduler(pipeline, workers=1)
+    pipeline.set_deferred_sink(scheduler.submit)
+    
+    latencies = []
+    for i in range(messages):
+        started = time.perf_counter()
+        pipeline.deliver(make_message(i))
+        latencies.append(time.perf_counter() - started)
+    
+    # Отложенные комментарии дожидаются завершения, чтобы посчитать все запросы
+    while any(lane['depth'] for lane in scheduler.get_stats().values()):
+        time.sleep(0.05)
+    time.sleep(0.2)
+    
+    return sum(latencies) / len(latencies)
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Бенчмарк режимов доставки в Podio')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка заглушки Podio (сек)')
+    args = parser.parse_args()
+    
+    logging.disable(logging.ERROR)
+    
+    standin = PodioStandin(args.latency, 0.0, 0.0)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(standin))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    os.environ.update({
+        'PODIO_API_URL': f'http://127.0.0.1:{server.server_port}',
+        'PODIO_CLIENT_ID': 'bench', 'PODIO_CLIENT_SECRET': 'bench',
+        'PODIO_APP_ID': '1', 'PODIO_APP_TOKEN': 'bench',
+        'PODIO_RATE_LIMIT_PER_HOUR': '0', 'EDIT_DEBOUNCE_SECONDS': '0'
+    })
+    
+    print(f"{'режим':<20} {'запросов/сообщение':>19} {'в пути доставки':>16} {'доставка, мс':>13}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, env in MODES:
+            before = dict(standin.calls)
+            latency = run_mode(env, args.messages, tmp_dir)
+            calls = {key: standin.calls[key] - before.get(key, 0) for key in standin.calls}
+            
+            total = calls.get('create_item', 0) + calls.get('create_comment', 0)
+            inline = total if name == 'comment' else calls.get('create_item', 0)
+            print(f"{name:<20} {total / args.messages:>19.2f} {inline / args.messages:>16.2f} {latency * 1000:>13.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк потоковой обработки больших вебхуков
+Сравнивает пиковую память и время на пачках из 1k, 10k и 50k событий:
+разбор json.loads + process_webhook против process_webhook_stream и полные пути
+большого вебхука - эндпоинт без спула (доставка через полосы), эндпоинт со спулом (ответ 202),
+обработчик очереди (drain_spool) и обработчик шардов (shard_worker).
+Podio заменен счетчиком доставок: замеряется память и время самой обработки
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+
+from src.wazzup.webhook_handler import WazzupWebhookHandler
+
+class CountingPipeline:
+    """Доставка без Podio: считает события"""
+    
+    def __init__(self):
+        self.delivered = 0
+    
+    def app_for(self, item):
+        return 'default'
+    
+    def has_capacity(self, app_name, in_use):
+        return True
+    
+    def deliver(self, item):
+        self.delivered += 1
+        return {'message_id': item.get('message_id')}
+    
+    def deliver_stream(self, items):
+        for item in items:
+            self.deliver(item)
+        return self.delivered, True
+    
+    def deliver_in_order(self, items):
+        return self.deliver_stream(items)[0]
+    
+    def close(self):
+        pass
+
+def write_payload(path: str, events: int) -> int:
+    """Генерация вебхука: 80% сообщений, 20% статусов"""
+    messages = int(events * 0.8)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"messages": [')
+        for i in range(messages):
+            if i:
+                f.write(',')
+            json.dump({
+                'messageId': f'00000000-0000-4000-8000-{i:012d}',
+                'channelId': 'c0ffee00-0000-4000-8000-000000000001',
+                'chatType': 'whatsgroup',
+                'chatId': f'7929{i % 500:07d}',
+                'dateTime': '2024-01-01T12:00:00.000',
+                'type': 'text',
+                'isEcho': False,
+                'text': 'Сообщение из рассылки ' * 4,
+                'status': 'inbound',
+                'contact': {'name': f'Контакт {i}', 'phone': f'7929{i:07d}'}
+            }, f, ensure_ascii=False)
+        f.write('], "statuses": [')
+        for i in range(events - messages):
+            if i:
+                f.write(',')
+            json.dump({
+                'messageId': f'00000000-0000-4000-8000-{i:012d}',
+                'timestamp': '2024-01-01T12:00:01.000',
+                'status': 'delivered'
+            }, f)
+        f.write(']}')
+    return os.path.getsize(path)
+
+def run_list_mode(handler: WazzupWebhookHandler, path: str) -> int:
+    with open(path, 'rb') as f:
+        data = json.loads(f.read())
+    items = handler.process_webhook(data)
+    delivered = 0
+    for item in items:
+        delivered += 1
+    return delivered
+
+def run_stream_mode(handler: WazzupWebhookHandler, path: str) -> int:
+    delivered = 0
+    with open(path, 'rb') as f:
+        for item in handler.process_webhook_stream(f):
+            delivered += 1
+    return delivered
+
+def post_webhook(app_module, path: str, size: int):
+    with open(path, 'rb') as f:
+        response = app_module.app.test_client().post(
+            '/webhook/wazzup', input_stream=f, content_length=size, content_type='application/json'
+        )
+    return response.get_json()
+
+def run_endpoint_mode(app_module, path: str) -> int:
+    """Эндпоинт без спула: события доставляются через полосы по мере разбора"""
+    pipeline = CountingPipeline()
+    app_module.delivery_scheduler.pipeline = pipeline
+    app_module.webhook_spool = app_module.WebhookSpool('')
+    result = post_webhook(app_module, path, os.path.getsize(path))
+    app_module.delivery_scheduler.drain(60)
+    assert pipeline.delivered == result['queued_items_count']
+    return pipeline.delivered
+
+def run_spool_mode(app_module, spool, path: str) -> int:
+    """Эндпоинт со спулом: проверка тела, копия в спул и ответ 202"""
+    app_module.webhook_spool = spool
+    return post_webhook(app_module, path, os.path.getsize(path))['queued_items_count']
+
+def run_drain_mode(drain_spool, spool, handler: WazzupWebhookHandler, store) -> int:
+    """Обработчик очереди: потоковая доставка вебхука из спула"""
+    pipeline = CountingPipeline()
+    drain_spool.drain(spool, handler, pipeline, store)
+    return pipeline.delivered
+
+def run_shard_mode(spool, handler: WazzupWebhookHandler, store) -> int:
+    """Обработчик шардов: раскладка вебхука по файлам шардов и их доставка"""
+    from src.delivery.shards import ShardWorker
+    
+    pipeline = CountingPipeline()
+    worker = ShardWorker(spool, handler, pipeline, store, worker_id='bench', lease_ttl=30)
+    try:
+        while worker.run_once(max_files=1000):
+            pass
+    finally:
+        worker.stop()
+    return pipeline.delivered
+
+def measure(func, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = func(*args)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Бенчмарк потоковой обработки вебхуков')
+    parser.add_argument('--sizes', default='1000,10000,50000', help='размеры пачек через запятую')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Сервер и обработчики работают на временных базах; Podio не вызывается
+        os.environ.update({
+            'MESSAGE_STORE_DB': os.path.join(tmp_dir, 'messages.db'),
+            'MESSAGE_MAP_DB': os.path.join(tmp_dir, 'message_map.db'),
+            'SPOOL_DIR': '',
+            'SPOOL_ALL_WEBHOOKS': 'False',
+            'TRAFFIC_RECORD_DIR': '',
+            'WAZZUP_WEBHOOK_SECRET': '',
+            # Потоковый путь для пачек любого размера
+            'WEBHOOK_STREAMING_THRESHOLD': '1',
+            'ADMISSION_MAX_IN_FLIGHT': '0',
+            'ADMISSION_MAX_BACKLOG_AGE': '0'
+        })
+        import app as app_module
+        import drain_spool
+        from src.delivery.spool import WebhookSpool
+        
+        # Логирование каждого сообщения не должно влиять на замер
+        logging.disable(logging.WARNING)
+        handler = WazzupWebhookHandler()
+        store = app_module.message_store
+        
+        print(f"{'событий':>8} {'тело, МБ':>9} {'режим':>9} {'пик памяти, МБ':>15} {'время, с':>9}")
+        for events in (int(size) for size in args.sizes.split(',')):
+            path = os.path.join(tmp_dir, f'payload-{events}.json')
+            size = write_payload(path, events)
+            spool = WebhookSpool(os.path.join(tmp_dir, f'spool-{events}'))
+            
+            modes = (
+                ('list', run_list_mode, (handler, path)),
+                ('stream', run_stream_mode, (handler, path)),
+                ('endpoint', run_endpoint_mode, (app_module, path)),
+                ('spool', run_spool_mode, (app_module, spool, path)),
+                ('drain', run_drain_mode, (drain_spool, spool, handler, store)),
+                ('spool', run_spool_mode, (app_module, spool, path)),
+                ('shards', run_shard_mode, (spool, handler, store))
+            )
+            for mode, func, func_args in modes:
+                count, elapsed, peak = measure(func, *func_args)
+                assert count == events, f"{mode}: {count} != {events}"
+                print(f"{events:>8} {size / 2**20:>9.1f} {mode:>9} {peak / 2**20:>15.1f} {elapsed:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Обработчик очереди отложенных вебхуков
+Забирает вебхуки из SPOOL_DIR и доставляет их в Podio
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from itertools import islice
+from typing import Dict, Any
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.wazzup.webhook_handler import WazzupWebhookHandler
+from src.podio.router import PodioRouter
+from src.delivery.pipeline import DeliveryPipeline
+from src.delivery.spool import WebhookSpool
+from src.storage.message_store import MessageStore
+from src.utils.logger import setup_logger
+from src.utils.tracing import tracer, correlation_scope
+
+# Загрузка переменных окружения
+load_dotenv()
+
+logger = setup_logger('drain_spool')
+setup_logger('src')
+
+def deliver_body(spool: WebhookSpool, record: Dict[str, Any], handler: WazzupWebhookHandler,
+                 pipeline: DeliveryPipeline, store: MessageStore) -> bool:
+    """
+    Потоковая доставка большого вебхука из bodies; False, если он возвращен в очередь
+    Повторная попытка пропускает события, доставленные предыдущими
+    """
+    name = record['name']
+    skipped = record.get('delivered', 0)
+    with spool.open_body(record) as body:
+        events = handler.process_webhook_stream(body)
+        deque(islice(events, skipped), maxlen=0)
+        # История сохраняется от места остановки: уже переданные события записываются и при ошибке доставки
+        recorded = store.record_stream(events)
+        delivered, finished = pipeline.deliver_stream(recorded)
+        recorded.close()
+    
+    logger.info(f"Вебхук {name} обработан: доставлено {skipped + delivered} событий")
+    if not finished:
+        spool.retry(record, delivered=delivered)
+        return False
+    return True
+
+def drain(spool: WebhookSpool, handler: WazzupWebhookHandler, pipeline: DeliveryPipeline,
+          store: MessageStore) -> int:
+    """Обработка всех вебхуков, накопившихся в очереди"""
+    processed = 0
+    
+    while True:
+        record = spool.claim_next()
+        if record is None:
+            return processed
+        
+        name = record['name']
+        with correlation_scope(record.get('correlation_id')):
+            tracer.record_span('spool.wait', record['received_at'], time.time(), spool_file=name)
+            try:
+                if record.get('items') is None and record.get('body_file'):
+                    # Большой вебхук: события разбираются и доставляются по одному, без загрузки пачки в память
+                    if not deliver_body(spool, record, handler, pipeline, store):
+                        continue
+                    spool.complete(name)
+                    processed += 1
+                    continue
+                
+                # При повторной попытке в файле остаются только недоставленные события
+                items = record.get('items')
+                if items is None:
+                    items = handler.process_webhook(json.loads(record['body']))
+                    store.add_events(items)
+                
+                delivered = pipeline.deliver_in_order(items)
+                logger.info(f"Вебхук {name} обработан: доставлено {delivered} из {len(items)}")
+                if delivered < len(items):
+                    spool.retry(record, items[delivered:])
+                    continue
+                spool.complete(name)
+                processed += 1
+            except Exception as e:
+                logger.error(f"Ошибка обработки вебхука {name} из очереди: {str(e)}")
+                spool.fail(name)
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Доставка отложенных вебхуков из спула')
+    parser.add_argument('--once', action='store_true', help='обработать очередь и выйти')
+    parser.add_argument('--interval', type=float, default=1.0, help='пауза при пустой очереди (сек)')
+    args = parser.parse_args()
+    
+    spool = WebhookSpool()
+    if not spool.enabled:
+        logger.error("SPOOL_DIR не настроен")
+        sys.exit(1)
+    
+    handler = WazzupWebhookHandler()
+    pipeline = DeliveryPipeline(PodioRouter())
+    store = MessageStore()
+    
+    logger.info(f"Запуск обработчика очереди {spool.spool_dir}")
+    
+    while True:
+        spool.recover()
+        drain(spool, handler, pipeline, store)
+        
+        if args.once:
+            pipeline.close()
+            break
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
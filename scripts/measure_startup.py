@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Замер запуска gunicorn и пропускной способности вебхуков на локальной заглушке Podio API
+Для каждой конфигурации: время до готовности всех воркеров, задержка первого вебхука,
+число аутентификаций в Podio и задержка под параллельной нагрузкой
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+
+from podio_standin import PodioStandin, make_handler
+
+# Исходный запуск (gunicorn app:app) - один синхронный воркер без preload
+CONFIGS = (
+    ('sync 1, без preload', {'GUNICORN_WORKER_CLASS': 'sync', 'WEB_CONCURRENCY': '1', 'GUNICORN_THREADS': '1', 'GUNICORN_PRELOAD': 'false'}),
+    ('sync 4, без preload', {'GUNICORN_WORKER_CLASS': 'sync', 'WEB_CONCURRENCY': '4', 'GUNICORN_THREADS': '1', 'GUNICORN_PRELOAD': 'false'}),
+    ('sync 4, preload', {'GUNICORN_WORKER_CLASS': 'sync', 'WEB_CONCURRENCY': '4', 'GUNICORN_THREADS': '1', 'GUNICORN_PRELOAD': 'true'}),
+    ('gthread 2x4, preload', {'GUNICORN_WORKER_CLASS': 'gthread', 'WEB_CONCURRENCY': '2', 'GUNICORN_THREADS': '4', 'GUNICORN_PRELOAD': 'true'}),
+    ('gthread 2x8, preload', {'GUNICORN_WORKER_CLASS': 'gthread', 'WEB_CONCURRENCY': '2', 'GUNICORN_THREADS': '8', 'GUNICORN_PRELOAD': 'true'}),
+    ('gthread 4x8, preload', {'GUNICORN_WORKER_CLASS': 'gthread', 'WEB_CONCURRENCY': '4', 'GUNICORN_THREADS': '8', 'GUNICORN_PRELOAD': 'true'}),
+    ('gthread 2x16, preload', {'GUNICORN_WORKER_CLASS': 'gthread', 'WEB_CONCURRENCY': '2', 'GUNICORN_THREADS': '16', 'GUNICORN_PRELOAD': 'true'}),
+)
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def make_webhook(i: int) -> bytes:
+    return json.dumps({
+        'messages': [{
+            'messageId': f'startup-{time.time_ns()}-{i}',
+            'chatId': f'7929000{i % 1000:04d}',
+            'chatType': 'whatsapp',
+            'type': 'text',
+            'text': 'Здравствуйте! Хочу уточнить детали заказа.',
+            'dateTime': '2024-01-01T12:00:00',
+            'contact': {'name': 'Клиент'}
+        }]
+    }, ensure_ascii=False).encode('utf-8')
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def run_config(env, args, tmp_dir: str, standin: PodioStandin):
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    workers = int(env['WEB_CONCURRENCY'])
+    oauth_before = standin.calls['oauth']
+    
+    ready = []
+    started = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '--config', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}'],
+        cwd=ROOT, env=dict(os.environ, **env, MESSAGE_MAP_DB=os.path.join(tmp_dir, f'map-{port}.db'),
+                           MESSAGE_STORE_DB=os.path.join(tmp_dir, f'messages-{port}.db')),
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    
+    def read_log():
+        for line in process.stderr:
+            if 'готов' in line:
+                ready.append(time.monotonic() - started)
+    
+    threading.Thread(target=read_log, daemon=True).start()
+    
+    try:
+        first_health = None
+        while first_health is None or len(ready) < workers:
+            if process.poll() is not None:
+                raise RuntimeError('gunicorn завершился при запуске')
+            if time.monotonic() - started > 60:
+                raise RuntimeError('воркеры не запустились за 60 сек')
+            if first_health is None:
+                try:
+                    if requests.get(f'{url}/', timeout=1).status_code == 200:
+                        first_health = time.monotonic() - started
+                except requests.RequestException:
+                    pass
+            time.sleep(0.01)
+        
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+        headers = {'Content-Type': 'application/json'}
+        
+        sent_at = time.monotonic()
+        session.post(f'{url}/webhook/wazzup', data=make_webhook(0), headers=headers, timeout=60)
+        first_webhook = time.monotonic() - sent_at
+        
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+        
+        def send(i):
+            nonlocal errors
+            request_started = time.monotonic()
+            try:
+                ok = session.post(f'{url}/webhook/wazzup', data=make_webhook(i), headers=headers, timeout=60).ok
+            except requests.RequestException:
+                ok = False
+            with lock:
+                latencies.append(time.monotonic() - request_started)
+                errors += not ok
+        
+        load_started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(send, range(1, args.requests + 1)))
+        load_time = time.monotonic() - load_started
+    
+    finally:
+        stop_started = time.monotonic()
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
+        stopped = time.monotonic() - stop_started
+    
+    return {
+        'ready': max(ready),
+        'first_health': first_health,
+        'first_webhook': first_webhook,
+        'oauth': standin.calls['oauth'] - oauth_before,
+        'rps': args.requests / load_time,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'errors': errors,
+        'stop': stopped
+    }
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Замер запуска gunicorn и пропускной способности вебхуков')
+    parser.add_argument('--latency', type=float, default=0.1, help='задержка заглушки Podio (сек)')
+    parser.add_argument('--requests', type=int, default=200, help='вебхуков под нагрузкой')
+    parser.add_argument('--concurrency', type=int, default=32, help='одновременных вебхуков')
+    parser.add_argument('--only', help='подстрока названия конфигурации')
+    args = parser.parse_args()
+    
+    logging.disable(logging.ERROR)
+    
+    standin = PodioStandin(args.latency, 0.0, 0.0)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(standin))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    os.environ.update({
+        'PODIO_API_URL': f'http://127.0.0.1:{server.server_port}',
+        'PODIO_CLIENT_ID': 'bench', 'PODIO_CLIENT_SECRET': 'bench',
+        'PODIO_APP_ID': '1', 'PODIO_APP_TOKEN': 'bench',
+        'PODIO_RATE_LIMIT_PER_HOUR': '0', 'WAZZUP_WEBHOOK_SECRET': '',
+        'TRAFFIC_RECORD_DIR': '', 'SPOOL_DIR': '', 'TRACE_FILE': '', 'LOG_LEVEL': 'WARNING'
+    })
+    
+    print(f"{'конфигурация':<22} {'готовы, с':>9} {'1-й ответ, с':>12} {'1-й вебхук, мс':>15} {'oauth':>6} "
+          f"{'вебхук/с':>9} {'p50, мс':>8} {'p99, мс':>8} {'ошибок':>7} {'стоп, с':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, env in CONFIGS:
+            if args.only and args.only not in name:
+                continue
+            result = run_config(env, args, tmp_dir, standin)
+            print(f"{name:<22} {result['ready']:>9.2f} {result['first_health']:>12.2f} "
+                  f"{result['first_webhook'] * 1000:>15.0f} {result['oauth']:>6} {result['rps']:>9.1f} "
+                  f"{result['p50'] * 1000:>8.0f} {result['p99'] * 1000:>8.0f} {result['errors']:>7} {result['stop']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка Podio API для нагрузочных тестов
+Отвечает на вызовы, которые использует PodioClient, с настраиваемой задержкой
+и считает запросы. Используется вместе с PODIO_API_URL=http://127.0.0.1:<port>
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROUTES = [
+    ('POST', re.compile(r'^/oauth/token/?$'), 'oauth'),
+    ('GET', re.compile(r'^/app/\d+/?$'), 'get_app'),
+    ('POST', re.compile(r'^/item/app/\d+/filter/?$'), 'filter_items'),
+    ('POST', re.compile(r'^/item/app/\d+/?$'), 'create_item'),
+    ('PUT', re.compile(r'^/item/\d+/?$'), 'update_item'),
+    ('POST', re.compile(r'^/comment/item/\d+/?$'), 'create_comment'),
+]
+
+class PodioStandin:
+    """Состояние заглушки: счетчики вызовов и параметры задержки"""
+    
+    def __init__(self, latency: float, jitter: float, error_rate: float, capacity: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self.in_flight = 0
+        self.calls = Counter()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+    
+    def respond(self, method: str, path: str):
+        for route_method, pattern, name in ROUTES:
+            if method == route_method and pattern.match(path):
+                break
+        else:
+            return 404, {'error': 'not_found'}
+        
+        with self.lock:
+            self.calls[name] += 1
+            # Как Podio: при превышении допустимой нагрузки ответ 420
+            if self.capacity and name != 'oauth' and self.in_flight >= self.capacity:
+                self.calls['throttled'] += 1
+                return 420, {'error': 'rate_limit'}
+            self.in_flight += 1
+        
+        try:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        
+        if name != 'oauth' and random.random() < self.error_rate:
+            return 500, {'error': 'unavailable'}
+        
+        if name == 'oauth':
+            return 200, {'access_token': 'standin-token', 'expires_in': 28800}
+        if name == 'get_app':
+            return 200, {'app_id': int(path.strip('/').split('/')[1]), 'fields': []}
+        if name == 'filter_items':
+            return 200, {'items': [], 'total': 0}
+        if name == 'create_item':
+            return 200, {'item_id': next(self.ids)}
+        if name == 'update_item':
+            return 200, {'revision': 1}
+        return 200, {'comment_id': next(self.ids)}
+
+def make_handler(standin: PodioStandin):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+        
+        def _handle(self):
+            length = int(self.headers.get('Content-Length', 0))
+            if length:
+                self.rfile.read(length)
+            
+            path = self.path.split('?', 1)[0]
+            if self.command == 'GET' and path == '/_stats':
+                status, payload = 200, dict(standin.calls)
+            else:
+                status, payload = standin.respond(self.command, path)
+            
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        do_GET = do_POST = do_PUT = _handle
+        
+        def log_message(self, format, *args):
+            pass
+    
+    return Handler
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Локальная заглушка Podio API')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка ответа (сек)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='разброс задержки (сек)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 500')
+    parser.add_argument('--capacity', type=int, default=0, help='одновременных запросов до ответа 420 (0 - без ограничения)')
+    args = parser.parse_args()
+    
+    standin = PodioStandin(args.latency, args.jitter, args.error_rate, args.capacity)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(standin))
+    
+    print(f"🧪 Заглушка Podio API на http://127.0.0.1:{args.port} (статистика: /_stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nВызовы: {dict(standin.calls)}")
+
+if __name__ == "__main__":
+    main()
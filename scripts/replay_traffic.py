@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Воспроизведение записанного трафика вебхуков Wazzup
+Отправляет записанные тела запросов на локальный экземпляр сервиса
+с сохранением исходных интервалов между запросами (1x, 10x или max)
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import heapq
+import base64
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+def read_segment(path):
+    """Чтение записей одного сегмента; обрезанный хвост (после сбоя) пропускается"""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                
+                if 'body_b64' in record:
+                    body = base64.b64decode(record['body_b64'])
+                else:
+                    body = record['body'].encode('utf-8')
+                yield record['ts'], body, record.get('headers', {})
+    except (EOFError, OSError) as e:
+        print(f"⚠️ Сегмент {path} прочитан не полностью: {str(e)}")
+
+def find_segments(paths):
+    """Список файлов сегментов из переданных файлов и каталогов"""
+    segments = []
+    for path in paths:
+        if os.path.isdir(path):
+            segments.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.endswith('.jsonl.gz')
+            )
+        else:
+            segments.append(path)
+    return segments
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Воспроизведение записанного трафика вебхуков')
+    parser.add_argument('paths', nargs='+', help='сегменты или каталоги TRAFFIC_RECORD_DIR')
+    parser.add_argument('--url', default='http://127.0.0.1:5000/webhook/wazzup', help='адрес эндпоинта')
+    parser.add_argument('--speed', default='1', help='ускорение: 1, 10, ... или max')
+    parser.add_argument('--concurrency', type=int, default=32, help='одновременных запросов')
+    args = parser.parse_args()
+    
+    speed = None if args.speed == 'max' else float(args.speed)
+    segments = find_segments(args.paths)
+    if not segments:
+        print("❌ Сегменты не найдены")
+        sys.exit(1)
+    
+    # Сегменты разных процессов сливаются по времени приема
+    records = heapq.merge(*(read_segment(path) for path in segments), key=lambda r: r[0])
+    
+    statuses = Counter()
+    latencies = []
+    lags = []
+    lock = threading.Lock()
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+    
+    def send(body, headers):
+        headers = dict(headers, **{'Content-Type': 'application/json'})
+        started = time.monotonic()
+        try:
+            response = session.post(args.url, data=body, headers=headers, timeout=60)
+            status = response.status_code
+        except requests.RequestException:
+            status = 'error'
+        with lock:
+            statuses[status] += 1
+            latencies.append(time.monotonic() - started)
+    
+    print(f"▶️ Воспроизведение {len(segments)} сегментов на {args.url}, скорость {args.speed}")
+    
+    first_ts = None
+    replay_started = time.monotonic()
+    sent = 0
+    
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for ts, body, headers in records:
+            if first_ts is None:
+                first_ts = ts
+            
+            if speed is not None:
+                # Сохраняем форму потока: момент отправки пропорционален исходному
+                due = replay_started + (ts - first_ts) / speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    lags.append(-delay)
+            
+            executor.submit(send, body, headers)
+            sent += 1
+    
+    elapsed = time.monotonic() - replay_started
+    print(f"✅ Отправлено {sent} запросов за {elapsed:.1f} сек ({sent / max(elapsed, 1e-9):.1f} req/s)")
+    print(f"Коды ответов: {dict(statuses)}")
+    print(f"Задержка ответа: p50={percentile(latencies, 0.5) * 1000:.1f} мс, "
+          f"p99={percentile(latencies, 0.99) * 1000:.1f} мс")
+    if speed is not None:
+        print(f"Отставание от расписания: max={max(lags, default=0.0) * 1000:.1f} мс")
+
+if __name__ == "__main__":
+    main()
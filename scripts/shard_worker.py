@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Шардированная доставка вебхуков из спула
+Запускает один или несколько процессов-обработчиков; процессы на одном или разных хостах
+с общим SPOOL_DIR делят шарды по chat_id без центрального брокера
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+import multiprocessing
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.logger import setup_logger
+
+# Загрузка переменных окружения
+load_dotenv()
+
+logger = setup_logger('shard_worker')
+setup_logger('src')
+
+def run_worker(once: bool, interval: float) -> None:
+    """Цикл одного процесса; клиенты и соединения создаются в самом процессе"""
+    from src.wazzup.webhook_handler import WazzupWebhookHandler
+    from src.podio.router import PodioRouter
+    from src.delivery.pipeline import DeliveryPipeline
+    from src.delivery.spool import WebhookSpool
+    from src.delivery.shards import ShardWorker
+    from src.storage.message_store import MessageStore
+    from src.storage.item_map import FileItemMap
+    
+    spool = WebhookSpool()
+    # Соответствия messageId -> item_id хранятся в общем каталоге спула: SQLite в режиме WAL
+    # нельзя держать на сетевом томе, а новый владелец шарда должен видеть элементы прежнего
+    item_map = FileItemMap(os.path.join(spool.spool_dir, 'shards', 'map'))
+    worker = ShardWorker(spool, WazzupWebhookHandler(), DeliveryPipeline(PodioRouter(), item_map), MessageStore())
+    
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+    
+    logger.info(f"Запуск обработчика {worker.worker_id}, шардов: {worker.shard_count}")
+    try:
+        while not stopping:
+            delivered = worker.run_once()
+            if once and not delivered and spool.depth() == 0 and worker.pending_files() == 0:
+                break
+            if not delivered:
+                time.sleep(interval)
+    finally:
+        worker.stop()
+        logger.info(f"Обработчик {worker.worker_id} остановлен: {worker.get_stats()}")
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Шардированная доставка вебхуков из спула')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='число процессов на этом хосте')
+    parser.add_argument('--once', action='store_true', help='обработать очередь и выйти')
+    parser.add_argument('--interval', type=float, default=0.5, help='пауза при пустой очереди (сек)')
+    args = parser.parse_args()
+    
+    if not os.getenv('SPOOL_DIR'):
+        logger.error("SPOOL_DIR не настроен")
+        sys.exit(1)
+    
+    if args.processes <= 1:
+        run_worker(args.once, args.interval)
+        return
+    
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(args.once, args.interval), name=f'shard-worker-{index}')
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    
+    # Сигнал остановки передается всем процессам, каждый освобождает свои аренды
+    def stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    
+    for process in processes:
+        process.join()
+
+if __name__ == "__main__":
+    main()
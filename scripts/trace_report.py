@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Разбор файла трассировки TRACE_FILE
+Печатает разбивку задержки доставки по сообщениям или конвертирует
+трассировку в формат Chrome Trace (chrome://tracing, ui.perfetto.dev)
+"""
+
+import sys
+import json
+import argparse
+from datetime import datetime, timezone
+from collections import defaultdict
+
+def load_events(path):
+    events = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return events
+
+def parse_message_time(value):
+    """Время сообщения Wazzup (ISO 8601, UTC) в секундах эпохи"""
+    try:
+        dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+    except ValueError:
+        return None
+
+def report(events, message_id=None, correlation_id=None):
+    """Разбивка задержки по каждому доставленному событию"""
+    by_correlation = defaultdict(list)
+    for event in events:
+        by_correlation[event['args'].get('correlation_id')].append(event)
+    
+    print(f"{'message_id':<38} {'correlation_id':<34} {'lag, s':>8} {'queue, s':>9} "
+          f"{'deliver, ms':>12} {'podio':>6} {'podio, ms':>10}")
+    
+    for cid, cid_events in by_correlation.items():
+        if correlation_id and cid != correlation_id:
+            continue
+        
+        queued = sum(e['dur'] for e in cid_events if e['name'] in ('spool.wait', 'edit.debounce')) / 1e6
+        
+        for deliver in (e for e in cid_events if e['name'] == 'delivery.deliver'):
+            mid = deliver['args'].get('message_id') or '-'
+            if message_id and mid != message_id:
+                continue
+            
+            start, end = deliver['ts'], deliver['ts'] + deliver['dur']
+            requests = [
+                e for e in cid_events
+                if e['name'] == 'podio.request' and e['tid'] == deliver['tid']
+                and e['pid'] == deliver['pid'] and start <= e['ts'] <= end
+            ]
+            
+            # Задержка от времени сообщения в Wazzup до завершения доставки в Podio
+            message_time = parse_message_time(deliver['args'].get('message_time'))
+            lag = f"{end / 1e6 - message_time:.1f}" if message_time else '-'
+            
+            print(f"{mid:<38} {cid or '-':<34} {lag:>8} {queued:>9.2f} {deliver['dur'] / 1e3:>12.1f} "
+                  f"{len(requests):>6} {sum(e['dur'] for e in requests) / 1e3:>10.1f}")
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Отчет по файлу трассировки доставки')
+    parser.add_argument('trace_file', help='файл TRACE_FILE')
+    parser.add_argument('--message-id', help='только указанное сообщение')
+    parser.add_argument('--correlation-id', help='только указанный идентификатор корреляции')
+    parser.add_argument('--chrome', metavar='OUTPUT', help='сохранить в формате Chrome Trace')
+    args = parser.parse_args()
+    
+    events = load_events(args.trace_file)
+    if not events:
+        print("❌ Трассировка пуста")
+        sys.exit(1)
+    
+    if args.chrome:
+        with open(args.chrome, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+        print(f"✅ Сохранено {len(events)} событий в {args.chrome}")
+        return
+    
+    report(events, args.message_id, args.correlation_id)
+
+if __name__ == "__main__":
+    main()
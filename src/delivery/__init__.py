@@ -0,0 +1 @@
+# Delivery module
@@ -0,0 +1,136 @@
+"""
+Контроль допуска (admission control) для вебхуков
+Следит за количеством доставок в работе и возрастом очереди,
+при перегрузке переключает эндпоинт на быстрый путь (спул или отказ)
+"""
+
+import os
+import time
+import itertools
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Optional, Any, Callable
+
+logger = logging.getLogger(__name__)
+
+ACCEPT = 'accept'
+SPOOL = 'spool'
+REJECT = 'reject'
+
+class AdmissionController:
+    """Решает, принимать ли вебхук в синхронную обработку"""
+    
+    def __init__(self, max_in_flight: int = None, max_backlog_age: float = None,
+                 shed_mode: str = None, retry_after: int = None):
+        if max_in_flight is None:
+            max_in_flight = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 64))
+        if max_backlog_age is None:
+            max_backlog_age = float(os.getenv('ADMISSION_MAX_BACKLOG_AGE', 30))
+        if shed_mode is None:
+            shed_mode = os.getenv('ADMISSION_SHED_MODE', REJECT).lower()
+        if retry_after is None:
+            retry_after = int(os.getenv('ADMISSION_RETRY_AFTER', 5))
+        
+        if shed_mode not in (SPOOL, REJECT):
+            logger.warning(f"Неизвестный ADMISSION_SHED_MODE={shed_mode}, используется {REJECT}")
+            shed_mode = REJECT
+        
+        self.max_in_flight = max_in_flight
+        self.max_backlog_age = max_backlog_age
+        self.shed_mode = shed_mode
+        self.retry_after = retry_after
+        
+        self._lock = threading.Lock()
+        self._tokens = itertools.count(1)
+        self._in_flight = {}
+        self._backlog_sources = {}
+        self._load_sources = {}
+        self._counters = Counter()
+    
+    def add_load_source(self, name: str, in_flight: Callable[[], int]) -> None:
+        """
+        Регистрация источника доставок в работе (например, событий полос доставки)
+        Потоков запросов в процессе немного, поэтому без доставок лимит ADMISSION_MAX_IN_FLIGHT не достигается
+        """
+        self._load_sources[name] = in_flight
+    
+    def _in_flight_count(self) -> int:
+        """Вебхуки в синхронной обработке и доставки в работе"""
+        count = len(self._in_flight)
+        for name, in_flight in self._load_sources.items():
+            try:
+                count += in_flight()
+            except Exception as e:
+                logger.error(f"Ошибка получения числа доставок {name}: {str(e)}")
+        return count
+    
+    def add_backlog_source(self, name: str, oldest_age: Callable[[], float]) -> None:
+        """Регистрация источника возраста очереди (например, спула)"""
+        self._backlog_sources[name] = oldest_age
+    
+    def _backlog_age(self, now: float) -> float:
+        """Возраст самой старой незавершенной работы (секунды)"""
+        age = 0.0
+        if self._in_flight:
+            age = now - min(self._in_flight.values())
+        
+        for name, oldest_age in self._backlog_sources.items():
+            try:
+                age = max(age, oldest_age())
+            except Exception as e:
+                logger.error(f"Ошибка получения возраста очереди {name}: {str(e)}")
+        
+        return age
+    
+    def _overload_reason(self, now: float) -> Optional[str]:
+        if self.max_in_flight > 0 and self._in_flight_count() >= self.max_in_flight:
+            return 'in_flight'
+        if self.max_backlog_age > 0 and self._backlog_age(now) >= self.max_backlog_age:
+            return 'backlog_age'
+        return None
+    
+    def decide(self) -> Dict[str, Any]:
+        """
+        Решение о допуске вебхука
+        Возвращает {'action': accept|spool|reject, 'reason': ..., 'token': ...}
+        """
+        with self._lock:
+            now = time.monotonic()
+            reason = self._overload_reason(now)
+            
+            if reason is None:
+                token = next(self._tokens)
+                self._in_flight[token] = now
+                self._counters[ACCEPT] += 1
+                return {'action': ACCEPT, 'reason': None, 'token': token}
+            
+            return {'action': self.shed_mode, 'reason': reason, 'token': None}
+    
+    def release(self, token: Optional[int]) -> None:
+        """Завершение синхронной обработки вебхука"""
+        if token is None:
+            return
+        with self._lock:
+            self._in_flight.pop(token, None)
+    
+    def record_shed(self, action: str, reason: str) -> None:
+        """Учет фактического решения о сбросе нагрузки"""
+        with self._lock:
+            self._counters[action] += 1
+            self._counters[f'{action}:{reason}'] += 1
+        logger.warning(f"Вебхук не принят в обработку: {action} ({reason})")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика для эндпоинта /status"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'in_flight': self._in_flight_count(),
+                'in_flight_requests': len(self._in_flight),
+                'backlog_age': round(self._backlog_age(now), 3),
+                'max_in_flight': self.max_in_flight,
+                'max_backlog_age': self.max_backlog_age,
+                'shed_mode': self.shed_mode,
+                'decisions': dict(self._counters)
+            }
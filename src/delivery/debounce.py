@@ -0,0 +1,124 @@
+"""
+Подавление серий правок одного сообщения
+Из нескольких правок, пришедших за окно, в Podio записывается только последняя
+"""
+
+import os
+import time
+import heapq
+import logging
+import threading
+from typing import Dict, Any, Callable
+
+from src.utils.tracing import tracer, get_correlation_id, correlation_scope
+
+logger = logging.getLogger(__name__)
+
+class EditDebouncer:
+    """Откладывает правку на окно и заменяет ее более поздними правками того же сообщения"""
+    
+    def __init__(self, flush: Callable[[Dict[str, Any], Dict[str, Any]], Any], window: float = None):
+        if window is None:
+            window = float(os.getenv('EDIT_DEBOUNCE_SECONDS', 2.0))
+        
+        self.flush = flush
+        self.window = window
+        self.submitted = 0
+        self.coalesced = 0
+        self.flushed = 0
+        
+        self._pending = {}
+        self._deadlines = []
+        self._cond = threading.Condition()
+        self._worker_pid = None
+    
+    def submit(self, item: Dict[str, Any], mapping: Dict[str, Any]) -> None:
+        """Постановка правки; если правка этого сообщения уже ждет, она заменяется"""
+        if self.window <= 0:
+            self.flush(item, mapping)
+            return
+        
+        self._ensure_worker()
+        message_id = item.get('message_id')
+        
+        with self._cond:
+            self.submitted += 1
+            if message_id in self._pending:
+                # Срок записи не сдвигается, чтобы задержка правки была ограничена окном
+                deadline = self._pending[message_id][0]
+                self.coalesced += 1
+            else:
+                deadline = time.monotonic() + self.window
+                heapq.heappush(self._deadlines, (deadline, message_id))
+            
+            # Запись правки выполняется в фоне, поэтому идентификатор корреляции сохраняется вместе с ней
+            trace = (get_correlation_id(), time.time())
+            self._pending[message_id] = (deadline, item, mapping, trace)
+            self._cond.notify()
+    
+    def cancel(self, message_id: str) -> bool:
+        """Отмена ожидающей правки (например, сообщение удалено)"""
+        with self._cond:
+            return self._pending.pop(message_id, None) is not None
+    
+    def flush_all(self) -> int:
+        """Немедленная запись всех ожидающих правок (перед остановкой процесса)"""
+        with self._cond:
+            entries = list(self._pending.values())
+            self._pending = {}
+            self._deadlines = []
+        
+        for _, item, mapping, trace in entries:
+            self._flush_entry(item, mapping, trace)
+        return len(entries)
+    
+    def _ensure_worker(self) -> None:
+        if self._worker_pid == os.getpid():
+            return
+        
+        with self._cond:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            self._pending = {}
+            self._deadlines = []
+            threading.Thread(target=self._run, name='edit-debouncer', daemon=True).start()
+    
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._deadlines and self._deadlines[0][0] <= now:
+                        deadline, message_id = heapq.heappop(self._deadlines)
+                        entry = self._pending.get(message_id)
+                        # Запись в куче могла устареть после отмены
+                        if entry is None or entry[0] != deadline:
+                            continue
+                        del self._pending[message_id]
+                        break
+                    timeout = self._deadlines[0][0] - now if self._deadlines else None
+                    self._cond.wait(timeout)
+            
+            _, item, mapping, trace = entry
+            self._flush_entry(item, mapping, trace)
+    
+    def _flush_entry(self, item: Dict[str, Any], mapping: Dict[str, Any], trace) -> None:
+        correlation_id, submitted_at = trace
+        with correlation_scope(correlation_id):
+            tracer.record_span('edit.debounce', submitted_at, time.time(), message_id=item.get('message_id'))
+            try:
+                self.flush(item, mapping)
+                self.flushed += 1
+            except Exception as e:
+                logger.error(f"Ошибка записи правки сообщения {item.get('message_id')}: {str(e)}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'window': self.window,
+                'pending': len(self._pending),
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'flushed': self.flushed
+            }
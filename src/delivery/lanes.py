@@ -0,0 +1,398 @@
+"""
+Приоритетные полосы доставки
+Входящие сообщения клиентов доставляются раньше эхо-сообщений и статусов.
+Полосы обслуживаются взвешенным циклическим планированием с защитой от голодания.
+"""
+
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+from typing import Dict, Optional, Any, List, Iterable, Tuple, Callable
+
+logger = logging.getLogger(__name__)
+
+INBOUND = 'inbound'
+OUTBOUND = 'outbound'
+RECEIPTS = 'receipts'
+
+DEFAULT_WEIGHTS = 'inbound:6,outbound:3,receipts:1'
+
+# Сколько событий полосы просматривается в поисках чата, который сейчас никто не доставляет
+SCAN_LIMIT = 256
+
+# Как часто проверять, освободился ли слот или бюджет приложения, события которого ждут в полосах
+CAPACITY_POLL_INTERVAL = 0.2
+
+def classify(item: Dict[str, Any]) -> str:
+    """Полоса для события: входящие сообщения, исходящие (эхо) или статусы и отложенные комментарии"""
+    if item.get('event_type') != 'message':
+        return RECEIPTS
+    if item.get('direction') == 'outbound' or item.get('sent_from_app'):
+        return OUTBOUND
+    return INBOUND
+
+def chat_key(item: Dict[str, Any]) -> str:
+    """Ключ упорядочивания: события одного чата доставляются по одному"""
+    return item.get('chat_id') or item.get('message_id') or ''
+
+def _parse_weights(value: str) -> Dict[str, int]:
+    weights = {}
+    for part in value.split(','):
+        name, _, weight = part.partition(':')
+        if name.strip():
+            weights[name.strip()] = max(1, int(weight or 1))
+    return weights
+
+def _percentile(samples, p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+class _Lane:
+    """Очередь одной полосы и ее статистика"""
+    
+    def __init__(self, name: str, weight: int, max_depth: int):
+        self.name = name
+        self.weight = weight
+        self.max_depth = max_depth
+        self.queue = deque()
+        self.current = 0
+        self.enqueued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.rejected = 0
+        self.starvation_picks = 0
+        self.wait_samples = deque(maxlen=1000)
+        self.latency_samples = deque(maxlen=1000)
+    
+    def get_stats(self, now: float) -> Dict[str, Any]:
+        return {
+            'weight': self.weight,
+            'depth': len(self.queue),
+            'oldest_wait': round(now - self.queue[0][0], 3) if self.queue else 0.0,
+            'enqueued': self.enqueued,
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'starvation_picks': self.starvation_picks,
+            'wait_p50': round(_percentile(self.wait_samples, 0.5), 3),
+            'wait_p99': round(_percentile(self.wait_samples, 0.99), 3),
+            'latency_p50': round(_percentile(self.latency_samples, 0.5), 3),
+            'latency_p99': round(_percentile(self.latency_samples, 0.99), 3)
+        }
+
+class LaneScheduler:
+    """Пул потоков доставки, выбирающий события из полос по весам"""
+    
+    def __init__(self, pipeline, workers: int = None, weights: str = None,
+                 max_wait: float = None, max_depth: int = None):
+        if workers is None:
+            workers = int(os.getenv('DELIVERY_WORKERS', 8))
+        if weights is None:
+            weights = os.getenv('DELIVERY_LANE_WEIGHTS', DEFAULT_WEIGHTS)
+        if max_wait is None:
+            max_wait = float(os.getenv('DELIVERY_LANE_MAX_WAIT', 30))
+        if max_depth is None:
+            max_depth = int(os.getenv('DELIVERY_LANE_MAX_DEPTH', 10000))
+        
+        self.pipeline = pipeline
+        self.workers = workers
+        self.max_wait = max_wait
+        # Остановка воркера: сколько ждать доставки полос, остаток передается в spill
+        self.drain_timeout = float(os.getenv('DELIVERY_DRAIN_TIMEOUT', 20))
+        self.spill = None
+        
+        # Результат каких полос ждет вебхук; остальные доставляются в фоне
+        self.await_lanes = set(filter(None, os.getenv('DELIVERY_AWAIT_LANES', INBOUND).split(',')))
+        self.await_timeout = float(os.getenv('DELIVERY_AWAIT_TIMEOUT', 20))
+        
+        self.lanes = {}
+        for name, weight in _parse_weights(weights).items():
+            self.lanes[name] = _Lane(name, weight, max_depth)
+        for name in (INBOUND, OUTBOUND, RECEIPTS):
+            self.lanes.setdefault(name, _Lane(name, 1, max_depth))
+        
+        # Чаты, события которых доставляются прямо сейчас, и очередь номеров событий каждого чата:
+        # событие чата берется, только когда все более ранние события этого чата (в любой полосе) доставлены
+        self._active = set()
+        self._in_flight = {}
+        self._chat_queues = {}
+        # Доставки в каждое приложение Podio: поток берет событие, только если у приложения есть слот и бюджет,
+        # поэтому перегруженное приложение не занимает потоки, нужные остальным
+        self._app_busy = {}
+        self._app_blocked = False
+        self._sequence = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._workers_pid = None
+    
+    def set_spill(self, spill: Callable[[List[Dict[str, Any]]], Any]) -> None:
+        """Куда сохранить недоставленные события при остановке (например, в спул)"""
+        self.spill = spill
+    
+    def submit(self, item: Dict[str, Any], block: bool = False) -> Optional[Future]:
+        """
+        Постановка события в его полосу
+        Возвращает Future с результатом доставки или None, если полоса переполнена или полосы остановлены:
+        такое событие вызывающий передает в spill_items() или сообщает об ошибке
+        """
+        self._ensure_workers()
+        lane = self.lanes[classify(item)]
+        app = self.pipeline.app_for(item)
+        future = Future()
+        # Контекст (идентификатор корреляции, профиль запроса) переходит в поток доставки
+        context = contextvars.copy_context()
+        
+        with self._cond:
+            if self._closed:
+                return None
+            while len(lane.queue) >= lane.max_depth:
+                if not block:
+                    lane.rejected += 1
+                    logger.error(f"Полоса доставки {lane.name} переполнена")
+                    return None
+                # Обратное давление: потоковая обработка ждет освобождения места
+                self._cond.wait(1.0)
+            
+            self._sequence += 1
+            self._chat_queues.setdefault(chat_key(item), deque()).append(self._sequence)
+            lane.queue.append((time.monotonic(), item, future, context, self._sequence, app))
+            lane.enqueued += 1
+            self._cond.notify_all()
+        
+        return future
+    
+    def spill_items(self, items: List[Dict[str, Any]]) -> bool:
+        """Сохранение событий, не принятых в полосы, для повтора; False, если сохранить их негде"""
+        if not items:
+            return True
+        return self.spill is not None and bool(self.spill(items))
+    
+    def deliver_batch(self, items: Iterable[Dict[str, Any]]) -> Tuple[List[Dict], int, int]:
+        """
+        Доставка событий вебхука через полосы
+        Возвращает результаты ожидаемых полос, число событий, оставшихся в очереди или сохраненных в spill,
+        и число событий, которые не удалось ни поставить в полосу, ни сохранить (вебхук нужно повторить)
+        """
+        awaited = []
+        rejected = []
+        queued = 0
+        for item in items:
+            future = self.submit(item)
+            if future is None:
+                rejected.append(item)
+                continue
+            if classify(item) in self.await_lanes:
+                awaited.append(future)
+            else:
+                queued += 1
+        
+        results = []
+        deadline = time.monotonic() + self.await_timeout
+        for future in awaited:
+            try:
+                result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except TimeoutError:
+                # Событие останется в полосе и будет доставлено позже
+                queued += 1
+                continue
+            if result:
+                results.append(result)
+        
+        dropped = 0
+        if self.spill_items(rejected):
+            queued += len(rejected)
+        else:
+            dropped = len(rejected)
+            logger.error(f"Событий вебхука не принято в полосы доставки: {dropped}")
+        
+        return results, queued, dropped
+    
+    def _ensure_workers(self) -> None:
+        """Запуск потоков доставки в текущем процессе (в том числе после fork)"""
+        if self._workers_pid == os.getpid():
+            return
+        
+        with self._cond:
+            if self._workers_pid == os.getpid():
+                return
+            self._workers_pid = os.getpid()
+            for lane in self.lanes.values():
+                lane.queue.clear()
+            self._active.clear()
+            self._in_flight.clear()
+            self._chat_queues.clear()
+            self._app_busy.clear()
+            for index in range(self.workers):
+                threading.Thread(target=self._run, name=f'delivery-{index}', daemon=True).start()
+    
+    def _next_index(self, lane: _Lane, capacity: Dict[str, bool]) -> Optional[int]:
+        """
+        Первое событие полосы, которое следующее в своем чате, чат сейчас не доставляется
+        и у приложения Podio есть свободный слот (capacity - кэш проверки приложений на один выбор)
+        """
+        for index, entry in enumerate(lane.queue):
+            if index >= SCAN_LIMIT:
+                return None
+            key = chat_key(entry[1])
+            if key in self._active or self._chat_queues[key][0] != entry[4]:
+                continue
+            
+            app = entry[5]
+            if app not in capacity:
+                capacity[app] = self.pipeline.has_capacity(app, self._app_busy.get(app, 0))
+            if capacity[app]:
+                return index
+            self._app_blocked = True
+        return None
+    
+    def _pick(self) -> Optional[tuple]:
+        """Выбор следующего события (вызывается под блокировкой)"""
+        self._app_blocked = False
+        capacity = {}
+        ready = {}
+        for lane in self.lanes.values():
+            index = self._next_index(lane, capacity) if lane.queue else None
+            if index is not None:
+                ready[lane.name] = (lane, index)
+        if not ready:
+            return None
+        
+        now = time.monotonic()
+        starving = [(lane, index) for lane, index in ready.values() if now - lane.queue[index][0] >= self.max_wait]
+        
+        if starving:
+            # Защита от голодания: событие, ждущее дольше max_wait, идет первым
+            lane, index = min(starving, key=lambda candidate: candidate[0].queue[candidate[1]][0])
+            lane.starvation_picks += 1
+        else:
+            # Плавный взвешенный round-robin
+            total = 0
+            for candidate, _ in ready.values():
+                candidate.current += candidate.weight
+                total += candidate.weight
+            lane, index = max(ready.values(), key=lambda candidate: candidate[0].current)
+            lane.current -= total
+        
+        entry = lane.queue[index]
+        del lane.queue[index]
+        key = chat_key(entry[1])
+        self._active.add(key)
+        self._in_flight[entry[4]] = entry
+        self._app_busy[entry[5]] = self._app_busy.get(entry[5], 0) + 1
+        chat_queue = self._chat_queues[key]
+        chat_queue.popleft()
+        if not chat_queue:
+            del self._chat_queues[key]
+        return (lane,) + entry
+    
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                picked = self._pick()
+                while picked is None:
+                    # События перегруженного приложения ждут, пока у него освободится слот или бюджет
+                    self._cond.wait(CAPACITY_POLL_INTERVAL if self._app_blocked else None)
+                    picked = self._pick()
+                # Освободилось место для заблокированных отправителей
+                self._cond.notify_all()
+            
+            lane, enqueued_at, item, future, context, sequence, app = picked
+            started = time.monotonic()
+            
+            try:
+                result = context.run(self.pipeline.deliver, item)
+            except Exception as e:
+                logger.error(f"Ошибка доставки события из полосы {lane.name}: {str(e)}")
+                result = None
+            
+            finished = time.monotonic()
+            with self._cond:
+                self._active.discard(chat_key(item))
+                self._in_flight.pop(sequence, None)
+                self._app_busy[app] -= 1
+                lane.wait_samples.append(started - enqueued_at)
+                lane.latency_samples.append(finished - enqueued_at)
+                if result:
+                    lane.delivered += 1
+                else:
+                    lane.failed += 1
+                # Следующее событие этого чата можно брать
+                self._cond.notify_all()
+            
+            future.set_result(result)
+    
+    def drain(self, timeout: float = None) -> bool:
+        """Ожидание доставки всех событий полос; False, если за timeout не успели"""
+        if timeout is None:
+            timeout = self.drain_timeout
+        deadline = time.monotonic() + timeout
+        
+        with self._cond:
+            while any(lane.queue for lane in self.lanes.values()) or self._active:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._workers_pid != os.getpid():
+                    return False
+                self._cond.wait(min(remaining, 1.0))
+            return True
+    
+    def close(self, timeout: float = None) -> int:
+        """
+        Остановка полос: ожидание доставки, затем передача оставшихся событий в spill
+        События, доставка которых не завершилась за timeout, тоже передаются (доставка не менее одного раза:
+        уже созданные элементы пропускаются по соответствию messageId -> item_id)
+        Возвращает число переданных (или потерянных без spill) событий
+        """
+        self.drain(timeout)
+        
+        with self._cond:
+            self._closed = True
+            in_flight = list(self._in_flight.values())
+            queued = []
+            for lane in self.lanes.values():
+                queued.extend(lane.queue)
+                lane.queue.clear()
+            self._chat_queues.clear()
+            self._cond.notify_all()
+        
+        # Результат доставляемых событий выставит их поток
+        for entry in queued:
+            entry[2].set_result(None)
+        
+        entries = in_flight + queued
+        if not entries:
+            return 0
+        
+        # События разных полос сохраняются в порядке постановки
+        entries.sort(key=lambda entry: entry[4])
+        items = [entry[1] for entry in entries]
+        
+        if not self.spill_items(items):
+            logger.error(f"Остановка с недоставленными событиями в полосах: {len(items)} потеряно")
+        else:
+            logger.warning(f"Остановка с недоставленными событиями в полосах: {len(items)} сохранено для повтора")
+        return len(items)
+    
+    def pending(self, lanes: Iterable[str] = None) -> int:
+        """Число событий в очереди и в доставке в указанных полосах (по умолчанию во всех)"""
+        names = set(lanes) if lanes is not None else set(self.lanes)
+        with self._cond:
+            queued = sum(len(lane.queue) for lane in self.lanes.values() if lane.name in names)
+            return queued + sum(1 for entry in self._in_flight.values() if classify(entry[1]) in names)
+    
+    def oldest_age(self, lanes: Iterable[str] = None) -> float:
+        """Возраст самого старого ожидающего события в указанных полосах (по умолчанию во всех)"""
+        names = set(lanes) if lanes is not None else set(self.lanes)
+        with self._cond:
+            heads = [lane.queue[0][0] for lane in self.lanes.values() if lane.queue and lane.name in names]
+            return time.monotonic() - min(heads) if heads else 0.0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            return {name: lane.get_stats(now) for name, lane in self.lanes.items()}
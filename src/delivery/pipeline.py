@@ -0,0 +1,238 @@
+"""
+Конвейер доставки событий в Podio
+Общий код доставки для вебхук-сервера и фоновых обработчиков очереди
+"""
+
+import os
+import logging
+from typing import Dict, Optional, Any, List, Iterable, Callable, Tuple
+
+from src.delivery.debounce import EditDebouncer
+from src.delivery.reorder import ReorderBuffer
+from src.storage.item_map import MessageItemMap
+from src.utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Отложенный комментарий к уже созданному элементу (режим PODIO_DELIVERY_MODE=embedded)
+COMMENT_EVENT = 'comment'
+# События, дождавшиеся доставки своего сообщения в буфере переупорядочивания
+RELEASE_EVENT = 'released'
+
+class DeliveryPipeline:
+    """Доставка обработанных событий Wazzup в Podio"""
+    
+    def __init__(self, podio_router, item_map: MessageItemMap = None):
+        self.podio_router = podio_router
+        self.item_map = item_map or MessageItemMap()
+        self.edit_debouncer = EditDebouncer(self._write_change)
+        self.reorder_buffer = ReorderBuffer(self._deliver_held, poll=self._release_known)
+        # Статус сообщения, которое так и не пришло, по умолчанию создает отдельный элемент
+        self.drop_orphan_statuses = os.getenv('REORDER_DROP_ORPHAN_STATUSES', 'False').lower() == 'true'
+        self.deferred_sink = None
+    
+    def set_deferred_sink(self, sink: Callable[[Dict[str, Any]], Any]) -> None:
+        """Куда ставить отложенные события (фоновая полоса); без него они выполняются сразу"""
+        self.deferred_sink = sink
+    
+    def deliver(self, item: Dict[str, Any]) -> Optional[Dict]:
+        """Доставка одного события в приложение Podio, выбранное по маршруту"""
+        with tracer.span('delivery.deliver', message_id=item.get('message_id'),
+                         event_type=item.get('event_type'), message_time=item.get('timestamp')):
+            return self._deliver(item)
+    
+    def _deliver(self, item: Dict[str, Any]) -> Optional[Dict]:
+        if item.get('event_type') == COMMENT_EVENT:
+            return self._deliver_comment(item)
+        
+        if item.get('event_type') == RELEASE_EVENT:
+            return self._deliver_released(item)
+        
+        if self._is_change(item) or self._is_status(item):
+            message_id = item.get('message_id')
+            mapping = self.item_map.get(message_id)
+            if mapping:
+                return self._deliver_change(item, mapping)
+            
+            # Сообщение еще не доставлено: событие ждет его в буфере
+            if self.reorder_buffer.hold(item):
+                # Сообщение могло быть записано между проверкой и постановкой в буфер
+                if self.item_map.get(message_id):
+                    self._release_held(message_id)
+                return {'message_id': message_id, 'status': 'held'}
+        
+        if item.get('event_type') == 'message':
+            mapping = self.item_map.get(item.get('message_id'))
+            if mapping:
+                # Повторная доставка (повтор Wazzup, переход шарда после сбоя обработчика)
+                logger.info(f"Сообщение {item.get('message_id')} уже доставлено, повтор пропущен")
+                return {'item_id': mapping['item_id'], 'status': 'duplicate'}
+        
+        return self._create_item(item)
+    
+    def app_for(self, item: Dict[str, Any]) -> str:
+        """Приложение Podio, в которое уйдет событие (изоляция приложений в общих потоках доставки)"""
+        if item.get('event_type') == COMMENT_EVENT:
+            return item['app']
+        
+        if item.get('event_type') == RELEASE_EVENT or self._is_change(item) or self._is_status(item):
+            mapping = self.item_map.get(item.get('message_id'))
+            if mapping:
+                return mapping['app']
+        
+        return self.podio_router.resolve(item)
+    
+    def has_capacity(self, app_name: str, in_use: int) -> bool:
+        """Есть ли у приложения слот и бюджет еще для одной доставки при in_use идущих"""
+        podio_client = self.podio_router.get_client(app_name)
+        return podio_client is None or podio_client.has_capacity(in_use)
+    
+    def _create_item(self, item: Dict[str, Any]) -> Optional[Dict]:
+        app_name = self.podio_router.resolve(item)
+        podio_client = self.podio_router.get_client(app_name)
+        result = podio_client.create_message_item(item)
+        
+        if result:
+            logger.info(f"Элемент успешно отправлен в Podio: {result}")
+            if item.get('event_type') == 'message':
+                self.item_map.put(item.get('message_id'), result.get('item_id'), app_name)
+                self._release_held(item.get('message_id'))
+            if result.pop('comment_deferred', False):
+                self._defer_comment(item, result['item_id'], app_name)
+        else:
+            logger.error("Ошибка отправки элемента в Podio")
+        
+        return result
+    
+    def deliver_in_order(self, items: List[Dict[str, Any]]) -> int:
+        """
+        Доставка по порядку до первой ошибки
+        Возвращает число доставленных событий; остальные нужно повторить позже
+        """
+        delivered, _ = self.deliver_stream(items)
+        return delivered
+    
+    def deliver_stream(self, items: Iterable[Dict[str, Any]]) -> Tuple[int, bool]:
+        """
+        Доставка потока событий по порядку до первой ошибки без загрузки всего потока в память
+        Возвращает число доставленных событий и признак, что доставлены все
+        """
+        delivered = 0
+        for item in items:
+            if not self.deliver(item):
+                return delivered, False
+            delivered += 1
+        return delivered, True
+    
+    def deliver_all(self, items: Iterable[Dict[str, Any]]) -> List[Dict]:
+        """Доставка набора событий, возвращает список успешных результатов"""
+        results = []
+        for item in items:
+            result = self.deliver(item)
+            if result:
+                results.append(result)
+        return results
+    
+    def _defer_comment(self, item: Dict[str, Any], item_id: int, app_name: str) -> None:
+        """Постановка комментария к созданному элементу в фоновую полосу"""
+        comment = {
+            'event_type': COMMENT_EVENT,
+            'message_id': item.get('message_id'),
+            'item_id': item_id,
+            'app': app_name,
+            'message': item
+        }
+        
+        if self.deferred_sink is None or self.deferred_sink(comment) is None:
+            self._deliver_comment(comment)
+    
+    def _deliver_comment(self, comment: Dict[str, Any]) -> Optional[Dict]:
+        podio_client = self.podio_router.get_client(comment['app'])
+        if podio_client is None or not podio_client.add_message_comment(comment['item_id'], comment['message']):
+            logger.error(f"Ошибка добавления отложенного комментария к элементу {comment['item_id']}")
+            return None
+        return {'item_id': comment['item_id'], 'comment': True}
+    
+    def _release_held(self, message_id: str) -> None:
+        """Выпуск событий, ожидавших доставки сообщения, одной задачей фоновой полосы"""
+        entries = self.reorder_buffer.take(message_id)
+        if not entries:
+            return
+        
+        release = {
+            'event_type': RELEASE_EVENT,
+            'message_id': message_id,
+            'entries': entries
+        }
+        
+        if self.deferred_sink is None or self.deferred_sink(release) is None:
+            self._deliver_released(release)
+    
+    def _release_known(self, message_ids: List[str]) -> None:
+        """Выпуск событий сообщений, которые доставил другой процесс (соответствие messageId -> item_id общее)"""
+        for message_id in message_ids:
+            if self.item_map.get(message_id):
+                self._release_held(message_id)
+    
+    def _deliver_released(self, release: Dict[str, Any]) -> Dict:
+        delivered = self.reorder_buffer.deliver_entries(release['entries'])
+        return {'message_id': release['message_id'], 'released': delivered}
+    
+    def _deliver_held(self, item: Dict[str, Any]) -> Optional[Dict]:
+        """Доставка события из буфера: к исходному элементу, если он известен"""
+        mapping = self.item_map.get(item.get('message_id'))
+        if mapping:
+            return self._deliver_change(item, mapping)
+        
+        if self._is_status(item) and self.drop_orphan_statuses:
+            logger.warning(f"Статус {item.get('status')} для неизвестного сообщения {item.get('message_id')} пропущен")
+            return None
+        
+        # Сообщение не пришло за окно ожидания: событие записывается отдельным элементом, как без буфера
+        return self._create_item(item)
+    
+    def _is_status(self, item: Dict[str, Any]) -> bool:
+        return item.get('event_type') == 'status_update' and bool(item.get('message_id'))
+    
+    def _is_change(self, item: Dict[str, Any]) -> bool:
+        """Правка или удаление уже полученного сообщения"""
+        return item.get('event_type') == 'message' and bool(item.get('is_edited') or item.get('is_deleted'))
+    
+    def _deliver_change(self, item: Dict[str, Any], mapping: Dict[str, Any]) -> Optional[Dict]:
+        """Обновление исходного элемента вместо создания нового"""
+        if self._is_status(item):
+            return self._write_change(item, mapping)
+        
+        if item.get('is_deleted'):
+            # Удаление важнее ожидающей правки
+            self.edit_debouncer.cancel(item.get('message_id'))
+            return self._write_change(item, mapping)
+        
+        self.edit_debouncer.submit(item, mapping)
+        return {'item_id': mapping['item_id'], 'status': 'edit_scheduled'}
+    
+    def _write_change(self, item: Dict[str, Any], mapping: Dict[str, Any]) -> Optional[Dict]:
+        podio_client = self.podio_router.get_client(mapping['app'])
+        if podio_client is None:
+            logger.error(f"Неизвестное приложение Podio в соответствии: {mapping['app']}")
+            return None
+        
+        result = podio_client.update_message_item(mapping['item_id'], item)
+        
+        if result:
+            logger.info(f"Элемент {mapping['item_id']} обновлен для сообщения {item.get('message_id')}")
+        else:
+            logger.error(f"Ошибка обновления элемента {mapping['item_id']} в Podio")
+        
+        return result
+    
+    def close(self) -> None:
+        """Запись отложенных изменений перед остановкой"""
+        self.reorder_buffer.flush_all()
+        self.edit_debouncer.flush_all()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'edit_debouncer': self.edit_debouncer.get_stats(),
+            'reorder_buffer': self.reorder_buffer.get_stats()
+        }
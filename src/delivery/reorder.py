@@ -0,0 +1,182 @@
+"""
+Буфер переупорядочивания событий
+Статусы, правки и удаления сообщения, которое еще не доставлено в Podio,
+ждут доставки сообщения (или истечения окна) и выпускаются в порядке поступления
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Callable, List, Tuple, Optional
+
+from src.utils.tracing import tracer, get_correlation_id, correlation_scope
+
+logger = logging.getLogger(__name__)
+
+class ReorderBuffer:
+    """Ограниченный по времени и объему буфер событий для неизвестных messageId"""
+    
+    def __init__(self, deliver: Callable[[Dict[str, Any]], Any], window: float = None, max_events: int = None,
+                 poll: Optional[Callable[[List[str]], Any]] = None, poll_interval: float = None):
+        if window is None:
+            window = float(os.getenv('REORDER_WINDOW_SECONDS', 30))
+        if max_events is None:
+            max_events = int(os.getenv('REORDER_MAX_EVENTS', 10000))
+        if poll_interval is None:
+            poll_interval = float(os.getenv('REORDER_POLL_INTERVAL', 1.0))
+        
+        self.deliver = deliver
+        self.window = window
+        self.max_events = max(1, max_events)
+        # Буфер у каждого процесса свой: сообщение может доставить другой процесс,
+        # поэтому ожидаемые messageId периодически передаются в poll для проверки
+        self.poll = poll
+        self.poll_interval = poll_interval
+        self.held = 0
+        self.released = 0
+        self.expired = 0
+        self.evicted = 0
+        
+        # messageId -> (срок, [(событие, (correlation_id, время постановки))]);
+        # окно одинаково для всех, поэтому порядок вставки совпадает с порядком сроков
+        self._pending = OrderedDict()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._worker_pid = None
+    
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+    
+    def hold(self, item: Dict[str, Any]) -> bool:
+        """Постановка события в буфер; False, если буфер отключен"""
+        if not self.enabled:
+            return False
+        
+        self._ensure_worker()
+        message_id = item.get('message_id')
+        evicted = []
+        
+        with self._cond:
+            # При переполнении раньше срока выпускаются самые старые сообщения
+            while self._size >= self.max_events and self._pending:
+                evicted.append(self._pop_oldest())
+            
+            if message_id not in self._pending:
+                self._pending[message_id] = (time.monotonic() + self.window, [])
+            self._pending[message_id][1].append((item, (get_correlation_id(), time.time())))
+            self._size += 1
+            self.held += 1
+            self.evicted += len(evicted)
+            self._cond.notify()
+        
+        for entries in evicted:
+            logger.warning(f"Буфер переупорядочивания переполнен, событий выпущено досрочно: {len(entries)}")
+            self.deliver_entries(entries, expired=True)
+        return True
+    
+    def take(self, message_id: str) -> List[Tuple[Dict[str, Any], Any]]:
+        """Извлечение событий сообщения после его доставки (в порядке поступления)"""
+        with self._cond:
+            entry = self._pending.pop(message_id, None)
+            if entry is None:
+                return []
+            self._size -= len(entry[1])
+            return entry[1]
+    
+    def deliver_entries(self, entries: List[Tuple[Dict[str, Any], Any]], expired: bool = False) -> int:
+        """Доставка извлеченных событий по порядку"""
+        delivered = 0
+        for item, (correlation_id, held_at) in entries:
+            with correlation_scope(correlation_id):
+                tracer.record_span('reorder.wait', held_at, time.time(),
+                                   message_id=item.get('message_id'), expired=expired)
+                try:
+                    if self.deliver(item):
+                        delivered += 1
+                except Exception as e:
+                    logger.error(f"Ошибка доставки отложенного события {item.get('message_id')}: {str(e)}")
+        
+        with self._cond:
+            if expired:
+                self.expired += len(entries)
+            else:
+                self.released += len(entries)
+        return delivered
+    
+    def flush_all(self) -> int:
+        """Выпуск всех ожидающих событий (перед остановкой процесса)"""
+        with self._cond:
+            pending = [entries for _, entries in self._pending.values()]
+            self._pending = OrderedDict()
+            self._size = 0
+        
+        for entries in pending:
+            self.deliver_entries(entries, expired=True)
+        return sum(len(entries) for entries in pending)
+    
+    def _pop_oldest(self) -> List[Tuple[Dict[str, Any], Any]]:
+        _, (_, entries) = self._pending.popitem(last=False)
+        self._size -= len(entries)
+        return entries
+    
+    def _ensure_worker(self) -> None:
+        if self._worker_pid == os.getpid():
+            return
+        
+        with self._cond:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            self._pending = OrderedDict()
+            self._size = 0
+            threading.Thread(target=self._run, name='reorder-buffer', daemon=True).start()
+    
+    def _run(self) -> None:
+        polling = self.poll is not None and self.poll_interval > 0
+        next_poll = time.monotonic() + self.poll_interval
+        while True:
+            entries = None
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._pending:
+                        deadline = next(iter(self._pending.values()))[0]
+                        if deadline <= now:
+                            entries = self._pop_oldest()
+                            break
+                        if polling and next_poll <= now:
+                            message_ids = list(self._pending)
+                            next_poll = now + self.poll_interval
+                            break
+                        timeout = min(deadline, next_poll) - now if polling else deadline - now
+                    else:
+                        timeout = None
+                    self._cond.wait(timeout)
+            
+            if entries is None:
+                try:
+                    self.poll(message_ids)
+                except Exception as e:
+                    logger.error(f"Ошибка проверки ожидаемых сообщений: {str(e)}")
+                continue
+            
+            logger.info(f"Истекло ожидание сообщения {entries[0][0].get('message_id')}, событий: {len(entries)}")
+            self.deliver_entries(entries, expired=True)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            oldest_deadline = next(iter(self._pending.values()))[0] if self._pending else None
+            return {
+                'window': self.window,
+                'max_events': self.max_events,
+                'events': self._size,
+                'messages': len(self._pending),
+                'oldest_age': round(time.monotonic() - oldest_deadline + self.window, 3) if oldest_deadline else 0.0,
+                'held': self.held,
+                'released': self.released,
+                'expired': self.expired,
+                'evicted': self.evicted
+            }
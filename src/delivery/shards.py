@@ -0,0 +1,540 @@
+"""
+Шардирование доставки между процессами и хостами
+Вебхуки из спула разбиваются на шарды по chat_id; каждый шард в любой момент
+обрабатывает один обработчик, владеющий арендой шарда. Аренды продлеваются
+фоновым потоком и переходят к другим обработчикам, если владелец перестал отвечать.
+"""
+
+import os
+import json
+import time
+import socket
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Any, List, Set, Iterable
+
+from src.utils.tracing import tracer, correlation_scope
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних messageId -> chatId помнит разбиение (для статусов без chatId; старые ищутся в истории)
+CHAT_CACHE_SIZE = 10000
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def shard_for(chat_id: str, shard_count: int) -> int:
+    """Шард чата; число шардов фиксировано, поэтому чат всегда попадает в один шард"""
+    return _hash(str(chat_id)) % shard_count
+
+def owner_for(shard: int, workers: List[str]) -> Optional[str]:
+    """
+    Владелец шарда по взвешенному хешированию (rendezvous): при появлении или пропаже
+    обработчика переходят только шарды, которые он получает или терял
+    """
+    if not workers:
+        return None
+    return max(workers, key=lambda worker: _hash(f'{shard}:{worker}'))
+
+class ShardLeases:
+    """Аренды шардов и сигналы жизни обработчиков в общем каталоге"""
+    
+    def __init__(self, root: str, worker_id: str, shard_count: int, ttl: float):
+        self.root = root
+        self.worker_id = worker_id
+        self.shard_count = shard_count
+        self.ttl = ttl
+        self.owned: Set[int] = set()
+        self.desired: Optional[Set[int]] = None
+        self.busy: Set[int] = set()
+        self.lost = 0
+        
+        self._lock = threading.Lock()
+        self._heartbeat_pid = None
+        self._stopped = threading.Event()
+        
+        for name in ('leases', 'workers'):
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+    
+    def _lease_path(self, shard: int) -> str:
+        return os.path.join(self.root, 'leases', f'{shard:04d}.lease')
+    
+    def _worker_path(self, worker_id: str) -> str:
+        return os.path.join(self.root, 'workers', f'{worker_id}.json')
+    
+    @staticmethod
+    def _read(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    def _write(self, path: str, exclusive: bool = False) -> bool:
+        record = {'owner': self.worker_id, 'expires_at': time.time() + self.ttl}
+        if exclusive:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(record, f)
+            return True
+        
+        tmp_path = f'{path}.{self.worker_id}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+        return True
+    
+    def live_workers(self) -> List[str]:
+        """Обработчики с непросроченным сигналом жизни"""
+        now = time.time()
+        workers = []
+        for name in os.listdir(os.path.join(self.root, 'workers')):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.root, 'workers', name)
+            record = self._read(path)
+            if record and record['expires_at'] > now:
+                workers.append(record['owner'])
+            elif record and record['expires_at'] < now - self.ttl * 10:
+                # Давно остановленный обработчик
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return sorted(workers)
+    
+    def desired_shards(self) -> Set[int]:
+        """Шарды, которые должен обрабатывать этот обработчик при текущем составе"""
+        workers = self.live_workers()
+        if self.worker_id not in workers:
+            workers.append(self.worker_id)
+        desired = {shard for shard in range(self.shard_count) if owner_for(shard, workers) == self.worker_id}
+        
+        with self._lock:
+            self.desired = desired
+        return desired
+    
+    def acquire(self, shard: int) -> bool:
+        """Захват свободной или просроченной аренды шарда"""
+        path = self._lease_path(shard)
+        if self._write(path, exclusive=True):
+            with self._lock:
+                self.owned.add(shard)
+            return True
+        
+        lease = self._read(path)
+        if lease is None:
+            return False
+        if lease['expires_at'] > time.time():
+            if lease['owner'] != self.worker_id:
+                return False
+            with self._lock:
+                self.owned.add(shard)
+            return True
+        
+        # Просроченную аренду переносим в сторону: переименование удается только одному претенденту
+        stale_path = f'{path}.{self.worker_id}.stale'
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            return False
+        
+        taken = self._read(stale_path)
+        if taken and taken['expires_at'] > time.time() and taken['owner'] != self.worker_id:
+            # Между чтением и переименованием аренду успел взять другой обработчик - возвращаем ее
+            try:
+                os.link(stale_path, path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        
+        if not self._write(path, exclusive=True):
+            return False
+        logger.warning(f"Шард {shard} перехвачен у {lease['owner']} после истечения аренды")
+        with self._lock:
+            self.owned.add(shard)
+        return True
+    
+    def release(self, shard: int) -> None:
+        """Освобождение аренды (шард переходит другому обработчику)"""
+        with self._lock:
+            self.owned.discard(shard)
+        
+        path = self._lease_path(shard)
+        lease = self._read(path)
+        if lease and lease['owner'] == self.worker_id:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    
+    def begin(self, shard: int) -> bool:
+        """
+        Начало обработки файла шарда; False, если аренды нет
+        или по составу шард уходит другому обработчику
+        """
+        with self._lock:
+            if shard not in self.owned or (self.desired is not None and shard not in self.desired):
+                return False
+            self.busy.add(shard)
+            return True
+    
+    def end(self, shard: int) -> None:
+        with self._lock:
+            self.busy.discard(shard)
+    
+    def owned_shards(self) -> Set[int]:
+        with self._lock:
+            return set(self.owned)
+    
+    def renew(self) -> None:
+        """Сигнал жизни и продление аренд; аренды, перехваченные другими, снимаются"""
+        self._write(self._worker_path(self.worker_id))
+        desired = self.desired_shards()
+        
+        # Новый обработчик получает свои шарды после текущего файла, а не после всего цикла
+        with self._lock:
+            surrendered = [shard for shard in self.owned if shard not in desired and shard not in self.busy]
+        for shard in surrendered:
+            self.release(shard)
+            logger.info(f"Шард {shard} передан другому обработчику")
+        
+        with self._lock:
+            owned = list(self.owned)
+        
+        for shard in owned:
+            lease = self._read(self._lease_path(shard))
+            if lease is None or lease['owner'] != self.worker_id:
+                logger.error(f"Аренда шарда {shard} потеряна")
+                with self._lock:
+                    self.owned.discard(shard)
+                    self.lost += 1
+                continue
+            self._write(self._lease_path(shard))
+    
+    def start(self) -> None:
+        """Фоновое продление, не зависящее от длительности доставки"""
+        if self._heartbeat_pid == os.getpid():
+            return
+        self._heartbeat_pid = os.getpid()
+        self.renew()
+        threading.Thread(target=self._run, name='shard-leases', daemon=True).start()
+    
+    def _run(self) -> None:
+        while not self._stopped.wait(self.ttl / 3):
+            try:
+                self.renew()
+            except Exception as e:
+                logger.error(f"Ошибка продления аренд шардов: {str(e)}")
+    
+    def stop(self) -> None:
+        """Освобождение всех аренд при остановке, чтобы шарды сразу перешли другим"""
+        self._stopped.set()
+        with self._lock:
+            owned = list(self.owned)
+        for shard in owned:
+            self.release(shard)
+        try:
+            os.remove(self._worker_path(self.worker_id))
+        except FileNotFoundError:
+            pass
+
+class _ShardFile:
+    """Файл шарда, который пишется по одному событию и появляется в каталоге шарда целиком"""
+    
+    def __init__(self, tmp_path: str, path: str, header: Dict[str, Any]):
+        self.tmp_path = tmp_path
+        self.path = path
+        self.count = 0
+        self._file = open(tmp_path, 'w', encoding='utf-8')
+        self._file.write(json.dumps(header, ensure_ascii=False)[:-1] + ', "items": [')
+    
+    def write(self, item: Dict[str, Any]) -> None:
+        if self.count:
+            self._file.write(', ')
+        json.dump(item, self._file, ensure_ascii=False)
+        self.count += 1
+    
+    def commit(self) -> None:
+        self._file.write(']}')
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+    
+    def discard(self) -> None:
+        """Удаление файла (и незавершенного, и уже появившегося в каталоге шарда)"""
+        self._file.close()
+        for path in (self.tmp_path, self.path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+class ShardWorker:
+    """Обработчик спула: разбиение вебхуков на шарды и доставка своих шардов по порядку"""
+    
+    def __init__(self, spool, handler, pipeline, store=None, worker_id: str = None,
+                 shard_count: int = None, lease_ttl: float = None, threads: int = None):
+        if shard_count is None:
+            shard_count = int(os.getenv('SHARD_COUNT', 64))
+        if lease_ttl is None:
+            lease_ttl = float(os.getenv('SHARD_LEASE_TTL', 30))
+        if threads is None:
+            threads = int(os.getenv('SHARD_THREADS', 4))
+        # Файл шарда читается целиком при доставке, поэтому большой вебхук делится на части
+        self.file_max_items = int(os.getenv('SHARD_FILE_MAX_ITEMS', 200))
+        
+        self.spool = spool
+        self.handler = handler
+        self.pipeline = pipeline
+        self.store = store
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.shard_count = shard_count
+        self.shards_dir = os.path.join(spool.spool_dir, 'shards')
+        self.leases = ShardLeases(self.shards_dir, self.worker_id, shard_count, lease_ttl)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix='shard')
+        
+        self.split_webhooks = 0
+        self.delivered_files = 0
+        self.failed_files = 0
+        
+        for name in ('tmp', 'failed'):
+            os.makedirs(os.path.join(self.shards_dir, name), exist_ok=True)
+    
+    def _shard_dir(self, shard: int) -> str:
+        return os.path.join(self.shards_dir, f'{shard:04d}')
+    
+    def run_once(self, max_files: int = 20) -> int:
+        """Один цикл: состав и аренды, разбиение новых вебхуков, доставка своих шардов"""
+        self.leases.start()
+        self.rebalance()
+        self.spool.recover()
+        self.split_pending()
+        
+        # Вебхуки, принятые раньше еще не разобранного, ждут его, чтобы не нарушить порядок в чате
+        barrier = self.spool.oldest_pending()
+        shards = [shard for shard in sorted(self.leases.owned_shards()) if self._ready_files(shard, barrier)]
+        futures = [self.executor.submit(self._drain_shard, shard, barrier, max_files) for shard in shards]
+        return sum(future.result() for future in futures)
+    
+    def rebalance(self) -> None:
+        """Освобождение чужих по составу шардов и захват своих"""
+        desired = self.leases.desired_shards()
+        owned = self.leases.owned_shards()
+        
+        for shard in sorted(owned - desired):
+            self.leases.release(shard)
+            logger.info(f"Шард {shard} передан другому обработчику")
+        
+        acquired = [shard for shard in sorted(desired - owned) if self.leases.acquire(shard)]
+        if acquired:
+            logger.info(f"Обработчик {self.worker_id} получил шарды: {len(acquired)}, всего {len(self.leases.owned_shards())}")
+    
+    def split_pending(self) -> int:
+        """Разбиение вебхуков из спула на файлы шардов"""
+        split = 0
+        while True:
+            record = self.spool.claim_next()
+            if record is None:
+                return split
+            
+            name = record['name']
+            try:
+                # Уже разобранные события (сохраненные при остановке сервера) в историю не пишутся повторно
+                items = record.get('items')
+                if items is not None:
+                    self._write_shards(name, record, items)
+                elif record.get('body_file'):
+                    # Большой вебхук: тело в отдельном файле, события разбираются и раскладываются по одному
+                    with self.spool.open_body(record) as body:
+                        events = self.handler.process_webhook_stream(body)
+                        if self.store is not None:
+                            events = self.store.record_stream(events)
+                        self._write_shards(name, record, events)
+                else:
+                    items = self.handler.process_webhook(json.loads(record['body']))
+                    if self.store is not None:
+                        self.store.add_events(items)
+                    self._write_shards(name, record, items)
+                self.spool.complete(name)
+                self.split_webhooks += 1
+                split += 1
+            except Exception as e:
+                logger.error(f"Ошибка разбиения вебхука {name} на шарды: {str(e)}")
+                self.spool.fail(name)
+    
+    def _shard_of(self, item: Dict[str, Any], chats: 'OrderedDict[str, str]') -> int:
+        chat_id = item.get('chat_id') or chats.get(item.get('message_id'))
+        if not chat_id and self.store is not None:
+            # Статус без chatId идет в шард своего сообщения
+            chat_id = self.store.get_chat_id(item.get('message_id'))
+        return shard_for(chat_id or item.get('message_id', ''), self.shard_count)
+    
+    def _open_shard_file(self, shard: int, name: str, part: int, record: Dict[str, Any]) -> _ShardFile:
+        # Имя файла шарда совпадает с именем вебхука (части - с номером): повторное разбиение
+        # после сбоя перезапишет те же файлы, а части сортируются после первой и перед следующим вебхуком
+        file_name = name if part == 0 else f'{name}.{part:04d}'
+        os.makedirs(self._shard_dir(shard), exist_ok=True)
+        return _ShardFile(
+            os.path.join(self.shards_dir, 'tmp', f'{shard:04d}-{file_name}'),
+            os.path.join(self._shard_dir(shard), file_name),
+            {'received_at': record.get('received_at'), 'correlation_id': record.get('correlation_id')}
+        )
+    
+    def _write_shards(self, name: str, record: Dict[str, Any], items: Iterable[Dict[str, Any]]) -> None:
+        """
+        Раскладка событий по файлам шардов по мере разбора: в памяти только открытые файлы
+        и последние CHAT_CACHE_SIZE соответствий messageId -> chatId
+        """
+        chats = OrderedDict()
+        files = {}
+        parts = {}
+        written = []
+        try:
+            for item in items:
+                if item.get('chat_id') and item.get('message_id'):
+                    chats[item['message_id']] = item['chat_id']
+                    if len(chats) > CHAT_CACHE_SIZE:
+                        chats.popitem(last=False)
+                
+                shard = self._shard_of(item, chats)
+                shard_file = files.get(shard)
+                if shard_file is not None and shard_file.count >= self.file_max_items:
+                    shard_file.commit()
+                    shard_file = None
+                if shard_file is None:
+                    part = parts[shard] = parts.get(shard, -1) + 1
+                    shard_file = files[shard] = self._open_shard_file(shard, name, part, record)
+                    written.append(shard_file)
+                shard_file.write(item)
+            
+            for shard_file in files.values():
+                shard_file.commit()
+        except Exception:
+            # Вебхук уходит в failed целиком: готовые части не должны доставляться без остальных
+            for shard_file in written:
+                shard_file.discard()
+            raise
+    
+    def _ready_files(self, shard: int, barrier: Optional[str]) -> List[str]:
+        try:
+            names = sorted(os.listdir(self._shard_dir(shard)))
+        except FileNotFoundError:
+            return []
+        return [name for name in names if barrier is None or name < barrier]
+    
+    def _drain_shard(self, shard: int, barrier: Optional[str], max_files: int) -> int:
+        """
+        Последовательная доставка файлов шарда (порядок внутри чата сохраняется)
+        При ошибке файл остается первым в шарде и повторяется с задержкой
+        """
+        delivered = 0
+        for name in self._ready_files(shard, barrier)[:max_files]:
+            path = os.path.join(self._shard_dir(shard), name)
+            try:
+                # Файл ждет повторной попытки - следующие файлы шарда ждут вместе с ним
+                if os.path.getmtime(path) > time.time():
+                    break
+            except FileNotFoundError:
+                continue
+            
+            # Аренда могла перейти другому обработчику во время доставки предыдущего файла
+            if not self.leases.begin(shard):
+                break
+            
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+                
+                with correlation_scope(record.get('correlation_id')):
+                    if not record.get('attempts'):
+                        tracer.record_span('shard.wait', record['received_at'], time.time(), shard=shard, spool_file=name)
+                    items = record['items']
+                    sent = self.pipeline.deliver_in_order(items)
+                
+                if sent < len(items):
+                    if self._retry_file(shard, name, record, items[sent:]):
+                        break
+                    continue
+                
+                os.remove(path)
+                self.delivered_files += 1
+                delivered += 1
+            except Exception as e:
+                logger.error(f"Ошибка доставки файла {name} шарда {shard}: {str(e)}")
+                self._fail_file(shard, name)
+            finally:
+                self.leases.end(shard)
+        return delivered
+    
+    def _retry_file(self, shard: int, name: str, record: Dict[str, Any], items: List[Dict[str, Any]]) -> bool:
+        """
+        Сохранение недоставленных событий в файле шарда с задержкой повтора (как в спуле)
+        Возвращает False, если попытки исчерпаны и файл перенесен в failed
+        """
+        attempts = record.get('attempts', 0) + 1
+        path = os.path.join(self._shard_dir(shard), name)
+        tmp_path = os.path.join(self.shards_dir, 'tmp', f'{shard:04d}-{name}')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(record, items=items, attempts=attempts), f, ensure_ascii=False)
+        
+        if attempts >= self.spool.max_attempts:
+            os.replace(tmp_path, path)
+            logger.error(f"Файл {name} шарда {shard}: попытки доставки исчерпаны ({attempts}), перенос в failed")
+            self._fail_file(shard, name)
+            return False
+        
+        delay = min(self.spool.retry_backoff * 2 ** (attempts - 1), self.spool.retry_backoff_max)
+        retry_at = time.time() + delay
+        os.utime(tmp_path, (retry_at, retry_at))
+        os.replace(tmp_path, path)
+        logger.warning(f"Файл {name} шарда {shard}: недоставлено событий {len(items)}, повтор через {delay:.0f} сек")
+        return True
+    
+    def _fail_file(self, shard: int, name: str) -> None:
+        try:
+            os.replace(os.path.join(self._shard_dir(shard), name),
+                       os.path.join(self.shards_dir, 'failed', f'{shard:04d}-{name}'))
+        except FileNotFoundError:
+            pass
+        self.failed_files += 1
+    
+    def pending_files(self) -> int:
+        """Файлы шардов, которые можно доставить сейчас (шард, ожидающий повтора, не считается)"""
+        now = time.time()
+        pending = 0
+        for name in os.listdir(self.shards_dir):
+            if not name.isdigit():
+                continue
+            files = sorted(os.listdir(os.path.join(self.shards_dir, name)))
+            try:
+                if files and os.path.getmtime(os.path.join(self.shards_dir, name, files[0])) <= now:
+                    pending += len(files)
+            except FileNotFoundError:
+                pending += len(files)
+        return pending
+    
+    def stop(self) -> None:
+        """Остановка: завершение текущих доставок и освобождение аренд"""
+        self.executor.shutdown(wait=True)
+        self.pipeline.close()
+        self.leases.stop()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'worker_id': self.worker_id,
+            'shard_count': self.shard_count,
+            'owned_shards': len(self.leases.owned_shards()),
+            'live_workers': len(self.leases.live_workers()),
+            'split_webhooks': self.split_webhooks,
+            'delivered_files': self.delivered_files,
+            'failed_files': self.failed_files,
+            'lost_leases': self.leases.lost
+        }
@@ -0,0 +1,292 @@
+"""
+Файловая очередь (спул) входящих вебхуков
+Используется для отложенной доставки, когда сервер перегружен
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+from typing import Dict, Optional, Any, List, IO
+
+logger = logging.getLogger(__name__)
+
+class WebhookSpool:
+    """Очередь вебхуков на диске: incoming -> processing -> удаление"""
+    
+    def __init__(self, spool_dir: str = None):
+        if spool_dir is None:
+            spool_dir = os.getenv('SPOOL_DIR', '')
+        
+        self.spool_dir = spool_dir
+        self.claim_timeout = float(os.getenv('SPOOL_CLAIM_TIMEOUT', 300))
+        self.max_attempts = int(os.getenv('SPOOL_MAX_ATTEMPTS', 8))
+        self.retry_backoff = float(os.getenv('SPOOL_RETRY_BACKOFF', 30))
+        self.retry_backoff_max = float(os.getenv('SPOOL_RETRY_BACKOFF_MAX', 1800))
+        
+        self._age_cache = (0.0, 0.0)
+        
+        if self.enabled:
+            for name in ('tmp', 'incoming', 'processing', 'failed', 'bodies'):
+                os.makedirs(os.path.join(self.spool_dir, name), exist_ok=True)
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.spool_dir)
+    
+    def _path(self, state: str, name: str = '') -> str:
+        return os.path.join(self.spool_dir, state, name)
+    
+    def put(self, body: bytes, headers: Optional[Dict[str, str]] = None,
+            correlation_id: Optional[str] = None) -> Optional[str]:
+        """
+        Атомарная запись тела вебхука в очередь
+        Возвращает имя файла или None при ошибке
+        """
+        if not self.enabled:
+            return None
+        
+        try:
+            # Имя файла начинается с времени приема, чтобы сохранялся порядок
+            name = f"{time.time_ns():020d}-{uuid.uuid4().hex}.json"
+            record = {
+                'received_at': time.time(),
+                'correlation_id': correlation_id,
+                'headers': headers or {},
+                'body': body.decode('utf-8')
+            }
+            
+            tmp_path = self._path('tmp', name)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path('incoming', name))
+            
+            return name
+        
+        except Exception as e:
+            logger.error(f"Ошибка записи вебхука в очередь: {str(e)}")
+            return None
+    
+    def put_stream(self, body: IO[bytes], headers: Optional[Dict[str, str]] = None,
+                   correlation_id: Optional[str] = None) -> Optional[str]:
+        """
+        Запись большого вебхука в очередь без загрузки тела в память
+        Тело копируется в bodies/, запись очереди ссылается на него (body_file)
+        """
+        if not self.enabled:
+            return None
+        
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex}.json"
+        body_path = self._path('bodies', name)
+        try:
+            tmp_path = self._path('tmp', f'{name}.body')
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(body, f)
+            os.replace(tmp_path, body_path)
+            
+            record = {
+                'received_at': time.time(),
+                'correlation_id': correlation_id,
+                'headers': headers or {},
+                'body_file': name
+            }
+            tmp_path = self._path('tmp', name)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path('incoming', name))
+            
+            return name
+        
+        except Exception as e:
+            logger.error(f"Ошибка записи вебхука в очередь: {str(e)}")
+            try:
+                os.remove(body_path)
+            except FileNotFoundError:
+                pass
+            return None
+    
+    def put_items(self, items: List[Dict[str, Any]], correlation_id: Optional[str] = None) -> Optional[str]:
+        """
+        Запись уже разобранных событий (например, оставшихся в полосах при остановке воркера)
+        Обрабатывается как повторная попытка: разбор и запись в историю не повторяются
+        """
+        if not self.enabled:
+            return None
+        
+        try:
+            name = f"{time.time_ns():020d}-{uuid.uuid4().hex}.json"
+            record = {
+                'received_at': time.time(),
+                'correlation_id': correlation_id,
+                'headers': {},
+                'items': items
+            }
+            
+            tmp_path = self._path('tmp', name)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path('incoming', name))
+            
+            return name
+        
+        except Exception as e:
+            logger.error(f"Ошибка записи событий в очередь: {str(e)}")
+            return None
+    
+    def open_body(self, record: Dict[str, Any]) -> IO[bytes]:
+        """Тело большого вебхука, записанного через put_stream()"""
+        return open(self._path('bodies', record['body_file']), 'rb')
+    
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """Захват самого старого вебхука из очереди"""
+        if not self.enabled:
+            return None
+        
+        now = time.time()
+        for name in sorted(os.listdir(self._path('incoming'))):
+            path = self._path('incoming', name)
+            try:
+                # Время изменения в будущем - файл ждет повторной попытки
+                if os.path.getmtime(path) > now:
+                    continue
+                # Время захвата записывается до переноса: recover() отсчитывает SPOOL_CLAIM_TIMEOUT
+                # от захвата, а не от записи вебхука
+                os.utime(path)
+                os.replace(path, self._path('processing', name))
+            except FileNotFoundError:
+                # Файл уже забрал другой обработчик
+                continue
+            
+            try:
+                with open(self._path('processing', name), 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+                record['name'] = name
+                return record
+            except Exception as e:
+                logger.error(f"Поврежденный файл очереди {name}: {str(e)}")
+                self.fail(name)
+        
+        return None
+    
+    def complete(self, name: str) -> None:
+        """Удаление успешно обработанного вебхука"""
+        for path in (self._path('processing', name), self._path('bodies', name)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    
+    def retry(self, record: Dict[str, Any], items: Optional[List[Dict[str, Any]]] = None,
+              delivered: int = 0) -> bool:
+        """
+        Возврат недоставленных событий в очередь с экспоненциальной задержкой
+        items - недоставленные события; для большого вебхука (body_file) вместо них передается число
+        доставленных событий delivered: тело остается в bodies, следующая попытка пропускает их при разборе
+        Файл сохраняет имя (и место в очереди); после SPOOL_MAX_ATTEMPTS попыток переносится в failed
+        Возвращает False, если попытки исчерпаны
+        """
+        name = record['name']
+        attempts = record.get('attempts', 0) + 1
+        updated = {key: value for key, value in record.items() if key != 'name'}
+        if items is not None:
+            updated['items'] = items
+        else:
+            updated['delivered'] = record.get('delivered', 0) + delivered
+        updated['attempts'] = attempts
+        
+        tmp_path = self._path('tmp', name)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(updated, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path('processing', name))
+        
+        if attempts >= self.max_attempts:
+            logger.error(f"Вебхук {name}: попытки доставки исчерпаны ({attempts}), перенос в failed")
+            self.fail(name)
+            return False
+        
+        # Время изменения в будущем - claim_next() не возьмет файл до этого момента
+        delay = min(self.retry_backoff * 2 ** (attempts - 1), self.retry_backoff_max)
+        retry_at = time.time() + delay
+        os.utime(self._path('processing', name), (retry_at, retry_at))
+        os.replace(self._path('processing', name), self._path('incoming', name))
+        if items is not None:
+            logger.warning(f"Вебхук {name}: недоставлено событий {len(items)}, повтор через {delay:.0f} сек")
+        else:
+            logger.warning(f"Вебхук {name}: доставлено событий {updated['delivered']}, повтор остатка через {delay:.0f} сек")
+        return True
+    
+    def fail(self, name: str) -> None:
+        """Перенос необрабатываемого вебхука в failed"""
+        try:
+            os.replace(self._path('processing', name), self._path('failed', name))
+        except FileNotFoundError:
+            pass
+    
+    def recover(self) -> int:
+        """Возврат в очередь вебхуков, захваченных больше SPOOL_CLAIM_TIMEOUT назад (обработчик пропал)"""
+        if not self.enabled:
+            return 0
+        
+        recovered = 0
+        now = time.time()
+        for name in os.listdir(self._path('processing')):
+            path = self._path('processing', name)
+            try:
+                if now - os.path.getmtime(path) >= self.claim_timeout:
+                    os.replace(path, self._path('incoming', name))
+                    recovered += 1
+            except FileNotFoundError:
+                continue
+        
+        if recovered:
+            logger.warning(f"Возвращено в очередь зависших вебхуков: {recovered}")
+        return recovered
+    
+    def oldest_pending(self) -> Optional[str]:
+        """Имя самого старого вебхука, который еще не обработан (incoming или processing)"""
+        if not self.enabled:
+            return None
+        names = os.listdir(self._path('incoming')) + os.listdir(self._path('processing'))
+        return min(names) if names else None
+    
+    def depth(self) -> int:
+        """Количество вебхуков, ожидающих обработки"""
+        if not self.enabled:
+            return 0
+        return len(os.listdir(self._path('incoming')))
+    
+    def oldest_age(self) -> float:
+        """
+        Сколько ждет самый старый вебхук, который можно взять сейчас (секунды), кэшируется на 1 секунду
+        Вебхук, ожидающий повторной попытки, не учитывается, а после нее отсчитывается от времени повтора:
+        одно событие, которое Podio раз за разом отклоняет, не должно включать отказ в приеме
+        """
+        if not self.enabled:
+            return 0.0
+        
+        checked_at, age = self._age_cache
+        now = time.time()
+        if now - checked_at < 1.0:
+            return age
+        
+        oldest = None
+        for name in sorted(os.listdir(self._path('incoming'))):
+            received_at = int(name.split('-', 1)[0]) / 1e9
+            # Файлы упорядочены по времени приема, а доступными становятся не раньше него
+            if oldest is not None and received_at >= oldest:
+                break
+            try:
+                mtime = os.path.getmtime(self._path('incoming', name))
+            except FileNotFoundError:
+                continue
+            if mtime > now:
+                continue
+            claimable_at = max(received_at, mtime)
+            if oldest is None or claimable_at < oldest:
+                oldest = claimable_at
+        
+        age = max(0.0, now - oldest) if oldest is not None else 0.0
+        self._age_cache = (now, age)
+        return age
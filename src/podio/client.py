@@ -4,30 +4,121 @@
 """
 
 import os
+import re
+import html
 import json
+import time
 import logging
+import threading
 from datetime import datetime
-from typing import Dict, Optional, Any, List
+from typing import Dict, Optional, Any, List, Tuple
 import requests
+from requests.adapters import HTTPAdapter
+
+from src.podio.limits import RateBudget, AdaptiveLimiter
+from src.utils.profiling import profiler
+from src.utils.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+# Коды ответа Podio при превышении лимита запросов
+THROTTLE_STATUS_CODES = (420, 429)
+
+# Режимы доставки: элемент + комментарий (два запроса) или элемент с форматированным текстом (один запрос)
+DELIVERY_MODE_COMMENT = 'comment'
+DELIVERY_MODE_EMBEDDED = 'embedded'
+
+# Значение поля message-deleted для удаленных сообщений
+DELETED_MARKER = 'Удалено'
+
+# Значения поля message-status для статусов Wazzup
+MESSAGE_STATUS_LABELS = {
+    'delivered': 'Доставлено',
+    'read': 'Прочитано',
+    'error': 'Ошибка',
+    'edited': 'Изменено'
+}
+
 class PodioClient:
     """Клиент для работы с Podio API"""
     
-    def __init__(self):
-        self.client_id = os.getenv('PODIO_CLIENT_ID', '')
-        self.client_secret = os.getenv('PODIO_CLIENT_SECRET', '')
-        self.app_id = os.getenv('PODIO_APP_ID', '')
-        self.app_token = os.getenv('PODIO_APP_TOKEN', '')
+    def __init__(self, app_id: str = None, app_token: str = None,
+                 client_id: str = None, client_secret: str = None,
+                 name: str = 'default', rate_limit_per_hour: float = None,
+                 max_concurrency: int = None, delivery_mode: str = None):
+        """
+        Параметры, не переданные явно, берутся из переменных окружения.
+        Каждый экземпляр имеет собственный пул соединений, токен,
+        бюджет запросов и ограничение одновременных запросов.
+        """
+        self.name = name
+        self.client_id = client_id or os.getenv('PODIO_CLIENT_ID', '')
+        self.client_secret = client_secret or os.getenv('PODIO_CLIENT_SECRET', '')
+        self.app_id = app_id or os.getenv('PODIO_APP_ID', '')
+        self.app_token = app_token or os.getenv('PODIO_APP_TOKEN', '')
         self.space_id = os.getenv('PODIO_SPACE_ID', '')
         
-        self.base_url = 'https://api.podio.com'
+        self.base_url = os.getenv('PODIO_API_URL', 'https://api.podio.com').rstrip('/')
         self.access_token = None
         self.token_expires_at = None
         
-        # Инициализация подключения
-        self._authenticate()
+        if delivery_mode is None:
+            delivery_mode = os.getenv('PODIO_DELIVERY_MODE', DELIVERY_MODE_COMMENT).lower()
+        if delivery_mode not in (DELIVERY_MODE_COMMENT, DELIVERY_MODE_EMBEDDED):
+            logger.warning(f"Неизвестный режим доставки {delivery_mode}, используется {DELIVERY_MODE_COMMENT}")
+            delivery_mode = DELIVERY_MODE_COMMENT
+        
+        self.delivery_mode = delivery_mode
+        # В режиме embedded комментарий можно отложить в фоновую полосу доставки
+        self.defer_comment = os.getenv('PODIO_DEFERRED_COMMENT', 'False').lower() == 'true'
+        self._formatter = None
+        
+        if rate_limit_per_hour is None:
+            rate_limit_per_hour = float(os.getenv('PODIO_RATE_LIMIT_PER_HOUR', 5000))
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv('PODIO_MAX_CONCURRENCY', 8))
+        
+        self.rate_budget = RateBudget(rate_limit_per_hour)
+        # Потоки доставки общие для всех приложений: ожидание слота или бюджета одного приложения ограничено
+        self.acquire_timeout = float(os.getenv('PODIO_ACQUIRE_TIMEOUT', 2))
+        # max_concurrency - жесткий потолок, фактический лимит подстраивается под задержку и ошибки Podio
+        self.concurrency = AdaptiveLimiter(
+            floor=int(os.getenv('PODIO_CONCURRENCY_MIN', 1)),
+            ceiling=max_concurrency,
+            initial=int(os.getenv('PODIO_CONCURRENCY_INITIAL', 4)),
+            timeout=self.acquire_timeout,
+            latency_tolerance=float(os.getenv('PODIO_LATENCY_TOLERANCE', 2.0))
+        )
+        
+        # Пул соединений и токен создаются в процессе, который выполняет запросы:
+        # при запуске gunicorn с --preload мастер не открывает сокетов и не обращается к Podio
+        self.pool_size = max_concurrency
+        # Ограничение времени запроса: занятый слот всегда освобождается, и ожидающие потоки продвигаются
+        self.request_timeout = float(os.getenv('PODIO_REQUEST_TIMEOUT', 30))
+        self._session = None
+        self._session_pid = None
+        self._auth_lock = threading.RLock()
+    
+    @property
+    def session(self) -> requests.Session:
+        """Собственный пул соединений приложения в текущем процессе"""
+        return self._ensure_session()
+    
+    def _ensure_session(self) -> requests.Session:
+        if self._session_pid != os.getpid():
+            with self._auth_lock:
+                if self._session_pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    
+                    # Токен, полученный до fork, воркер не использует
+                    self.access_token = None
+                    self.token_expires_at = None
+                    self._session = session
+                    self._session_pid = os.getpid()
+        return self._session
     
     def _authenticate(self) -> bool:
         """Аутентификация в Podio API"""
@@ -47,7 +138,7 @@ class PodioClient:
                 'client_secret': self.client_secret
             }
             
-            response = requests.post(url, data=data)
+            response = self.session.post(url, data=data, timeout=self.request_timeout)
             
             if response.status_code == 200:
                 token_data = response.json()
@@ -70,22 +161,68 @@ class PodioClient:
     
     def _ensure_authenticated(self) -> bool:
         """Проверка и обновление токена при необходимости"""
-        if not self.access_token:
-            return self._authenticate()
+        # После fork сбрасывает токен, унаследованный от родителя
+        self._ensure_session()
+        if self._token_valid():
+            return True
         
-        # Проверяем, не истек ли токен
-        if self.token_expires_at and datetime.utcnow() >= self.token_expires_at:
-            logger.info("Токен истек, обновляем...")
+        # Токен получает один поток, остальные ждут его результата
+        with self._auth_lock:
+            if self._token_valid():
+                return True
+            if self.access_token:
+                logger.info("Токен истек, обновляем...")
             return self._authenticate()
-        
-        return True
+    
+    def _token_valid(self) -> bool:
+        if not self.access_token:
+            return False
+        return not self.token_expires_at or datetime.utcnow() < self.token_expires_at
+    
+    def warm_up(self) -> bool:
+        """Получение токена заранее, чтобы первый вебхук воркера не ждал аутентификации"""
+        return self._ensure_authenticated()
     
     def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Optional[Dict]:
-        """Выполнение запроса к Podio API"""
+        """Выполнение запроса к Podio API с учетом бюджета и изоляции приложения"""
+        # Ожидание слота и бюджета ограничено PODIO_ACQUIRE_TIMEOUT: перегруженное приложение не занимает
+        # общие потоки доставки, а запрос считается неудачным и повторяется (файл шарда, спул)
+        if not self.concurrency.acquire():
+            logger.error(f"Приложение Podio {self.name}: нет свободного слота за {self.acquire_timeout} сек, запрос отклонен")
+            return None
+        if not self.rate_budget.acquire(self.acquire_timeout):
+            self.concurrency.cancel()
+            logger.error(f"Приложение Podio {self.name}: бюджет запросов исчерпан, запрос отклонен")
+            return None
+        
+        started = time.monotonic()
+        status_code = None
+        try:
+            with profiler.stage('podio_io'), tracer.span('podio.request', app=self.name, method=method, endpoint=endpoint):
+                result, status_code = self._send_request(method, endpoint, data)
+            return result
+        finally:
+            latency = time.monotonic() - started
+            # Базовая задержка ведется по виду запроса: идентификаторы в пути не различаются
+            kind = f"{method.upper()} {re.sub(r'/[0-9]+', '/{id}', endpoint)}"
+            if status_code is None:
+                # Запрос не дошел до Podio (аутентификация, сеть) - считаем ошибкой
+                self.concurrency.release(latency, 'error', kind)
+            elif status_code in THROTTLE_STATUS_CODES:
+                self.concurrency.release(latency, 'throttled', kind)
+            elif status_code >= 500:
+                self.concurrency.release(latency, 'error', kind)
+            elif 200 <= status_code < 300:
+                self.concurrency.release(latency, 'ok', kind)
+            else:
+                self.concurrency.release(latency, 'client_error', kind)
+    
+    def _send_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Tuple[Optional[Dict], Optional[int]]:
+        """Отправка HTTP запроса к Podio API, возвращает результат и код ответа"""
         try:
             if not self._ensure_authenticated():
                 logger.error("Не удалось аутентифицироваться в Podio")
-                return None
+                return None, None
             
             url = f"{self.base_url}{endpoint}"
             headers = {
@@ -94,24 +231,36 @@ class PodioClient:
             }
             
             if method.upper() == 'GET':
-                response = requests.get(url, headers=headers, params=data)
+                response = self.session.get(url, headers=headers, params=data, timeout=self.request_timeout)
             elif method.upper() == 'POST':
-                response = requests.post(url, headers=headers, json=data)
+                response = self.session.post(url, headers=headers, json=data, timeout=self.request_timeout)
             elif method.upper() == 'PUT':
-                response = requests.put(url, headers=headers, json=data)
+                response = self.session.put(url, headers=headers, json=data, timeout=self.request_timeout)
             else:
                 logger.error(f"Неподдерживаемый HTTP метод: {method}")
-                return None
+                return None, None
             
             if response.status_code in [200, 201]:
-                return response.json()
+                return response.json(), response.status_code
             else:
                 logger.error(f"Ошибка API Podio: {response.status_code} - {response.text}")
-                return None
+                return None, response.status_code
         
         except Exception as e:
             logger.error(f"Ошибка запроса к Podio API: {str(e)}")
-            return None
+            return None, None
+    
+    def has_capacity(self, in_use: int) -> bool:
+        """Можно ли начать еще одну доставку, если in_use доставок в приложение уже идет"""
+        return self.concurrency.has_capacity(in_use) and self.rate_budget.available()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика ограничителей приложения"""
+        return {
+            'app_id': self.app_id,
+            'rate_budget': self.rate_budget.get_stats(),
+            'concurrency': self.concurrency.get_stats()
+        }
     
     def check_connection(self) -> bool:
         """Проверка подключения к Podio"""
@@ -136,9 +285,20 @@ class PodioClient:
         """
         Создание элемента в Podio для сообщения
         """
+        with tracer.span('podio.create_item', app=self.name, message_id=message_data.get('message_id')):
+            return self._create_message_item(message_data)
+    
+    def _create_message_item(self, message_data: Dict[str, Any]) -> Optional[Dict]:
         try:
             # Подготовка данных для создания элемента
-            fields = self._prepare_item_fields(message_data)
+            with profiler.stage('prepare_fields'):
+                fields = self._prepare_item_fields(message_data)
+                
+                # Форматированное сообщение в поле элемента вместо отдельного комментария
+                if self.delivery_mode == DELIVERY_MODE_EMBEDDED:
+                    fields['message-formatted'] = {
+                        'value': self._format_rich_text(message_data)
+                    }
             
             item_data = {
                 'fields': fields
@@ -151,13 +311,18 @@ class PodioClient:
                 item_id = result.get('item_id')
                 logger.info(f"Создан элемент в Podio с ID: {item_id}")
                 
-                # Добавление комментария с форматированным сообщением
-                self._add_comment_to_item(item_id, message_data)
-                
-                return {
+                created = {
                     'item_id': item_id,
                     'podio_url': f"https://podio.com/app/{self.app_id}/items/{item_id}"
                 }
+                
+                if self.delivery_mode == DELIVERY_MODE_COMMENT:
+                    # Добавление комментария с форматированным сообщением
+                    self._add_comment_to_item(item_id, message_data)
+                elif self.defer_comment:
+                    created['comment_deferred'] = True
+                
+                return created
             
             return None
         
@@ -165,6 +330,54 @@ class PodioClient:
             logger.error(f"Ошибка создания элемента в Podio: {str(e)}")
             return None
     
+    def update_message_item(self, item_id: int, message_data: Dict[str, Any]) -> Optional[Dict]:
+        """
+        Обновление элемента сообщения при редактировании, удалении или смене статуса
+        """
+        with tracer.span('podio.update_item', app=self.name, item_id=item_id,
+                         message_id=message_data.get('message_id')):
+            return self._update_message_item(item_id, message_data)
+    
+    def _update_message_item(self, item_id: int, message_data: Dict[str, Any]) -> Optional[Dict]:
+        try:
+            if message_data.get('event_type') == 'status_update':
+                fields = {
+                    'message-status': {
+                        'value': MESSAGE_STATUS_LABELS.get(message_data.get('status'), message_data.get('status'))
+                    }
+                }
+            elif message_data.get('is_deleted'):
+                fields = {
+                    'message-deleted': {
+                        'value': DELETED_MARKER
+                    }
+                }
+            else:
+                fields = {
+                    'message-text': {
+                        'value': message_data.get('message_text', '')
+                    }
+                }
+            
+            # В режиме embedded форматированное сообщение хранится в поле элемента:
+            # правка и удаление перерисовывают его (с пометкой «изменено» / «удалено»)
+            if self.delivery_mode == DELIVERY_MODE_EMBEDDED and message_data.get('event_type') != 'status_update':
+                fields['message-formatted'] = {
+                    'value': self._format_rich_text(message_data)
+                }
+            
+            if not self.update_item(item_id, fields):
+                return None
+            
+            return {
+                'item_id': item_id,
+                'podio_url': f"https://podio.com/app/{self.app_id}/items/{item_id}"
+            }
+        
+        except Exception as e:
+            logger.error(f"Ошибка обновления элемента сообщения в Podio: {str(e)}")
+            return None
+    
     def _prepare_item_fields(self, message_data: Dict[str, Any]) -> Dict[str, Any]:
         """Подготовка полей для создания элемента в Podio"""
         try:
@@ -218,6 +431,12 @@ class PodioClient:
                     'value': message_data['chat_id']
                 }
             
+            # Поле "Удалено" (категория) - мягкое удаление вместо нового элемента
+            if message_data.get('is_deleted'):
+                fields['message-deleted'] = {
+                    'value': DELETED_MARKER
+                }
+            
             # Поле "Источник" (категория)
             fields['source'] = {
                 'value': message_data.get('source', 'wazzup')
@@ -229,14 +448,35 @@ class PodioClient:
             logger.error(f"Ошибка подготовки полей: {str(e)}")
             return {}
     
+    def _format_message(self, message_data: Dict[str, Any]) -> str:
+        """Форматирование сообщения обработчиком Wazzup (обработчик создается один раз)"""
+        if self._formatter is None:
+            from src.wazzup.webhook_handler import WazzupWebhookHandler
+            self._formatter = WazzupWebhookHandler()
+        return self._formatter.format_message_for_podio(message_data)
+    
+    def _format_rich_text(self, message_data: Dict[str, Any]) -> str:
+        """Форматированное сообщение в HTML для текстового поля Podio с форматированием"""
+        text = html.escape(self._format_message(message_data), quote=False)
+        text = re.sub(r'\[([^\]]+)\]\((https?://[^)\s]+)\)', r'<a href="\2">\1</a>', text)
+        text = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', text)
+        text = re.sub(r'\*(.+?)\*', r'<em>\1</em>', text)
+        return text.replace('\n', '<br>')
+    
+    def add_message_comment(self, item_id: int, message_data: Dict[str, Any]) -> bool:
+        """Добавление комментария с форматированным сообщением к существующему элементу"""
+        return self._add_comment_to_item(item_id, message_data)
+    
     def _add_comment_to_item(self, item_id: int, message_data: Dict[str, Any]) -> bool:
         """Добавление комментария к элементу с форматированным сообщением"""
+        with tracer.span('podio.add_comment', app=self.name, item_id=item_id,
+                         message_id=message_data.get('message_id')):
+            return self._post_comment(item_id, message_data)
+    
+    def _post_comment(self, item_id: int, message_data: Dict[str, Any]) -> bool:
         try:
-            from src.wazzup.webhook_handler import WazzupWebhookHandler
-            
             # Форматируем сообщение
-            handler = WazzupWebhookHandler()
-            formatted_message = handler.format_message_for_podio(message_data)
+            formatted_message = self._format_message(message_data)
             
             comment_data = {
                 'value': formatted_message,
@@ -0,0 +1,219 @@
+"""
+Ограничители нагрузки для клиентов Podio
+Бюджет запросов (token bucket) и адаптивное ограничение одновременных запросов
+на уровне приложения Podio (изоляция приложений друг от друга)
+"""
+
+import time
+import threading
+from typing import Dict, Optional, Any, Tuple
+
+class RateBudget:
+    """Бюджет запросов в час по алгоритму token bucket"""
+    
+    def __init__(self, rate_per_hour: float, burst: float = None):
+        self.rate_per_hour = rate_per_hour
+        # По умолчанию допускается всплеск в объеме пятиминутного бюджета
+        self.capacity = burst if burst is not None else max(1.0, rate_per_hour / 12)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0
+        self.rejected = 0
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate_per_hour / 3600)
+    
+    def acquire(self, timeout: float = None) -> bool:
+        """
+        Списание одного запроса из бюджета
+        Если бюджет исчерпан, ждет пополнения; с заданным timeout возвращает False,
+        если запрос не дождется бюджета за это время (ждать заведомо бесполезно - сразу)
+        """
+        if self.rate_per_hour <= 0:
+            return True
+        
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        counted = False
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                
+                delay = (1 - self._tokens) * 3600 / self.rate_per_hour
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    self.rejected += 1
+                    return False
+                if not counted:
+                    self.waited += 1
+                    counted = True
+            
+            time.sleep(delay)
+    
+    def available(self) -> bool:
+        """Есть ли в бюджете запрос прямо сейчас (без списания)"""
+        if self.rate_per_hour <= 0:
+            return True
+        with self._lock:
+            self._refill()
+            return self._tokens >= 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'rate_per_hour': self.rate_per_hour,
+            'available': round(self._tokens, 2),
+            'waited': self.waited,
+            'rejected': self.rejected
+        }
+
+class AdaptiveLimiter:
+    """
+    Адаптивное ограничение одновременных запросов к приложению Podio (AIMD)
+    Лимит растет на единицу за «окно» успешных быстрых ответов и уменьшается
+    в разы при троттлинге, ошибках или росте задержки относительно базовой.
+    Базовая задержка ведется отдельно для каждого вида запроса: создание элемента,
+    комментарий и чтение приложения обычно отвечают за разное время
+    """
+    
+    def __init__(self, floor: int, ceiling: int, initial: int = None, timeout: float = None,
+                 latency_tolerance: float = 2.0, backoff: float = 0.5, latency_backoff: float = 0.9):
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.limit = float(min(self.ceiling, max(self.floor, initial if initial is not None else self.ceiling)))
+        self.timeout = timeout
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.latency_backoff = latency_backoff
+        
+        self.in_flight = 0
+        self.waiting = 0
+        self.waited = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.errors = 0
+        self.client_errors = 0
+        # Вид запроса -> [минимальная (базовая) задержка, сглаженная задержка]
+        self.latencies = {}
+        
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+    
+    def acquire(self, timeout: float = None) -> bool:
+        """
+        Занятие слота; пока слотов нет, вызывающий поток ждет
+        С timeout (по умолчанию заданным при создании) возвращает False, если слот не освободился за это время
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            if self.in_flight >= int(self.limit):
+                self.waited += 1
+            
+            self.waiting += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    if deadline is None:
+                        self._cond.wait()
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            
+            self.in_flight += 1
+            return True
+    
+    def release(self, latency: float, outcome: str, kind: str = '') -> None:
+        """
+        Освобождение слота с результатом запроса
+        outcome: 'ok' (2xx), 'client_error' (прочие 4xx), 'throttled' (420/429) или 'error' (5xx, сетевые ошибки)
+        kind - вид запроса, для которого ведется базовая задержка (например, 'POST /item/app/{id}/')
+        """
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            
+            if outcome == 'ok':
+                min_latency, smoothed = self._observe_latency(kind, latency)
+                if smoothed > min_latency * self.latency_tolerance:
+                    self._decrease(self.latency_backoff, now, smoothed)
+                else:
+                    # Аддитивный рост: +1 к лимиту за limit успешных ответов
+                    self.limit = min(self.ceiling, self.limit + 1 / self.limit)
+            elif outcome == 'client_error':
+                # Быстрый отказ (404, 400) ничего не говорит о загрузке Podio: ни задержки, ни изменения лимита
+                self.client_errors += 1
+            else:
+                if outcome == 'throttled':
+                    self.throttled += 1
+                else:
+                    self.errors += 1
+                self._decrease(self.backoff, now, self._smoothed(kind))
+            
+            self._cond.notify_all()
+    
+    def cancel(self) -> None:
+        """Освобождение слота без учета результата (запрос не отправлялся)"""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+    
+    def has_capacity(self, in_use: int) -> bool:
+        """Меньше ли in_use занятых снаружи слотов текущего лимита (без занятия слота)"""
+        with self._cond:
+            return in_use < int(self.limit)
+    
+    def _observe_latency(self, kind: str, latency: float) -> Tuple[float, float]:
+        baseline = self.latencies.get(kind)
+        if baseline is None:
+            baseline = self.latencies[kind] = [latency, latency]
+            return latency, latency
+        
+        # Базовая задержка медленно «забывается», чтобы лимит подстраивался под новые условия
+        baseline[0] = min(latency, baseline[0] * 1.001)
+        baseline[1] = 0.8 * baseline[1] + 0.2 * latency
+        return baseline[0], baseline[1]
+    
+    def _smoothed(self, kind: str) -> Optional[float]:
+        baseline = self.latencies.get(kind)
+        if baseline is not None:
+            return baseline[1]
+        if self.latencies:
+            return max(smoothed for _, smoothed in self.latencies.values())
+        return None
+    
+    def _decrease(self, factor: float, now: float, window: Optional[float]) -> None:
+        # Не чаще одного раза за время ответа: один всплеск ошибок дает одно снижение
+        window = window or 0.1
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self.limit = max(self.floor, self.limit * factor)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'limit': int(self.limit),
+                'floor': self.floor,
+                'ceiling': self.ceiling,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'waited': self.waited,
+                'rejected': self.rejected,
+                'throttled': self.throttled,
+                'errors': self.errors,
+                'client_errors': self.client_errors,
+                'latency': {
+                    kind: {'min': round(min_latency, 4), 'smoothed': round(smoothed, 4)}
+                    for kind, (min_latency, smoothed) in self.latencies.items()
+                }
+            }
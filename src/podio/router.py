@@ -0,0 +1,107 @@
+"""
+Маршрутизация событий Wazzup по приложениям Podio
+Выбирает клиент Podio по channelId и chatType согласно таблице маршрутов
+"""
+
+import os
+import json
+import logging
+from typing import Dict, Optional, Any
+
+from src.podio.client import PodioClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_APP = 'default'
+
+class PodioRouter:
+    """Таблица маршрутов channel_id/chat_type -> клиент приложения Podio"""
+    
+    def __init__(self, config_path: str = None):
+        if config_path is None:
+            config_path = os.getenv('PODIO_ROUTING_CONFIG', '')
+        
+        self.config_path = config_path
+        self.clients = {}
+        self.routes = {}
+        self.default_app = DEFAULT_APP
+        
+        if config_path:
+            self._load_config(config_path)
+        else:
+            # Одно приложение из переменных окружения PODIO_APP_ID/PODIO_APP_TOKEN
+            self.clients[DEFAULT_APP] = PodioClient(name=DEFAULT_APP)
+    
+    def _load_config(self, config_path: str) -> None:
+        """Загрузка таблицы маршрутов из JSON файла"""
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        
+        for name, app_config in config.get('apps', {}).items():
+            # Токен приложения лучше хранить в переменной окружения, а не в файле
+            app_token = app_config.get('app_token')
+            if not app_token and app_config.get('app_token_env'):
+                app_token = os.getenv(app_config['app_token_env'], '')
+            app_id = str(app_config.get('app_id') or '')
+            
+            # Пустое значение клиент заменил бы на PODIO_APP_ID/PODIO_APP_TOKEN другого приложения
+            if not app_id:
+                raise ValueError(f"Не задан app_id приложения Podio: {name}")
+            if not app_token:
+                source = app_config.get('app_token_env') or 'app_token/app_token_env'
+                raise ValueError(f"Не задан токен приложения Podio {name}: {source}")
+            
+            self.clients[name] = PodioClient(
+                app_id=app_id,
+                app_token=app_token,
+                name=name,
+                rate_limit_per_hour=app_config.get('rate_limit_per_hour'),
+                max_concurrency=app_config.get('max_concurrency'),
+                delivery_mode=app_config.get('delivery_mode')
+            )
+        
+        for route in config.get('routes', []):
+            app_name = route.get('app')
+            if app_name not in self.clients:
+                raise ValueError(f"Маршрут ссылается на неизвестное приложение Podio: {app_name}")
+            
+            key = (route.get('channel_id'), route.get('chat_type'))
+            self.routes[key] = app_name
+        
+        self.default_app = config.get('default', DEFAULT_APP)
+        if self.default_app not in self.clients:
+            raise ValueError(f"Приложение по умолчанию не описано в конфигурации: {self.default_app}")
+        
+        logger.info(f"Загружено маршрутов Podio: {len(self.routes)}, приложений: {len(self.clients)}")
+    
+    def resolve(self, item: Dict[str, Any]) -> str:
+        """Имя приложения Podio для события"""
+        channel_id = item.get('channel_id') or None
+        chat_type = item.get('chat_type') or None
+        
+        # Точный маршрут важнее маршрута только по каналу или только по типу чата
+        for key in ((channel_id, chat_type), (channel_id, None), (None, chat_type)):
+            app_name = self.routes.get(key)
+            if app_name:
+                return app_name
+        
+        return self.default_app
+    
+    def client_for(self, item: Dict[str, Any]) -> PodioClient:
+        """Клиент Podio для события"""
+        return self.clients[self.resolve(item)]
+    
+    def get_client(self, name: str = None) -> Optional[PodioClient]:
+        """Клиент Podio по имени приложения"""
+        return self.clients.get(name or self.default_app)
+    
+    def check_connections(self) -> Dict[str, bool]:
+        """Проверка подключения ко всем приложениям Podio"""
+        return {name: client.check_connection() for name, client in self.clients.items()}
+    
+    def warm_up(self) -> Dict[str, bool]:
+        """Аутентификация всех приложений в текущем процессе (после fork воркера)"""
+        return {name: client.warm_up() for name, client in self.clients.items()}
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: client.get_stats() for name, client in self.clients.items()}
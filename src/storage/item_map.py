@@ -0,0 +1,138 @@
+"""
+Постоянное соответствие messageId -> элемент Podio
+Нужно для обновления исходного элемента при редактировании и удалении сообщения
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+class MessageItemMap:
+    """Хранилище соответствий в SQLite (отдельное соединение на поток)"""
+    
+    def __init__(self, db_path: str = None):
+        if db_path is None:
+            db_path = os.getenv('MESSAGE_MAP_DB', 'data/message_map.db')
+        
+        self.db_path = db_path
+        self._local = threading.local()
+        
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS message_items (
+                message_id TEXT PRIMARY KEY,
+                item_id INTEGER NOT NULL,
+                app TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока; после fork открывается заново"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def get(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Элемент Podio, созданный для сообщения"""
+        if not message_id:
+            return None
+        
+        try:
+            row = self._connection().execute(
+                'SELECT item_id, app FROM message_items WHERE message_id = ?',
+                (message_id,)
+            ).fetchone()
+            if row:
+                return {'item_id': row[0], 'app': row[1]}
+            return None
+        
+        except Exception as e:
+            logger.error(f"Ошибка чтения соответствия для сообщения {message_id}: {str(e)}")
+            return None
+    
+    def put(self, message_id: str, item_id: int, app: str) -> None:
+        """Сохранение элемента Podio, созданного для сообщения"""
+        if not message_id or not item_id:
+            return
+        
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO message_items (message_id, item_id, app, created_at) VALUES (?, ?, ?, ?)',
+                (message_id, item_id, app, time.time())
+            )
+            conn.commit()
+        
+        except Exception as e:
+            logger.error(f"Ошибка сохранения соответствия для сообщения {message_id}: {str(e)}")
+
+class FileItemMap:
+    """
+    Хранилище соответствий в файлах общего каталога (по файлу на сообщение)
+    Запись через временный файл и переименование, без блокировок и WAL,
+    поэтому каталог можно держать на общем томе нескольких хостов
+    """
+    
+    def __init__(self, map_dir: str):
+        self.map_dir = map_dir
+        os.makedirs(os.path.join(map_dir, 'tmp'), exist_ok=True)
+    
+    def _path(self, message_id: str) -> str:
+        digest = hashlib.sha1(message_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.map_dir, digest[:2], f'{digest}.json')
+    
+    def get(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Элемент Podio, созданный для сообщения"""
+        if not message_id:
+            return None
+        
+        try:
+            with open(self._path(message_id), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            return {'item_id': record['item_id'], 'app': record['app']}
+        
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка чтения соответствия для сообщения {message_id}: {str(e)}")
+            return None
+    
+    def put(self, message_id: str, item_id: int, app: str) -> None:
+        """Сохранение элемента Podio, созданного для сообщения"""
+        if not message_id or not item_id:
+            return
+        
+        try:
+            path = self._path(message_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = os.path.join(self.map_dir, 'tmp', uuid.uuid4().hex)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'message_id': message_id,
+                    'item_id': item_id,
+                    'app': app,
+                    'created_at': time.time()
+                }, f)
+            os.replace(tmp_path, path)
+        
+        except Exception as e:
+            logger.error(f"Ошибка сохранения соответствия для сообщения {message_id}: {str(e)}")
@@ -0,0 +1,346 @@
+"""
+Локальное хранилище обработанных сообщений
+История чатов в SQLite с индексами по chat_id, времени и message_id
+и полнотекстовым поиском (FTS5) по тексту сообщения
+"""
+
+import os
+import time
+import base64
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional, Any, Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_COLUMNS = (
+    'message_id', 'chat_id', 'chat_type', 'channel_id', 'timestamp', 'direction',
+    'message_type', 'message_text', 'contact_name', 'contact_phone', 'content_uri',
+    'is_edited', 'is_deleted', 'status'
+)
+
+class MessageStore:
+    """История сообщений в SQLite (отдельное соединение на поток)"""
+    
+    def __init__(self, db_path: str = None, retention_days: float = None):
+        if db_path is None:
+            db_path = os.getenv('MESSAGE_STORE_DB', 'data/messages.db')
+        if retention_days is None:
+            retention_days = float(os.getenv('MESSAGE_STORE_RETENTION_DAYS', 90))
+        
+        self.db_path = db_path
+        self.retention_days = retention_days
+        self.compact_interval = float(os.getenv('MESSAGE_STORE_COMPACT_INTERVAL', 3600))
+        self.full_text = False
+        
+        self._local = threading.local()
+        self._compactor_pid = None
+        self._compactor_lock = threading.Lock()
+        
+        if self.enabled:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._create_schema()
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.db_path)
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока; после fork открывается заново"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def _create_schema(self) -> None:
+        conn = self._connection()
+        # auto_vacuum действует только для новой базы и позволяет возвращать место после очистки
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id TEXT NOT NULL UNIQUE,
+                chat_id TEXT NOT NULL,
+                chat_type TEXT,
+                channel_id TEXT,
+                timestamp TEXT,
+                ts REAL NOT NULL,
+                direction TEXT,
+                message_type TEXT,
+                message_text TEXT,
+                contact_name TEXT,
+                contact_phone TEXT,
+                content_uri TEXT,
+                is_edited INTEGER NOT NULL DEFAULT 0,
+                is_deleted INTEGER NOT NULL DEFAULT 0,
+                status TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_chat_ts ON messages (chat_id, ts, id);
+            CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages (ts);
+            -- Статусы, пришедшие раньше своего сообщения (ts - время получения)
+            CREATE TABLE IF NOT EXISTS pending_statuses (
+                message_id TEXT PRIMARY KEY,
+                status TEXT,
+                ts REAL NOT NULL
+            );
+        ''')
+        
+        try:
+            conn.executescript('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    message_text, content='messages', content_rowid='id'
+                );
+                CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts (rowid, message_text) VALUES (new.id, new.message_text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, message_text)
+                    VALUES ('delete', old.id, old.message_text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message_text ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, message_text)
+                    VALUES ('delete', old.id, old.message_text);
+                    INSERT INTO messages_fts (rowid, message_text) VALUES (new.id, new.message_text);
+                END;
+            ''')
+            self.full_text = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Полнотекстовый поиск недоступен (FTS5): {str(e)}")
+        
+        conn.commit()
+    
+    @staticmethod
+    def _to_epoch(timestamp: str) -> float:
+        """Время сообщения Wazzup (ISO 8601, без зоны - UTC) в секундах эпохи"""
+        try:
+            dt = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            return dt.timestamp()
+        except ValueError:
+            return time.time()
+    
+    def add_events(self, items: Iterable[Dict[str, Any]]) -> int:
+        """Сохранение пачки событий одной транзакцией"""
+        if not self.enabled:
+            return 0
+        
+        messages = []
+        statuses = []
+        for item in items:
+            if item.get('event_type') == 'message' and item.get('message_id'):
+                row = {column: item.get(column) for column in MESSAGE_COLUMNS}
+                row['is_edited'] = int(bool(row['is_edited']))
+                row['is_deleted'] = int(bool(row['is_deleted']))
+                row['ts'] = self._to_epoch(item.get('timestamp'))
+                messages.append(row)
+            elif item.get('event_type') == 'status_update' and item.get('message_id'):
+                statuses.append((item.get('status'), item.get('message_id')))
+        
+        if not messages and not statuses:
+            return 0
+        
+        try:
+            conn = self._connection()
+            with conn:
+                # Правка обновляет текст, удаление ставит отметку; повтор того же сообщения игнорируется
+                conn.executemany(f'''
+                    INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)}, ts)
+                    VALUES ({', '.join(':' + column for column in MESSAGE_COLUMNS)}, :ts)
+                    ON CONFLICT (message_id) DO UPDATE SET
+                        message_text = CASE WHEN excluded.is_edited THEN excluded.message_text ELSE message_text END,
+                        is_edited = max(is_edited, excluded.is_edited),
+                        is_deleted = max(is_deleted, excluded.is_deleted)
+                ''', messages)
+                if messages:
+                    self._apply_pending_statuses(conn)
+                
+                # Статус раньше сообщения откладывается до его вставки
+                received_at = time.time()
+                for status, message_id in statuses:
+                    updated = conn.execute(
+                        'UPDATE messages SET status = ? WHERE message_id = ?', (status, message_id)
+                    ).rowcount
+                    if not updated:
+                        conn.execute('''
+                            INSERT INTO pending_statuses (message_id, status, ts) VALUES (?, ?, ?)
+                            ON CONFLICT (message_id) DO UPDATE SET status = excluded.status, ts = excluded.ts
+                        ''', (message_id, status, received_at))
+        
+        except Exception as e:
+            logger.error(f"Ошибка сохранения сообщений в локальное хранилище: {str(e)}")
+            return 0
+        
+        self._ensure_compactor()
+        return len(messages) + len(statuses)
+    
+    @staticmethod
+    def _apply_pending_statuses(conn: sqlite3.Connection) -> None:
+        """Перенос отложенных статусов в появившиеся сообщения"""
+        conn.execute('''
+            UPDATE messages SET status = (
+                SELECT status FROM pending_statuses p WHERE p.message_id = messages.message_id
+            )
+            WHERE message_id IN (SELECT message_id FROM pending_statuses)
+        ''')
+        conn.execute('DELETE FROM pending_statuses WHERE message_id IN (SELECT message_id FROM messages)')
+    
+    def record_stream(self, items: Iterable[Dict[str, Any]], batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """
+        Сохранение потока событий пачками с передачей событий дальше
+        Если поток не дочитан (доставка прервалась), уже переданные события тоже сохраняются
+        """
+        batch = []
+        try:
+            for item in items:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    self.add_events(batch)
+                    batch = []
+                yield item
+        finally:
+            if batch:
+                self.add_events(batch)
+    
+    @staticmethod
+    def _encode_cursor(ts: float, row_id: int) -> str:
+        return base64.urlsafe_b64encode(f'{ts!r}:{row_id}'.encode('ascii')).decode('ascii')
+    
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        ts, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split(':')
+        return float(ts), int(row_id)
+    
+    def get_chat_messages(self, chat_id: str, limit: int = 50, cursor: Optional[str] = None,
+                          query: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Сообщения чата от новых к старым
+        cursor - значение next_cursor предыдущей страницы, query - полнотекстовый поиск
+        """
+        limit = max(1, min(limit, 500))
+        params = [chat_id]
+        conditions = ['m.chat_id = ?']
+        join = ''
+        
+        if cursor:
+            ts, row_id = self._decode_cursor(cursor)
+            conditions.append('(m.ts < ? OR (m.ts = ? AND m.id < ?))')
+            params.extend([ts, ts, row_id])
+        
+        if query:
+            if not self.full_text:
+                raise ValueError('Полнотекстовый поиск недоступен')
+            join = 'JOIN messages_fts ON messages_fts.rowid = m.id'
+            conditions.append('messages_fts MATCH ?')
+            params.append(query)
+        
+        params.append(limit + 1)
+        try:
+            rows = self._connection().execute(f'''
+                SELECT m.id, m.ts, {', '.join('m.' + column for column in MESSAGE_COLUMNS)}
+                FROM messages m {join}
+                WHERE {' AND '.join(conditions)}
+                ORDER BY m.ts DESC, m.id DESC
+                LIMIT ?
+            ''', params).fetchall()
+        except sqlite3.OperationalError as e:
+            if query:
+                # Синтаксис запроса FTS5 задает клиент
+                raise ValueError(f'Некорректный поисковый запрос: {str(e)}')
+            raise
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(rows[-1]['ts'], rows[-1]['id'])
+        
+        messages = []
+        for row in rows:
+            message = {column: row[column] for column in MESSAGE_COLUMNS}
+            message['is_edited'] = bool(message['is_edited'])
+            message['is_deleted'] = bool(message['is_deleted'])
+            messages.append(message)
+        
+        return {'messages': messages, 'next_cursor': next_cursor}
+    
+    def get_chat_id(self, message_id: str) -> Optional[str]:
+        """Чат сообщения по messageId (для статусов, в которых нет chatId)"""
+        if not self.enabled or not message_id:
+            return None
+        row = self._connection().execute(
+            'SELECT chat_id FROM messages WHERE message_id = ?', (message_id,)
+        ).fetchone()
+        return row['chat_id'] if row else None
+    
+    def _ensure_compactor(self) -> None:
+        """Запуск фоновой очистки в текущем процессе (после fork поток запускается заново)"""
+        if self._compactor_pid == os.getpid() or self.retention_days <= 0:
+            return
+        
+        with self._compactor_lock:
+            if self._compactor_pid == os.getpid():
+                return
+            self._compactor_pid = os.getpid()
+            threading.Thread(target=self._run_compactor, name='message-store-compactor', daemon=True).start()
+    
+    def _run_compactor(self) -> None:
+        # Удаление и incremental_vacuum не выполняются в потоке запроса
+        while True:
+            self.compact()
+            time.sleep(max(self.compact_interval, 1.0))
+    
+    def compact(self, batch_size: int = 5000) -> int:
+        """Удаление сообщений старше MESSAGE_STORE_RETENTION_DAYS небольшими транзакциями"""
+        if not self.enabled or self.retention_days <= 0:
+            return 0
+        
+        cutoff = time.time() - self.retention_days * 86400
+        removed = 0
+        try:
+            conn = self._connection()
+            while True:
+                with conn:
+                    deleted = conn.execute(
+                        'DELETE FROM messages WHERE id IN (SELECT id FROM messages WHERE ts < ? LIMIT ?)',
+                        (cutoff, batch_size)
+                    ).rowcount
+                removed += deleted
+                if deleted < batch_size:
+                    break
+            
+            # Сообщение отложенного статуса так и не пришло за срок хранения
+            with conn:
+                conn.execute('DELETE FROM pending_statuses WHERE ts < ?', (cutoff,))
+            
+            if removed:
+                conn.execute('PRAGMA incremental_vacuum')
+                logger.info(f"Удалено из локального хранилища сообщений: {removed}")
+        
+        except Exception as e:
+            logger.error(f"Ошибка очистки локального хранилища: {str(e)}")
+        
+        return removed
+    
+    def get_stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {'enabled': False}
+        
+        conn = self._connection()
+        count = conn.execute('SELECT count(*) FROM messages').fetchone()[0]
+        pending = conn.execute('SELECT count(*) FROM pending_statuses').fetchone()[0]
+        return {
+            'enabled': True,
+            'messages': count,
+            'pending_statuses': pending,
+            'full_text': self.full_text,
+            'retention_days': self.retention_days
+        }
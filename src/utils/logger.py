@@ -6,6 +6,15 @@ import logging
 import os
 from datetime import datetime
 
+from src.utils.tracing import get_correlation_id
+
+class CorrelationIdFilter(logging.Filter):
+    """Добавляет в запись лога идентификатор корреляции текущего контекста"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = get_correlation_id()
+        return True
+
 def setup_logger(name: str, level: str = None) -> logging.Logger:
     """
     Настройка логгера для модуля
@@ -33,7 +42,7 @@ def setup_logger(name: str, level: str = None) -> logging.Logger:
     
     # Создание форматтера
     formatter = logging.Formatter(
-        fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        fmt='%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
     
@@ -41,6 +50,7 @@ def setup_logger(name: str, level: str = None) -> logging.Logger:
     console_handler = logging.StreamHandler()
     console_handler.setLevel(getattr(logging, level, logging.INFO))
     console_handler.setFormatter(formatter)
+    console_handler.addFilter(CorrelationIdFilter())
     logger.addHandler(console_handler)
     
     # Файловый обработчик (если указана директория для логов)
@@ -51,6 +61,7 @@ def setup_logger(name: str, level: str = None) -> logging.Logger:
         file_handler = logging.FileHandler(log_file, encoding='utf-8')
         file_handler.setLevel(getattr(logging, level, logging.INFO))
         file_handler.setFormatter(formatter)
+        file_handler.addFilter(CorrelationIdFilter())
         logger.addHandler(file_handler)
     
     return logger
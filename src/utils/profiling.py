@@ -0,0 +1,272 @@
+"""
+Профилирование горячего пути вебхука по запросу
+Выборочно снимает cProfile и tracemalloc по этапам обработки запроса.
+В выключенном состоянии этап обходится одной проверкой contextvar.
+Состояние включения общее для воркеров gunicorn (файл в каталоге профилей).
+Профилирование выключается, когда каталог профилей достигает лимита по числу файлов или объему.
+"""
+
+import os
+import json
+import time
+import random
+import cProfile
+import logging
+import threading
+import tracemalloc
+import contextvars
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+_current_profile = contextvars.ContextVar('current_profile', default=None)
+_NULL_STAGE = nullcontext()
+
+class RequestProfile:
+    """Профиль одного запроса: cProfile и снимки памяти по этапам"""
+    
+    def __init__(self, output_dir: str, name: str):
+        self.output_dir = output_dir
+        self.prefix = f"{datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')}-{name}"
+        self.profiles = {}
+        self.snapshots = {}
+        self.active_stage = None
+        self.started_tracemalloc = False
+        self.baseline = None
+        self.closed = False
+        self._lock = threading.Lock()
+    
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(int(os.getenv('PROFILING_TRACEMALLOC_FRAMES', 10)))
+            self.started_tracemalloc = True
+        self.baseline = tracemalloc.take_snapshot()
+    
+    @contextmanager
+    def stage(self, name: str):
+        # Вложенные и параллельные (из потоков доставки) этапы учитываются во внешнем:
+        # cProfile не поддерживает одновременный запуск; после finish этапы не пишутся
+        with self._lock:
+            busy = self.closed or self.active_stage is not None
+            if not busy:
+                self.active_stage = name
+        
+        if busy:
+            yield
+            return
+        
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                self.active_stage = None
+                # Снимок памяти берется при первом выходе из этапа, чтобы ограничить накладные расходы
+                if name not in self.snapshots and not self.closed:
+                    self.snapshots[name] = tracemalloc.take_snapshot()
+    
+    def finish(self) -> None:
+        """Запись результатов в каталог профилей"""
+        with self._lock:
+            self.closed = True
+        
+        try:
+            for name, profile in self.profiles.items():
+                path = os.path.join(self.output_dir, f"{self.prefix}-{name}")
+                # Формат pstats читают flameprof, snakeviz, gprof2dot
+                profile.dump_stats(f"{path}.prof")
+                
+                snapshot = self.snapshots.get(name)
+                if snapshot is not None:
+                    snapshot.dump(f"{path}.tracemalloc")
+                    with open(f"{path}.alloc.txt", 'w', encoding='utf-8') as f:
+                        for stat in snapshot.compare_to(self.baseline, 'lineno')[:25]:
+                            f.write(f"{stat}\n")
+        finally:
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+
+class ProfilingController:
+    """Включение профилирования для доли запросов и/или на интервал времени"""
+    
+    def __init__(self, output_dir: str = None):
+        if output_dir is None:
+            output_dir = os.getenv('PROFILING_DIR', 'data/profiles')
+        
+        self.output_dir = output_dir
+        self.sample_rate = 0.0
+        # Время окончания окна - по часам системы, чтобы оно совпадало во всех процессах
+        self.until = None
+        self.active = False
+        self.profiled = 0
+        
+        # Включение через /admin/profiling попадает в один воркер; остальные узнают о нем из файла,
+        # время изменения которого проверяется не чаще раза в PROFILING_CHECK_INTERVAL секунд
+        self.control_path = os.path.join(output_dir, 'profiling.json')
+        self.check_interval = float(os.getenv('PROFILING_CHECK_INTERVAL', 1.0))
+        self._checked_at = 0.0
+        self._control_mtime = None
+        
+        # Каждый запрос пишет по три файла на этап: лимит каталога защищает диск при долгом окне
+        self.max_files = int(os.getenv('PROFILING_MAX_FILES', 1000))
+        self.max_bytes = int(os.getenv('PROFILING_MAX_BYTES', 100 * 1024 * 1024))
+        
+        # Одновременно профилируется не больше одного запроса:
+        # cProfile и tracemalloc общие для процесса
+        self._slot = threading.Lock()
+    
+    def enable(self, percent: float = 100.0, duration: Optional[float] = None) -> None:
+        """Профилировать percent% запросов; duration - длительность окна в секундах"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        files, size = self._usage()
+        if self._exhausted(files, size):
+            raise ValueError(f"Каталог профилей заполнен ({files} файлов, {size} байт): удалите старые профили")
+        
+        sample_rate = max(0.0, min(100.0, percent)) / 100
+        until = time.time() + duration if duration else None
+        
+        tmp_path = f'{self.control_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'sample_rate': sample_rate, 'until': until}, f)
+        os.replace(tmp_path, self.control_path)
+        self._control_mtime = os.stat(self.control_path).st_mtime_ns
+        
+        self._apply(sample_rate, until)
+        logger.warning(f"Профилирование включено: {percent}% запросов, окно {duration or 'без ограничения'} сек")
+    
+    def disable(self) -> None:
+        try:
+            os.remove(self.control_path)
+        except FileNotFoundError:
+            pass
+        self._control_mtime = None
+        self._apply(0.0, None)
+        logger.warning("Профилирование выключено")
+    
+    def _apply(self, sample_rate: float, until: Optional[float]) -> None:
+        self.sample_rate = sample_rate
+        self.until = until
+        self.active = sample_rate > 0
+    
+    def _usage(self):
+        """Число файлов профилей и их объем в каталоге (общем для всех воркеров)"""
+        files = 0
+        size = 0
+        try:
+            with os.scandir(self.output_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and not entry.name.startswith('profiling.json'):
+                        files += 1
+                        size += entry.stat().st_size
+        except FileNotFoundError:
+            pass
+        return files, size
+    
+    def _exhausted(self, files: int, size: int) -> bool:
+        return files >= self.max_files or size >= self.max_bytes
+    
+    def _sync(self, force: bool = False) -> None:
+        """Подхват включения и выключения, сделанных в другом воркере"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        
+        try:
+            mtime = os.stat(self.control_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._control_mtime:
+            return
+        self._control_mtime = mtime
+        
+        if mtime is None:
+            self._apply(0.0, None)
+            return
+        
+        try:
+            with open(self.control_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self._apply(float(state.get('sample_rate', 0.0)), state.get('until'))
+        except (FileNotFoundError, ValueError) as e:
+            logger.error(f"Ошибка чтения состояния профилирования: {str(e)}")
+            self._apply(0.0, None)
+    
+    def start_request(self, name: str):
+        """Решение о профилировании запроса; возвращает токен для finish_request"""
+        self._sync()
+        if not self.active:
+            return None
+        
+        if self.until is not None and time.time() >= self.until:
+            self.disable()
+            return None
+        
+        if random.random() >= self.sample_rate or not self._slot.acquire(blocking=False):
+            return None
+        
+        try:
+            profile = RequestProfile(self.output_dir, name)
+            profile.start()
+        except Exception as e:
+            self._slot.release()
+            logger.error(f"Ошибка запуска профилирования: {str(e)}")
+            return None
+        
+        return _current_profile.set(profile)
+    
+    def finish_request(self, token) -> None:
+        if token is None:
+            return
+        
+        profile = _current_profile.get()
+        _current_profile.reset(token)
+        try:
+            profile.finish()
+            self.profiled += 1
+        except Exception as e:
+            logger.error(f"Ошибка записи профиля: {str(e)}")
+        finally:
+            self._slot.release()
+        
+        # Выключение через файл состояния останавливает и остальные воркеры
+        files, size = self._usage()
+        if self.active and self._exhausted(files, size):
+            logger.warning(f"Каталог профилей заполнен ({files} файлов, {size} байт), профилирование выключено")
+            self.disable()
+    
+    def stage(self, name: str):
+        """Контекст этапа обработки; без активного профиля ничего не делает"""
+        profile = _current_profile.get()
+        if profile is None:
+            return _NULL_STAGE
+        return profile.stage(name)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        self._sync(force=True)
+        if self.active and self.until is not None and time.time() >= self.until:
+            self.disable()
+        
+        remaining = None
+        if self.active and self.until is not None:
+            remaining = round(max(0.0, self.until - time.time()), 1)
+        
+        files, size = self._usage()
+        return {
+            'active': self.active,
+            'percent': self.sample_rate * 100,
+            'remaining_seconds': remaining,
+            'profiled_requests': self.profiled,
+            'output_dir': self.output_dir,
+            'files': files,
+            'bytes': size,
+            'max_files': self.max_files,
+            'max_bytes': self.max_bytes
+        }
+
+# Общий контроллер процесса
+profiler = ProfilingController()
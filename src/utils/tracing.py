@@ -0,0 +1,123 @@
+"""
+Сквозные идентификаторы корреляции и замер этапов доставки
+Идентификатор назначается при приеме вебхука (или берется из заголовка)
+и сопровождает событие через очереди до запросов к Podio.
+Этапы записываются в JSON-lines файл в формате событий Chrome Trace.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+CORRELATION_HEADERS = ('X-Correlation-ID', 'X-Request-ID')
+NO_CORRELATION_ID = '-'
+
+_correlation_id = contextvars.ContextVar('correlation_id', default=NO_CORRELATION_ID)
+_valid_correlation_id = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+_NULL_SPAN = nullcontext()
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex
+
+def get_correlation_id() -> str:
+    return _correlation_id.get()
+
+def correlation_id_from_headers(headers) -> str:
+    """Идентификатор из входящего заголовка или новый"""
+    for header in CORRELATION_HEADERS:
+        value = headers.get(header, '')
+        if value and _valid_correlation_id.match(value):
+            return value
+    return new_correlation_id()
+
+def set_correlation_id(correlation_id: str):
+    """Установка идентификатора в текущем контексте; возвращает токен для reset"""
+    return _correlation_id.set(correlation_id or NO_CORRELATION_ID)
+
+def reset_correlation_id(token) -> None:
+    _correlation_id.reset(token)
+
+@contextmanager
+def correlation_scope(correlation_id: Optional[str]):
+    """Временная установка идентификатора (фоновые потоки, обработчики очередей)"""
+    token = set_correlation_id(correlation_id)
+    try:
+        yield
+    finally:
+        _correlation_id.reset(token)
+
+class Tracer:
+    """Запись этапов (spans) в файл TRACE_FILE, по одному событию на строку"""
+    
+    def __init__(self, trace_file: str = None):
+        if trace_file is None:
+            trace_file = os.getenv('TRACE_FILE', '')
+        
+        self.trace_file = trace_file
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_pid = None
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.trace_file)
+    
+    def span(self, name: str, **args):
+        """Контекст замера этапа; без TRACE_FILE ничего не делает"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, args)
+    
+    @contextmanager
+    def _span(self, name: str, args: Dict[str, Any]):
+        started = time.time()
+        try:
+            yield args
+        finally:
+            self.record_span(name, started, time.time(), **args)
+    
+    def record_span(self, name: str, started: float, finished: float, **args) -> None:
+        """Запись уже завершившегося этапа (например, ожидания в очереди)"""
+        if not self.enabled:
+            return
+        
+        args['correlation_id'] = get_correlation_id()
+        event = {
+            'name': name,
+            'cat': name.split('.', 1)[0],
+            'ph': 'X',
+            'ts': int(started * 1e6),
+            'dur': max(0, int((finished - started) * 1e6)),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args
+        }
+        line = json.dumps(event, ensure_ascii=False, default=str) + '\n'
+        
+        try:
+            with self._lock:
+                self._open().write(line)
+        except Exception as e:
+            logger.error(f"Ошибка записи трассировки: {str(e)}")
+    
+    def _open(self):
+        # После fork файл открывается заново, чтобы не делить буфер с родителем
+        if self._file is None or self._file_pid != os.getpid():
+            trace_dir = os.path.dirname(self.trace_file)
+            if trace_dir:
+                os.makedirs(trace_dir, exist_ok=True)
+            self._file = open(self.trace_file, 'a', encoding='utf-8', buffering=1)
+            self._file_pid = os.getpid()
+        return self._file
+
+# Общий трассировщик процесса
+tracer = Tracer()
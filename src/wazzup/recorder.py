@@ -0,0 +1,229 @@
+"""
+Запись реального трафика вебхуков Wazzup
+Сохраняет сырые подписанные тела запросов с временем приема
+в сжатые ротируемые сегменты для последующего воспроизведения
+"""
+
+import os
+import gzip
+import json
+import time
+import base64
+import queue
+import shutil
+import atexit
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Any, IO, Union
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = 'traffic-'
+SEGMENT_SUFFIX = '.jsonl.gz'
+# Большие тела до записи ждут в файлах с этим префиксом
+BODY_PREFIX = '.body-'
+# Размер части большого тела при кодировании base64 (кратен 3 - части кодируются независимо)
+BODY_CHUNK_SIZE = 3 * 64 * 1024
+
+class TrafficRecorder:
+    """Запись вебхуков в фоновом потоке; в пути запроса только постановка в очередь"""
+    
+    def __init__(self, record_dir: str = None):
+        if record_dir is None:
+            record_dir = os.getenv('TRAFFIC_RECORD_DIR', '')
+        
+        self.record_dir = record_dir
+        self.segment_bytes = int(os.getenv('TRAFFIC_SEGMENT_BYTES', 64 * 1024 * 1024))
+        self.segment_seconds = float(os.getenv('TRAFFIC_SEGMENT_SECONDS', 3600))
+        self.max_segments = int(os.getenv('TRAFFIC_MAX_SEGMENTS', 48))
+        
+        self.recorded = 0
+        self.dropped = 0
+        
+        self.queue_size = int(os.getenv('TRAFFIC_QUEUE_SIZE', 10000))
+        
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_pid = None
+        self._segment = None
+        self._segment_path = None
+        self._segment_size = 0
+        self._segment_opened_at = 0.0
+        
+        if self.enabled:
+            os.makedirs(self.record_dir, exist_ok=True)
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.record_dir)
+    
+    def record(self, body: bytes, headers: Optional[Dict[str, str]] = None) -> None:
+        """Постановка вебхука в очередь записи (не блокирует запрос)"""
+        if not self.enabled:
+            return
+        
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((time.time(), body, headers or {}))
+        except queue.Full:
+            self.dropped += 1
+    
+    def record_stream(self, body: IO[bytes], headers: Optional[Dict[str, str]] = None) -> None:
+        """
+        Запись большого тела без загрузки в память: тело копируется во временный файл,
+        в очередь ставится только путь к нему
+        """
+        if not self.enabled:
+            return
+        
+        self._ensure_writer()
+        received_at = time.time()
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.record_dir, prefix=BODY_PREFIX, delete=False) as f:
+                shutil.copyfileobj(body, f)
+        except Exception as e:
+            self.dropped += 1
+            logger.error(f"Ошибка записи трафика: {str(e)}")
+            return
+        
+        try:
+            self._queue.put_nowait((received_at, f.name, headers or {}))
+        except queue.Full:
+            self.dropped += 1
+            os.remove(f.name)
+    
+    def _ensure_writer(self) -> None:
+        """Запуск потока записи в текущем процессе (в том числе после fork)"""
+        if self._writer_pid == os.getpid():
+            return
+        
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            
+            # Очередь и сегмент родительского процесса в дочернем не используются
+            self._writer_pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._segment = None
+            self._writer = threading.Thread(target=self._run, name='traffic-recorder', daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+    
+    def _run(self) -> None:
+        while True:
+            try:
+                entry = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                self._flush()
+                continue
+            
+            if entry is None:
+                self._close_segment()
+                return
+            
+            try:
+                self._write(*entry)
+            except Exception as e:
+                self.dropped += 1
+                logger.error(f"Ошибка записи трафика: {str(e)}")
+    
+    def _write(self, received_at: float, body: Union[bytes, str], headers: Dict[str, str]) -> None:
+        if isinstance(body, str):
+            self._write_file(received_at, body, headers)
+            return
+        
+        record = {'ts': received_at, 'headers': headers}
+        try:
+            record['body'] = body.decode('utf-8')
+        except UnicodeDecodeError:
+            record['body_b64'] = base64.b64encode(body).decode('ascii')
+        
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        
+        if self._segment is None or self._segment_expired(received_at):
+            self._rotate()
+        
+        self._segment.write(line)
+        self._segment_size += len(line)
+        self.recorded += 1
+    
+    def _write_file(self, received_at: float, path: str, headers: Dict[str, str]) -> None:
+        """Запись тела из временного файла: base64 по частям, строка сегмента собирается без загрузки тела"""
+        try:
+            if self._segment is None or self._segment_expired(received_at):
+                self._rotate()
+            
+            # Та же строка JSON, что и у малых тел с полем body_b64
+            prefix = json.dumps({'ts': received_at, 'headers': headers}, ensure_ascii=False)[:-1]
+            written = self._segment.write(f'{prefix}, "body_b64": "'.encode('utf-8'))
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(BODY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += self._segment.write(base64.b64encode(chunk))
+            written += self._segment.write(b'"}\n')
+            
+            self._segment_size += written
+            self.recorded += 1
+        finally:
+            os.remove(path)
+    
+    def _segment_expired(self, now: float) -> bool:
+        return (self._segment_size >= self.segment_bytes
+                or now - self._segment_opened_at >= self.segment_seconds)
+    
+    def _rotate(self) -> None:
+        """Закрытие текущего сегмента и открытие нового"""
+        self._close_segment()
+        
+        stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+        name = f"{SEGMENT_PREFIX}{stamp}-{os.getpid()}-{time.time_ns() % 10**9:09d}{SEGMENT_SUFFIX}"
+        self._segment_path = os.path.join(self.record_dir, name)
+        self._segment = gzip.open(self._segment_path, 'ab', compresslevel=5)
+        self._segment_size = 0
+        self._segment_opened_at = time.time()
+        
+        self._prune()
+    
+    def _prune(self) -> None:
+        """Удаление самых старых сегментов сверх TRAFFIC_MAX_SEGMENTS"""
+        if self.max_segments <= 0:
+            return
+        
+        segments = sorted(
+            name for name in os.listdir(self.record_dir)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        for name in segments[:-self.max_segments]:
+            try:
+                os.remove(os.path.join(self.record_dir, name))
+            except FileNotFoundError:
+                pass
+    
+    def _flush(self) -> None:
+        if self._segment is not None:
+            self._segment.flush()
+    
+    def _close_segment(self) -> None:
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+    
+    def close(self) -> None:
+        """Дозапись очереди и закрытие сегмента"""
+        if self._writer_pid != os.getpid() or not self._writer.is_alive():
+            return
+        self._queue.put(None)
+        self._writer.join(timeout=5.0)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'recorded': self.recorded,
+            'dropped': self.dropped,
+            'queued': self._queue.qsize()
+        }
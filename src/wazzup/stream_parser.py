@@ -0,0 +1,128 @@
+"""
+Потоковый разбор тела вебхука Wazzup
+Читает JSON по частям и отдает элементы массивов messages/statuses по одному,
+не загружая весь документ в память
+"""
+
+import json
+import codecs
+from typing import IO, Iterator, Tuple, Any, Iterable
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+STREAMED_KEYS = ('messages', 'statuses')
+NUMBER_START = '-0123456789'
+NUMBER_END = ',]}: \t\r\n'
+
+class WebhookStreamParser:
+    """Инкрементальный разбор объекта верхнего уровня с массивами событий"""
+    
+    def __init__(self, stream: IO[bytes], keys: Iterable[str] = STREAMED_KEYS,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.stream = stream
+        self.keys = set(keys)
+        self.chunk_size = chunk_size
+        
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+    
+    def _fill(self) -> bool:
+        """Дочитывание следующей части потока; False, если поток закончился"""
+        if self._eof:
+            return False
+        
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self._eof = True
+            self._buf += self._text_decoder.decode(b'', final=True)
+            return False
+        
+        # Обработанная часть буфера отбрасывается
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        self._buf += self._text_decoder.decode(chunk)
+        return True
+    
+    def _peek(self) -> str:
+        """Следующий значимый символ (пробелы пропускаются)"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError('Неожиданный конец JSON')
+    
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(f"Ожидался символ из '{chars}', получен '{char}' (позиция {self._pos})")
+        self._pos += 1
+        return char
+    
+    def _value(self) -> Any:
+        """Разбор одного значения JSON с дочитыванием потока при необходимости"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            
+            # Число считается законченным, только если за ним идет разделитель: часть может
+            # оборваться внутри дробной части или экспоненты ("6.02|e23"), и начало разберется как число
+            if self._buf[self._pos] in NUMBER_START and (end >= len(self._buf) or self._buf[end] not in NUMBER_END):
+                if self._fill():
+                    continue
+            
+            self._pos = end
+            return value
+    
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        """Пары (ключ массива, элемент) в порядке следования в документе"""
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            self._expect_end()
+            return
+        
+        while True:
+            key = self._value()
+            self._expect(':')
+            
+            if key in self.keys and self._peek() == '[':
+                self._pos += 1
+                if self._peek() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield key, self._value()
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                # Прочие поля верхнего уровня не нужны для доставки
+                self._value()
+            
+            if self._expect(',}') == '}':
+                self._expect_end()
+                return
+    
+    def _expect_end(self) -> None:
+        """После объекта верхнего уровня допускаются только пробелы"""
+        try:
+            char = self._peek()
+        except ValueError:
+            return
+        raise ValueError(f"Лишние данные после JSON: '{char}' (позиция {self._pos})")
+
+def iter_webhook_events(stream: IO[bytes], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[str, Any]]:
+    """
+    Элементы массивов messages и statuses из потока тела вебхука
+    Некорректный или обрезанный JSON - ValueError (в том числе после уже выданных элементов)
+    """
+    return iter(WebhookStreamParser(stream, chunk_size=chunk_size))
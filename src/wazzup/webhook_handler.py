@@ -8,8 +8,11 @@ import json
 import hashlib
 import hmac
 import logging
+import tempfile
 from datetime import datetime
-from typing import Dict, Optional, Any, List
+from typing import Dict, Optional, Any, List, Iterator, IO
+
+from src.wazzup.stream_parser import iter_webhook_events
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +22,8 @@ class WazzupWebhookHandler:
     def __init__(self):
         self.webhook_secret = os.getenv('WAZZUP_WEBHOOK_SECRET', '')
         self.api_key = os.getenv('WAZZUP_API_KEY', '')
+        self.stream_chunk_size = int(os.getenv('WEBHOOK_STREAM_CHUNK_SIZE', 64 * 1024))
+        self.stream_memory_limit = int(os.getenv('WEBHOOK_STREAM_MEMORY_LIMIT', 1024 * 1024))
     
     def validate_webhook(self, request) -> bool:
         """
@@ -62,28 +67,86 @@ class WazzupWebhookHandler:
         Обработка вебхука от Wazzup
         Возвращает список структурированных данных для отправки в Podio
         """
+        return list(self.iter_webhook(data))
+    
+    def iter_webhook(self, data: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Обработка разобранного вебхука с выдачей событий по одному"""
         try:
-            processed_items = []
-            
             # Обработка сообщений
             if 'messages' in data:
                 for message in data['messages']:
                     processed_message = self._process_message(message)
                     if processed_message:
-                        processed_items.append(processed_message)
+                        yield processed_message
             
             # Обработка статусов
             if 'statuses' in data:
                 for status in data['statuses']:
                     processed_status = self._process_status(status)
                     if processed_status:
-                        processed_items.append(processed_status)
-            
-            return processed_items
+                        yield processed_status
         
         except Exception as e:
             logger.error(f"Ошибка обработки вебхука: {str(e)}")
-            return []
+    
+    def process_webhook_stream(self, stream: IO[bytes]) -> Iterator[Dict[str, Any]]:
+        """
+        Потоковая обработка тела вебхука
+        Тело разбирается по частям, события выдаются по мере разбора,
+        поэтому память не зависит от размера пачки
+        Некорректный или обрезанный JSON - ValueError: вебхук нельзя считать принятым
+        """
+        try:
+            for key, element in iter_webhook_events(stream, self.stream_chunk_size):
+                if key == 'messages':
+                    processed_item = self._process_message(element)
+                else:
+                    processed_item = self._process_status(element)
+                
+                if processed_item:
+                    yield processed_item
+        
+        except Exception as e:
+            logger.error(f"Ошибка потоковой обработки вебхука: {str(e)}")
+            raise
+    
+    def count_stream_events(self, stream: IO[bytes]) -> int:
+        """Проверка тела потоковым разбором без обработки событий; ValueError при некорректном JSON"""
+        return sum(1 for _ in iter_webhook_events(stream, self.stream_chunk_size))
+    
+    def buffer_body(self, stream: IO[bytes], signature: str) -> Optional[IO[bytes]]:
+        """
+        Буферизация тела запроса во временный файл с проверкой подписи
+        Возвращает файл, открытый на начале, или None при неверной подписи
+        """
+        body = tempfile.SpooledTemporaryFile(max_size=self.stream_memory_limit)
+        digest = hmac.new(self.webhook_secret.encode('utf-8'), digestmod=hashlib.sha256) if self.webhook_secret else None
+        
+        try:
+            while True:
+                chunk = stream.read(self.stream_chunk_size)
+                if not chunk:
+                    break
+                body.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+            
+            body.seek(0)
+            
+            if digest is None:
+                logger.warning("WAZZUP_WEBHOOK_SECRET не настроен, пропускаем валидацию")
+                return body
+            
+            if not signature:
+                logger.error("Отсутствует заголовок X-Wazzup-Signature")
+            elif hmac.compare_digest(signature, digest.hexdigest()):
+                return body
+        
+        except Exception as e:
+            logger.error(f"Ошибка чтения тела вебхука: {str(e)}")
+        
+        body.close()
+        return None
     
     def _process_message(self, message_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Обработка отдельного сообщения"""
@@ -0,0 +1,63 @@
+"""
+Тесты контроля допуска: возраст очереди спула и учет работы в процессе
+"""
+
+import os
+import json
+import time
+
+from src.delivery.admission import AdmissionController, ACCEPT, REJECT
+from src.delivery.spool import WebhookSpool
+
+def age_webhook(spool, name, seconds):
+    """Сдвиг времени приема вебхука в прошлое (имя файла и время изменения)"""
+    received_ns = time.time_ns() - int(seconds * 1e9)
+    aged = f"{received_ns:020d}-{name.split('-', 1)[1]}"
+    path = os.path.join(spool.spool_dir, 'incoming', aged)
+    os.replace(os.path.join(spool.spool_dir, 'incoming', name), path)
+    os.utime(path, (received_ns / 1e9, received_ns / 1e9))
+    return aged
+
+def test_retry_waiting_webhook_does_not_shed(tmp_path):
+    spool = WebhookSpool(str(tmp_path / 'spool'))
+    controller = AdmissionController(max_in_flight=0, max_backlog_age=30)
+    controller.add_backlog_source('spool', spool.oldest_age)
+    
+    age_webhook(spool, spool.put(json.dumps({'messages': []}).encode('utf-8')), 120)
+    record = spool.claim_next()
+    assert spool.retry(record, [{'message_id': 'm1'}])
+    
+    # Вебхук ждет повторной попытки: очередь для контроля допуска пуста
+    assert spool.oldest_age() == 0.0
+    decision = controller.decide()
+    assert decision['action'] == ACCEPT
+    controller.release(decision['token'])
+
+def test_backlog_age_counts_claimable_webhooks(tmp_path):
+    spool = WebhookSpool(str(tmp_path / 'spool'))
+    controller = AdmissionController(max_in_flight=0, max_backlog_age=30, shed_mode=REJECT)
+    controller.add_backlog_source('spool', spool.oldest_age)
+    
+    age_webhook(spool, spool.put(json.dumps({'messages': []}).encode('utf-8')), 60)
+    spool.put(json.dumps({'messages': []}).encode('utf-8'))
+    
+    assert 59 < spool.oldest_age() < 62
+    assert controller.decide() == {'action': REJECT, 'reason': 'backlog_age', 'token': None}
+
+def test_in_flight_counts_delivery_work():
+    controller = AdmissionController(max_in_flight=4, max_backlog_age=0)
+    pending = [3]
+    controller.add_load_source('lanes', lambda: pending[0])
+    
+    # Один поток запроса и три события в полосах - лимит еще не достигнут
+    decision = controller.decide()
+    assert decision['action'] == ACCEPT
+    assert controller.decide() == {'action': REJECT, 'reason': 'in_flight', 'token': None}
+    
+    controller.release(decision['token'])
+    pending[0] = 4
+    assert controller.decide()['reason'] == 'in_flight'
+    
+    pending[0] = 0
+    assert controller.decide()['action'] == ACCEPT
+    assert controller.get_stats()['in_flight_requests'] == 1
@@ -0,0 +1,160 @@
+"""
+Тесты полос доставки: переполнение полос и изоляция приложений Podio в общих потоках доставки
+"""
+
+import json
+import time
+import threading
+
+import pytest
+
+from src.podio.router import PodioRouter
+from src.delivery.pipeline import DeliveryPipeline
+from src.delivery.lanes import LaneScheduler
+from src.storage.item_map import MessageItemMap
+
+class GatedPipeline:
+    """Доставка с записью порядка; пока gate закрыт, потоки доставки ждут"""
+    
+    def __init__(self):
+        self.gate = threading.Event()
+        self.delivered = []
+        self.lock = threading.Lock()
+    
+    def app_for(self, item):
+        return 'default'
+    
+    def has_capacity(self, app_name, in_use):
+        return True
+    
+    def deliver(self, item):
+        self.gate.wait(5)
+        with self.lock:
+            self.delivered.append(item['message_id'])
+        return {'message_id': item['message_id']}
+
+def status(message_id, chat_id='chat'):
+    return {'event_type': 'status_update', 'message_id': message_id, 'chat_id': chat_id, 'status': 'read'}
+
+@pytest.fixture
+def router(tmp_path):
+    config = {
+        'default': 'healthy',
+        'apps': {
+            'slow': {'app_id': '1', 'app_token': 'slow-token', 'max_concurrency': 1, 'delivery_mode': 'embedded'},
+            'healthy': {'app_id': '2', 'app_token': 'healthy-token', 'max_concurrency': 4, 'delivery_mode': 'embedded'}
+        },
+        'routes': [{'channel_id': 'slow-channel', 'app': 'slow'}]
+    }
+    path = tmp_path / 'routing.json'
+    path.write_text(json.dumps(config), encoding='utf-8')
+    return PodioRouter(str(path))
+
+def fake_podio(client, latency):
+    """Ответ Podio с задержкой вместо сетевого запроса"""
+    counter = iter(range(1, 1000))
+    lock = threading.Lock()
+    
+    def send_request(method, endpoint, data=None):
+        time.sleep(latency)
+        with lock:
+            return {'item_id': next(counter)}, 200
+    
+    client._send_request = send_request
+
+def message(message_id, channel_id):
+    return {'event_type': 'message', 'message_id': message_id, 'chat_id': f'chat-{message_id}',
+            'channel_id': channel_id, 'text': message_id}
+
+def test_saturated_app_does_not_delay_other_app(router, tmp_path):
+    fake_podio(router.get_client('slow'), 1.0)
+    fake_podio(router.get_client('healthy'), 0.01)
+    pipeline = DeliveryPipeline(router, MessageItemMap(str(tmp_path / 'map.db')))
+    scheduler = LaneScheduler(pipeline, workers=4, max_wait=30, max_depth=100)
+    
+    slow = [scheduler.submit(message(f'a{index}', 'slow-channel')) for index in range(6)]
+    time.sleep(0.1)
+    
+    started = time.monotonic()
+    healthy = scheduler.submit(message('b1', 'healthy-channel'))
+    assert healthy.result(timeout=5)['item_id']
+    # Слот медленного приложения один: остальные потоки свободны для другого приложения
+    assert time.monotonic() - started < 0.5
+    
+    stats = router.get_client('slow').get_stats()['concurrency']
+    assert stats['in_flight'] <= 1
+    assert stats['rejected'] == 0
+    
+    assert scheduler.drain(timeout=10)
+    assert all(future.result(timeout=1) for future in slow)
+
+def test_overflow_is_reported_not_dropped():
+    pipeline = GatedPipeline()
+    scheduler = LaneScheduler(pipeline, workers=1, max_wait=30, max_depth=1)
+    
+    # Поток доставки занят первым событием, второе заполняет полосу, остальные в нее не помещаются
+    scheduler.submit(status('s0', 'busy'))
+    time.sleep(0.1)
+    results, queued, dropped = scheduler.deliver_batch([status('s1'), status('s2'), status('s3')])
+    assert (results, queued, dropped) == ([], 1, 2)
+    assert scheduler.lanes['receipts'].rejected == 2
+    
+    # С spill не принятые события сохраняются и считаются поставленными в очередь
+    spilled = []
+    scheduler.set_spill(lambda items: spilled.extend(items) or True)
+    results, queued, dropped = scheduler.deliver_batch([status('s4'), status('s5')])
+    assert (queued, dropped) == (2, 0)
+    assert [item['message_id'] for item in spilled] == ['s4', 's5']
+    
+    pipeline.gate.set()
+    assert scheduler.drain(timeout=5)
+    assert pipeline.delivered == ['s0', 's1']
+
+def test_closed_scheduler_spills_submitted_batch():
+    pipeline = GatedPipeline()
+    pipeline.gate.set()
+    scheduler = LaneScheduler(pipeline, workers=1, max_wait=30, max_depth=10)
+    assert scheduler.close(timeout=1) == 0
+    
+    assert scheduler.deliver_batch([status('s1')]) == ([], 0, 1)
+    scheduler.set_spill(lambda items: True)
+    assert scheduler.deliver_batch([status('s1')]) == ([], 1, 0)
+
+def test_chat_order_is_kept_across_lanes():
+    pipeline = GatedPipeline()
+    scheduler = LaneScheduler(pipeline, workers=4, max_wait=30, max_depth=100)
+    
+    # Статус пришел первым: входящее и эхо того же чата ждут его, несмотря на больший вес своих полос
+    events = [
+        status('c1', 'chat'),
+        {'event_type': 'message', 'message_id': 'c2', 'chat_id': 'chat'},
+        {'event_type': 'message', 'message_id': 'c3', 'chat_id': 'chat', 'direction': 'outbound'},
+        {'event_type': 'message', 'message_id': 'c4', 'chat_id': 'chat'},
+        {'event_type': 'message', 'message_id': 'other', 'chat_id': 'other'}
+    ]
+    for event in events:
+        scheduler.submit(event)
+    time.sleep(0.1)
+    assert len(scheduler._in_flight) == 2
+    
+    pipeline.gate.set()
+    assert scheduler.drain(timeout=5)
+    assert [message_id for message_id in pipeline.delivered if message_id != 'other'] == ['c1', 'c2', 'c3', 'c4']
+
+def test_waiting_receipt_is_picked_before_heavier_lane():
+    pipeline = GatedPipeline()
+    scheduler = LaneScheduler(pipeline, workers=1, max_wait=0.2, max_depth=100)
+    
+    # Поток доставки занят, статус ждет дольше max_wait, входящие поставлены только что
+    scheduler.submit({'event_type': 'message', 'message_id': 'm0', 'chat_id': 'busy'})
+    time.sleep(0.05)
+    scheduler.submit(status('s1', 'receipt-chat'))
+    time.sleep(0.3)
+    for index in range(1, 6):
+        scheduler.submit({'event_type': 'message', 'message_id': f'm{index}', 'chat_id': f'chat-{index}'})
+    
+    pipeline.gate.set()
+    assert scheduler.drain(timeout=5)
+    assert pipeline.delivered[:2] == ['m0', 's1']
+    assert scheduler.lanes['receipts'].starvation_picks == 1
+    assert scheduler.lanes['inbound'].starvation_picks == 0
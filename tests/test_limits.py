@@ -0,0 +1,105 @@
+"""
+Тесты ограничителей Podio: устойчивый лимит одновременных запросов, реакция на рост задержки и троттлинг
+"""
+
+import pytest
+
+from src.podio import limits
+from src.podio.limits import AdaptiveLimiter, RateBudget
+from src.podio.client import PodioClient
+
+class FakeClock:
+    """Время модуля ограничителей, которое двигает сам тест"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def monotonic(self):
+        return self.now
+    
+    def sleep(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(limits, 'time', fake)
+    return fake
+
+def run(limiter, clock, calls):
+    """Последовательные запросы: (вид, задержка, результат); возвращает минимальный лимит после разгона"""
+    lowest = limiter.ceiling
+    for index, (kind, latency, outcome) in enumerate(calls):
+        assert limiter.acquire()
+        clock.now += latency
+        limiter.release(latency, outcome, kind)
+        if index >= 50:
+            lowest = min(lowest, int(limiter.limit))
+    return lowest
+
+def healthy_calls(count):
+    calls = []
+    for index in range(count):
+        if index % 10 == 9:
+            calls.append(('GET /item/{id}', 0.02, 'client_error'))
+        elif index % 2:
+            calls.append(('POST /comment/item/{id}/', 0.06, 'ok'))
+        else:
+            calls.append(('POST /item/app/{id}/', 0.15, 'ok'))
+    return calls
+
+def test_healthy_mixed_endpoints_reach_ceiling(clock):
+    limiter = AdaptiveLimiter(floor=1, ceiling=8, initial=4)
+    
+    # Разные виды запросов и быстрые 404 не принимаются за рост задержки
+    assert run(limiter, clock, healthy_calls(600)) == 8
+    assert limiter.get_stats()['client_errors'] == 60
+
+def test_latency_growth_lowers_limit(clock):
+    limiter = AdaptiveLimiter(floor=1, ceiling=8, initial=8)
+    run(limiter, clock, healthy_calls(100))
+    
+    slow = [('POST /item/app/{id}/', 0.6, 'ok')] * 40
+    run(limiter, clock, slow)
+    assert limiter.limit < 8
+
+def test_throttling_halves_limit(clock):
+    limiter = AdaptiveLimiter(floor=1, ceiling=8, initial=8)
+    assert limiter.acquire()
+    limiter.release(0.1, 'throttled', 'POST /item/app/{id}/')
+    assert int(limiter.limit) == 4
+    assert limiter.get_stats()['throttled'] == 1
+
+def test_acquire_times_out_when_saturated():
+    limiter = AdaptiveLimiter(floor=1, ceiling=1, timeout=0.05)
+    assert limiter.acquire()
+    assert not limiter.acquire()
+    assert limiter.get_stats()['rejected'] == 1
+    
+    limiter.release(0.01, 'ok')
+    assert limiter.acquire()
+
+def test_rate_budget_rejects_without_waiting(clock):
+    budget = RateBudget(rate_per_hour=3600, burst=1)
+    assert budget.acquire(timeout=0.5)
+    # Следующий запрос появится через секунду - ждать полсекунды бесполезно
+    assert not budget.acquire(timeout=0.5)
+    assert clock.now == 1000.0
+    assert budget.acquire(timeout=2)
+    assert clock.now == pytest.approx(1001.0)
+
+def test_exhausted_budget_returns_slot(monkeypatch):
+    monkeypatch.setenv('PODIO_ACQUIRE_TIMEOUT', '0.1')
+    client = PodioClient(app_id='1', app_token='token', rate_limit_per_hour=1)
+    sent = []
+    client._send_request = lambda method, endpoint, data=None: sent.append(endpoint) or ({'item_id': 1}, 200)
+    
+    assert client._make_request('POST', '/item/app/1/', {}) == {'item_id': 1}
+    # Бюджет исчерпан: запрос отклоняется без отправки, занятый слот освобождается без учета задержки
+    assert client._make_request('POST', '/item/app/1/', {}) is None
+    assert sent == ['/item/app/1/']
+    
+    stats = client.concurrency.get_stats()
+    assert stats['in_flight'] == 0
+    assert stats['errors'] == 0
+    assert client.rate_budget.rejected == 1
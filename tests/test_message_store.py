@@ -0,0 +1,36 @@
+"""
+Тесты локального хранилища сообщений: очистка по сроку хранения
+"""
+
+import time
+import threading
+
+from src.storage.message_store import MessageStore
+
+def message(message_id, timestamp):
+    return {'event_type': 'message', 'message_id': message_id, 'chat_id': 'chat',
+            'timestamp': timestamp, 'message_text': message_id}
+
+def test_compaction_runs_outside_request_thread(tmp_path):
+    store = MessageStore(str(tmp_path / 'messages.db'), retention_days=1)
+    compacted = threading.Event()
+    threads = []
+    compact = store.compact
+    
+    def recording_compact(*args, **kwargs):
+        threads.append(threading.current_thread())
+        removed = compact(*args, **kwargs)
+        compacted.set()
+        return removed
+    
+    store.compact = recording_compact
+    assert store.add_events([message('old', '2000-01-01T00:00:00'), message('new', '2100-01-01T00:00:00')]) == 2
+    
+    assert compacted.wait(5)
+    assert threading.current_thread() not in threads
+    assert store.get_stats()['messages'] == 1
+    
+    # Поток очистки один на процесс
+    store.add_events([message('next', '2100-01-01T00:00:01')])
+    time.sleep(0.1)
+    assert len(threads) == 1
@@ -0,0 +1,37 @@
+"""
+Тесты профилирования: лимит каталога профилей
+"""
+
+import pytest
+
+from src.utils.profiling import ProfilingController
+
+def profiled_request(controller):
+    token = controller.start_request('test')
+    with controller.stage('parse'):
+        sum(range(1000))
+    with controller.stage('store'):
+        sum(range(1000))
+    controller.finish_request(token)
+    return token is not None
+
+def test_profiling_stops_at_file_limit(tmp_path, monkeypatch):
+    monkeypatch.setenv('PROFILING_MAX_FILES', '10')
+    controller = ProfilingController(str(tmp_path))
+    controller.enable(100)
+    
+    # Запрос пишет по три файла на этап: после второго запроса лимит достигнут
+    assert [profiled_request(controller) for _ in range(5)] == [True, True, False, False, False]
+    stats = controller.get_stats()
+    assert not stats['active']
+    assert stats['files'] == 12
+    assert not (tmp_path / 'profiling.json').exists()
+
+def test_enable_refused_when_directory_full(tmp_path, monkeypatch):
+    monkeypatch.setenv('PROFILING_MAX_BYTES', '100')
+    (tmp_path / 'old.prof').write_bytes(b'x' * 100)
+    controller = ProfilingController(str(tmp_path))
+    
+    with pytest.raises(ValueError):
+        controller.enable(100)
+    assert not controller.get_stats()['active']
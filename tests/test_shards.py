@@ -0,0 +1,205 @@
+"""
+Тесты шардирования доставки: аренды шардов, перераспределение и порядок вебхуков
+"""
+
+import os
+import json
+import time
+import threading
+
+import pytest
+
+from src.delivery.spool import WebhookSpool
+from src.delivery.shards import ShardLeases, ShardWorker, shard_for, owner_for
+
+class FakeHandler:
+    """Разбор вебхука: тело теста уже содержит готовые события"""
+    
+    def process_webhook(self, data):
+        return data['items']
+
+class FakePipeline:
+    """Доставка с записью порядка событий"""
+    
+    def __init__(self):
+        self.delivered = []
+    
+    def deliver_in_order(self, items):
+        self.delivered.extend(item['message_id'] for item in items)
+        return len(items)
+    
+    def close(self):
+        pass
+
+@pytest.fixture
+def spool(tmp_path):
+    return WebhookSpool(str(tmp_path / 'spool'))
+
+def make_worker(spool, worker_id, shard_count=8):
+    return ShardWorker(spool, FakeHandler(), FakePipeline(), worker_id=worker_id,
+                       shard_count=shard_count, lease_ttl=30, threads=2)
+
+def write_lease(leases, shard, owner, expires_at):
+    with open(leases._lease_path(shard), 'w', encoding='utf-8') as f:
+        json.dump({'owner': owner, 'expires_at': expires_at}, f)
+
+def read_lease(leases, shard):
+    with open(leases._lease_path(shard), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def put_webhook(spool, chat_id, *message_ids):
+    items = [{'message_id': message_id, 'chat_id': chat_id} for message_id in message_ids]
+    return spool.put(json.dumps({'items': items}).encode('utf-8'))
+
+def test_acquire_expired_lease(tmp_path):
+    leases = ShardLeases(str(tmp_path), 'b', shard_count=4, ttl=30)
+    write_lease(leases, 1, 'a', time.time() - 1)
+    
+    assert leases.acquire(1)
+    assert 1 in leases.owned_shards()
+    lease = read_lease(leases, 1)
+    assert lease['owner'] == 'b'
+    assert lease['expires_at'] > time.time()
+    # Временные файлы перехвата не остаются
+    assert sorted(os.listdir(tmp_path / 'leases')) == ['0001.lease']
+
+def test_live_lease_is_not_taken(tmp_path):
+    leases = ShardLeases(str(tmp_path), 'b', shard_count=4, ttl=30)
+    write_lease(leases, 1, 'a', time.time() + 30)
+    
+    assert not leases.acquire(1)
+    assert read_lease(leases, 1)['owner'] == 'a'
+    assert leases.owned_shards() == set()
+
+@pytest.mark.parametrize('expired', [True, False], ids=['expired', 'missing'])
+def test_two_workers_contend_for_one_shard(tmp_path, expired):
+    for _ in range(50):
+        root = tmp_path / f'round-{time.time_ns()}'
+        contenders = [ShardLeases(str(root), worker_id, shard_count=1, ttl=30) for worker_id in ('a', 'b')]
+        if expired:
+            write_lease(contenders[0], 0, 'gone', time.time() - 1)
+        
+        start = threading.Barrier(len(contenders))
+        results = {}
+        
+        def contend(leases):
+            start.wait()
+            results[leases.worker_id] = leases.acquire(0)
+        
+        threads = [threading.Thread(target=contend, args=(leases,)) for leases in contenders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        winners = [worker_id for worker_id, acquired in results.items() if acquired]
+        assert len(winners) == 1
+        assert read_lease(contenders[0], 0)['owner'] == winners[0]
+
+def test_rebalance_surrenders_shards_to_new_worker(spool):
+    first = make_worker(spool, 'a')
+    second = make_worker(spool, 'b')
+    try:
+        first.leases.renew()
+        first.rebalance()
+        assert first.leases.owned_shards() == set(range(8))
+        
+        # Появился второй обработчик: ему переходят только шарды, которые он получает по хешу
+        second.leases.renew()
+        expected = {shard for shard in range(8) if owner_for(shard, ['a', 'b']) == 'b'}
+        assert expected
+        
+        # Пока первый владеет шардами, второй их не получает
+        second.rebalance()
+        assert second.leases.owned_shards() == set()
+        
+        first.rebalance()
+        second.rebalance()
+        assert first.leases.owned_shards() == set(range(8)) - expected
+        assert second.leases.owned_shards() == expected
+    finally:
+        first.executor.shutdown()
+        second.executor.shutdown()
+
+def test_busy_shard_is_surrendered_after_current_file(tmp_path):
+    first = ShardLeases(str(tmp_path), 'a', shard_count=8, ttl=30)
+    first.renew()
+    for shard in range(8):
+        assert first.acquire(shard)
+    
+    moving = next(shard for shard in range(8) if owner_for(shard, ['a', 'b']) == 'b')
+    assert first.begin(moving)
+    
+    second = ShardLeases(str(tmp_path), 'b', shard_count=8, ttl=30)
+    second.renew()
+    
+    # Фоновое продление не отдает шард посреди доставки файла, но новых файлов он уже не начинает
+    first.renew()
+    assert moving in first.owned_shards()
+    assert not second.acquire(moving)
+    
+    first.end(moving)
+    assert not first.begin(moving)
+    first.renew()
+    assert moving not in first.owned_shards()
+    assert second.acquire(moving)
+
+def test_ready_files_stop_at_oldest_pending_webhook(spool):
+    worker = make_worker(spool, 'a', shard_count=1)
+    try:
+        older = put_webhook(spool, 'chat', 'm1')
+        newer = put_webhook(spool, 'chat', 'm2')
+        assert older < newer
+        
+        # Старший вебхук захвачен другим обработчиком и еще не разбит на шарды
+        claimed = spool.claim_next()
+        assert claimed['name'] == older
+        assert worker.split_pending() == 1
+        assert spool.oldest_pending() == older
+        
+        assert worker._ready_files(0, spool.oldest_pending()) == []
+        assert worker._ready_files(0, None) == [newer]
+    finally:
+        worker.executor.shutdown()
+
+def test_run_once_keeps_chat_order_behind_barrier(spool):
+    worker = make_worker(spool, 'a', shard_count=4)
+    try:
+        older = put_webhook(spool, 'chat', 'm1', 'm2')
+        put_webhook(spool, 'chat', 'm3')
+        
+        # Другой обработчик захватил старший вебхук: младший разбивается, но не доставляется раньше него
+        spool.claim_next()
+        assert worker.run_once() == 0
+        assert worker.pipeline.delivered == []
+        
+        # Захват вернулся в очередь (обработчик пропал) - оба вебхука доставляются по порядку
+        os.replace(os.path.join(spool.spool_dir, 'processing', older),
+                   os.path.join(spool.spool_dir, 'incoming', older))
+        assert worker.run_once() == 2
+        assert worker.pipeline.delivered == ['m1', 'm2', 'm3']
+        assert spool.oldest_pending() is None
+        assert worker.pending_files() == 0
+    finally:
+        worker.stop()
+
+def test_shard_for_is_stable():
+    assert shard_for('chat', 64) == shard_for('chat', 64)
+    assert 0 <= shard_for('chat', 64) < 64
+
+def test_large_webhook_is_split_into_ordered_parts(spool):
+    worker = make_worker(spool, 'a', shard_count=1)
+    worker.file_max_items = 2
+    try:
+        name = put_webhook(spool, 'chat', 'm1', 'm2', 'm3', 'm4', 'm5')
+        put_webhook(spool, 'chat', 'm6')
+        assert worker.split_pending() == 2
+        
+        files = worker._ready_files(0, None)
+        assert files[:3] == [name, f'{name}.0001', f'{name}.0002']
+        assert len(files) == 4
+        
+        assert worker.run_once() == 4
+        assert worker.pipeline.delivered == ['m1', 'm2', 'm3', 'm4', 'm5', 'm6']
+    finally:
+        worker.stop()
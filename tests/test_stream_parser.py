@@ -0,0 +1,81 @@
+"""
+Тесты потокового разбора тела вебхука: границы частей, числа и многобайтовые символы на стыке частей
+"""
+
+import io
+import json
+
+import pytest
+
+from src.wazzup.stream_parser import iter_webhook_events
+from src.wazzup.webhook_handler import WazzupWebhookHandler
+
+DOCUMENT = {
+    'meta': {'skip': [1, 2, {'nested': 'value'}], 'flag': True},
+    'messages': [
+        {'messageId': 'm1', 'chatId': '79000000000', 'text': 'Привет, мир', 'count': 1234567890},
+        {'messageId': 'm2', 'chatId': '79000000001', 'text': 'emoji 👍🏽 и "кавычки" \\ слеш', 'price': -12.5e3},
+        {'messageId': 'm3', 'text': '', 'items': [], 'extra': None}
+    ],
+    'statuses': [
+        {'messageId': 'm1', 'status': 'read', 'timestamp': 1700000000123}
+    ]
+}
+
+def parse(body: bytes, chunk_size: int):
+    return list(iter_webhook_events(io.BytesIO(body), chunk_size=chunk_size))
+
+def expected_events(document):
+    return [(key, element) for key in ('messages', 'statuses') for element in document.get(key, [])]
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 7, 16, 64, 1 << 16])
+def test_chunk_boundaries(chunk_size):
+    body = json.dumps(DOCUMENT, ensure_ascii=False, indent=1).encode('utf-8')
+    assert parse(body, chunk_size) == expected_events(DOCUMENT)
+
+@pytest.mark.parametrize('chunk_size', range(1, 12))
+def test_numbers_split_across_chunks(chunk_size):
+    body = b'{"messages": [1234567890, -0.000125, 6.02e23, 42],"statuses":[7]}'
+    assert parse(body, chunk_size) == [
+        ('messages', 1234567890), ('messages', -0.000125), ('messages', 6.02e23),
+        ('messages', 42), ('statuses', 7)
+    ]
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 4, 5])
+def test_multibyte_utf8_split_across_chunks(chunk_size):
+    text = 'ж€👍🏽 привет'
+    body = json.dumps({'messages': [{'text': text}]}, ensure_ascii=False).encode('utf-8')
+    assert len(body) != len(body.decode('utf-8'))
+    assert parse(body, chunk_size) == [('messages', {'text': text})]
+
+def test_empty_arrays_and_object():
+    assert parse(b'{}', 1) == []
+    assert parse(b' {"messages": [], "statuses": []} \n', 3) == []
+
+@pytest.mark.parametrize('body', [
+    b'',
+    b'not json',
+    b'[{"messages": []}]',
+    b'{"messages": [{"messageId": "m1"}, {"messageId": "m2"',
+    b'{"messages": [{"messageId": "m1"}]',
+    b'{"messages": [1, 2,]}',
+    b'{"messages": []} trailing',
+    '{"messages": [{"text": "обрезано'.encode('utf-8')[:-1]
+], ids=['empty', 'not-json', 'array', 'truncated-element', 'truncated-object',
+        'trailing-comma', 'trailing-data', 'truncated-utf8'])
+def test_malformed_body_raises(body):
+    with pytest.raises(ValueError):
+        parse(body, 4)
+
+def test_handler_reraises_after_partial_batch():
+    handler = WazzupWebhookHandler()
+    body = json.dumps({'messages': [{'messageId': 'm1', 'chatId': 'c', 'text': 'one'}]}).encode('utf-8')[:-2]
+    events = handler.process_webhook_stream(io.BytesIO(body))
+    
+    first = next(events)
+    assert first['message_id'] == 'm1'
+    with pytest.raises(ValueError):
+        next(events)
+    
+    with pytest.raises(ValueError):
+        handler.count_stream_events(io.BytesIO(body))